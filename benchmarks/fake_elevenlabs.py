@@ -0,0 +1,295 @@
+"""A local stand-in for the ElevenLabs speech-to-text API, for benchmarks and offline runs.
+
+Serves POST /v1/speech-to-text like the real endpoint, so the ElevenLabs client in
+transcribe_calls.setup_environment can be pointed at it with ELEVENLABS_BASE_URL:
+
+    python benchmarks/fake_elevenlabs.py --port 8765 --latency-ms 800 --rate-429 0.05
+    ELEVENLABS_BASE_URL=http://127.0.0.1:8765 ELEVENLABS_API_KEY=fake python transcribe_calls.py
+
+Responses are deterministic diarized transcripts: the words, speaker turns and timings
+are derived from a hash of the uploaded audio and fill its duration (read from the
+container header, or estimated from the payload size). Latency follows a configurable
+distribution, and 429 (with Retry-After) and 5xx responses are injected at configurable
+rates. GET /stats returns the request counts as JSON.
+"""
+
+import argparse
+import hashlib
+import io
+import json
+import math
+import os
+import random
+import signal
+import sys
+import threading
+import time
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from transcribe_calls import HEADER_PROBES  # noqa: E402
+
+LATENCY_DISTRIBUTIONS = ("fixed", "uniform", "lognormal")
+SERVER_ERRORS = (500, 502, 503)
+VOCABULARY = (
+    "haan", "ji", "nahi", "theek", "hai", "aapka", "order", "kab", "tak", "aayega", "main", "check",
+    "karta", "hoon", "ek", "minute", "payment", "ho", "gaya", "address", "confirm", "kijiye", "dhanyavaad",
+    "sir", "madam", "bataiye", "problem", "kya", "refund", "account", "number", "please", "hold", "kariye",
+)
+AUDIO_EVENTS = ("(laughter)", "(background noise)", "(cough)")
+
+def payload_duration(file_name, data):
+    """Seconds of audio in an uploaded payload, from its header where possible."""
+    ext = os.path.splitext(file_name or "")[1].lower()
+    probe = HEADER_PROBES.get(ext)
+    if probe:
+        try:
+            info = probe(io.BytesIO(data), len(data))
+            if info and info["duration_seconds"] > 0:
+                return info["duration_seconds"]
+        except Exception:
+            pass
+    if ext == ".flac" and data[:4] == b"fLaC" and len(data) >= 26:
+        # STREAMINFO: 20-bit sample rate, then channels, bits per sample and a 36-bit sample count
+        info = int.from_bytes(data[18:26], "big")
+        sample_rate = info >> 44
+        total_samples = info & 0xFFFFFFFFF
+        if sample_rate and total_samples:
+            return total_samples / sample_rate
+    if ext == ".ogg":
+        return len(data) * 8 / 24000  # the compact Opus bitrate
+    return len(data) / 16000  # 8 kHz 16-bit mono, the usual call recording
+
+def fake_transcript(data, duration, language_code="hin"):
+    """Build a diarized response for the audio, the same every time for the same bytes."""
+    rng = random.Random(hashlib.sha256(data).digest())
+    speakers = rng.randint(2, 3) if duration > 30 else 2
+    words = []
+    t = round(rng.uniform(0.1, 0.8), 3)
+    speaker = 0
+    while t < duration - 0.3:
+        turn_end = min(duration, t + rng.uniform(2.0, 9.0))
+        while t < turn_end - 0.2:
+            if rng.random() < 0.02:
+                word, length = rng.choice(AUDIO_EVENTS), rng.uniform(0.5, 1.5)
+                word_type = "audio_event"
+            else:
+                word, length = rng.choice(VOCABULARY), rng.uniform(0.15, 0.5)
+                word_type = "word"
+            end = round(min(turn_end, t + length), 3)
+            if words:
+                words.append({"text": " ", "type": "spacing", "start": words[-1]["end"], "end": t,
+                              "speaker_id": f"speaker_{speaker}", "logprob": 0.0})
+            words.append({"text": word, "type": word_type, "start": t, "end": end,
+                          "speaker_id": f"speaker_{speaker}", "logprob": round(-rng.random() * 0.3, 4)})
+            t = round(end + rng.uniform(0.02, 0.25), 3)
+        # Hand over to another speaker after a short pause
+        speaker = (speaker + rng.randint(1, speakers - 1)) % speakers
+        t = round(t + rng.uniform(0.2, 1.2), 3)
+    return {
+        "language_code": language_code or "hin",
+        "language_probability": 0.98,
+        "text": "".join(word["text"] for word in words),
+        "words": words,
+        "audio_duration_secs": round(duration, 3),
+    }
+
+class FakeSpeechToText:
+    """Request handling settings and counters shared by the server's threads.
+    
+    Each request takes latency_ms (scaled by the distribution) plus ms_per_audio_second
+    for every second of uploaded audio. rate_429 and rate_5xx are the fractions of
+    requests answered with a 429 (Retry-After: retry_after seconds) or a random 5xx,
+    drawn from a generator seeded with seed.
+    """
+    
+    def __init__(self, latency_ms=500.0, distribution="lognormal", jitter=0.3, ms_per_audio_second=0.0,
+                 rate_429=0.0, rate_5xx=0.0, retry_after=1.0, seed=0):
+        if distribution not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(f"Unknown latency distribution '{distribution}'. Expected one of: {', '.join(LATENCY_DISTRIBUTIONS)}")
+        self.latency_ms = latency_ms
+        self.distribution = distribution
+        self.jitter = jitter
+        self.ms_per_audio_second = ms_per_audio_second
+        self.rate_429 = rate_429
+        self.rate_5xx = rate_5xx
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "ok": 0, "429": 0, "5xx": 0, "bad_request": 0, "audio_seconds": 0.0, "bytes": 0}
+    
+    def latency_seconds(self, duration):
+        with self.lock:
+            if self.distribution == "uniform":
+                factor = self.rng.uniform(1 - self.jitter, 1 + self.jitter)
+            elif self.distribution == "lognormal":
+                # jitter is the sigma of the log; the median stays at latency_ms
+                factor = math.exp(self.rng.gauss(0, self.jitter))
+            else:
+                factor = 1.0
+        return max(0.0, (self.latency_ms * factor + self.ms_per_audio_second * duration) / 1000)
+    
+    def injected_error(self):
+        """Return the status code to fail this request with, or None."""
+        with self.lock:
+            roll = self.rng.random()
+            if roll < self.rate_429:
+                return 429
+            if roll < self.rate_429 + self.rate_5xx:
+                return self.rng.choice(SERVER_ERRORS)
+        return None
+    
+    def count(self, key, amount=1):
+        with self.lock:
+            self.stats[key] += amount
+
+class FakeRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, as the client pools its connections
+    
+    def log_message(self, format, *args):
+        pass
+    
+    def _send_json(self, status, body, headers=None):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+    
+    def _read_body(self):
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().split(b";")[0].strip(), 16)
+                if size == 0:
+                    self.rfile.readline()
+                    return b"".join(chunks)
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+        return self.rfile.read(int(self.headers.get("Content-Length", "0")))
+    
+    def do_GET(self):
+        if self.path.rstrip("/") == "/stats":
+            with self.server.fake.lock:
+                self._send_json(200, dict(self.server.fake.stats))
+        else:
+            self._send_json(404, {"detail": "Not found"})
+    
+    def do_POST(self):
+        fake = self.server.fake
+        body = self._read_body()
+        if self.path.split("?")[0].rstrip("/") != "/v1/speech-to-text":
+            self._send_json(404, {"detail": "Not found"})
+            return
+        fake.count("requests")
+        
+        message = BytesParser(policy=HTTP).parsebytes(
+            f"Content-Type: {self.headers.get('Content-Type', '')}\r\n\r\n".encode("latin-1") + body
+        )
+        fields = {}
+        file_name, data = None, None
+        for part in message.iter_parts() if message.is_multipart() else ():
+            name = part.get_param("name", header="content-disposition")
+            if name == "file":
+                file_name, data = part.get_filename(), part.get_payload(decode=True)
+            else:
+                fields[name] = part.get_payload(decode=True).decode("utf-8", "replace")
+        if not data:
+            fake.count("bad_request")
+            self._send_json(400, {"detail": {"status": "invalid_file", "message": "No audio file was uploaded"}})
+            return
+        
+        status = fake.injected_error()
+        if status == 429:
+            fake.count("429")
+            time.sleep(fake.latency_seconds(0) / 10)
+            self._send_json(429, {"detail": {"status": "too_many_concurrent_requests", "message": "Rate limited"}},
+                            {"Retry-After": f"{fake.retry_after:g}"})
+            return
+        
+        duration = payload_duration(file_name, data)
+        time.sleep(fake.latency_seconds(duration))
+        if status is not None:
+            fake.count("5xx")
+            self._send_json(status, {"detail": {"status": "server_error", "message": "Injected failure"}})
+            return
+        fake.count("ok")
+        fake.count("audio_seconds", duration)
+        fake.count("bytes", len(data))
+        self._send_json(200, fake_transcript(data, duration, fields.get("language_code")))
+
+class FakeElevenLabsServer:
+    """Runs the stand-in on a background thread: start() returns its base URL."""
+    
+    def __init__(self, fake=None, host="127.0.0.1", port=0):
+        self.fake = fake or FakeSpeechToText()
+        self.httpd = ThreadingHTTPServer((host, port), FakeRequestHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.fake = self.fake
+        self.thread = None
+    
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+    
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True, name="fake-elevenlabs")
+        self.thread.start()
+        return self.base_url
+    
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+def add_fake_arguments(parser):
+    """Add the stand-in's settings to an argparse parser (shared with run_benchmarks)."""
+    parser.add_argument("--latency-ms", type=float, default=500, help="Median time per request (default: 500)")
+    parser.add_argument("--latency-distribution", choices=LATENCY_DISTRIBUTIONS, default="lognormal")
+    parser.add_argument("--jitter", type=float, default=0.3,
+                        help="Spread: sigma of the log for lognormal, +/- fraction for uniform (default: 0.3)")
+    parser.add_argument("--ms-per-audio-second", type=float, default=0.0,
+                        help="Extra time per second of uploaded audio (default: 0)")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="Fraction of requests rate limited")
+    parser.add_argument("--rate-5xx", type=float, default=0.0, help="Fraction of requests failed with a 5xx")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds sent with 429s")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for latencies and injected errors")
+
+def fake_from_args(args):
+    return FakeSpeechToText(
+        latency_ms=args.latency_ms,
+        distribution=args.latency_distribution,
+        jitter=args.jitter,
+        ms_per_audio_second=args.ms_per_audio_second,
+        rate_429=args.rate_429,
+        rate_5xx=args.rate_5xx,
+        retry_after=args.retry_after,
+        seed=args.seed,
+    )
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve a local stand-in for the ElevenLabs speech-to-text API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    add_fake_arguments(parser)
+    args = parser.parse_args(argv)
+    
+    server = FakeElevenLabsServer(fake_from_args(args), args.host, args.port)
+    signal.signal(signal.SIGTERM, signal.default_int_handler)  # Stop on SIGTERM as on Ctrl-C, printing the stats
+    print(f"Fake ElevenLabs speech-to-text listening on {server.base_url} (set ELEVENLABS_BASE_URL to this)")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+        print(json.dumps(server.fake.stats))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,232 @@
+"""End-to-end benchmarks of transcribe_calls.py against the local ElevenLabs stand-in.
+
+For each corpus size a synthetic corpus of call recordings is generated (and reused on
+later runs), the fake server from fake_elevenlabs.py is started, and `transcribe_calls.py
+run` is timed as a subprocess in a fresh output folder, with ELEVENLABS_BASE_URL pointing
+at the fake. No API credits or network are needed.
+
+    python benchmarks/run_benchmarks.py --sizes 25,100,400 --latency-ms 800 --rate-429 0.02
+
+Reported per run: files/sec, audio-seconds/sec, peak RSS of the largest process and
+checkpoint overhead (time spent persisting batches, from the run's events file), plus
+the fake's request and error counts. Settings of the run itself (MAX_CONCURRENCY,
+BATCH_SIZE, PAYLOAD_STRATEGY, RESULT_STORE, ...) are taken from the environment, so
+the same corpus can be compared across configurations; --json appends the results to
+a file for tracking regressions.
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import wave
+
+import numpy as np
+
+from fake_elevenlabs import FakeElevenLabsServer, add_fake_arguments, fake_from_args
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPT = os.path.join(REPO_ROOT, "transcribe_calls.py")
+
+def synth_call(rng, seconds, sample_rate=8000):
+    """Two alternating voice-like talkers with pauses and line noise, as 16-bit samples."""
+    samples = np.zeros(int(seconds * sample_rate), dtype=np.float32)
+    t = 0.0
+    speaker = 0
+    while t < seconds:
+        turn = rng.uniform(1.5, 8.0)
+        start, end = int(t * sample_rate), int(min(seconds, t + turn) * sample_rate)
+        time_axis = np.arange(end - start) / sample_rate
+        pitch = (120 if speaker == 0 else 210) * rng.uniform(0.9, 1.1)
+        # A few harmonics, amplitude-modulated at syllable rate
+        voice = sum(np.sin(2 * np.pi * pitch * k * time_axis) / k for k in (1, 2, 3))
+        envelope = 0.5 + 0.5 * np.sin(2 * np.pi * rng.uniform(3, 6) * time_axis) ** 2
+        samples[start:end] = 0.25 * voice * envelope
+        speaker = 1 - speaker
+        # Mostly short gaps, sometimes a long hold
+        t += turn + (rng.uniform(5, 15) if rng.random() < 0.1 else rng.uniform(0.2, 1.0))
+    samples += np.random.default_rng(rng.randrange(1 << 32)).normal(0, 0.003, len(samples)).astype(np.float32)
+    return (np.clip(samples, -1, 1) * 32767).astype(np.int16)
+
+def generate_corpus(folder, count, min_seconds, max_seconds, sample_rate=8000, seed=0):
+    """Write count WAV recordings to folder, reusing those already there. Returns total audio seconds."""
+    os.makedirs(folder, exist_ok=True)
+    total_seconds = 0.0
+    for index in range(count):
+        rng = random.Random(seed * 1_000_003 + index)
+        seconds = rng.uniform(min_seconds, max_seconds)
+        total_seconds += int(seconds * sample_rate) / sample_rate
+        path = os.path.join(folder, f"call_{index:05d}.wav")
+        if os.path.exists(path):
+            continue
+        with wave.open(f"{path}.tmp", "wb") as w:
+            w.setnchannels(1)
+            w.setsampwidth(2)
+            w.setframerate(sample_rate)
+            w.writeframes(synth_call(rng, seconds, sample_rate).tobytes())
+        os.replace(f"{path}.tmp", path)
+    return total_seconds
+
+def read_events(events_path):
+    """Sum up the per-file and persist events that a run wrote."""
+    totals = {"done": 0, "failed": 0, "cached": 0, "audio_seconds": 0.0, "persist_seconds": 0.0, "checkpoints": 0}
+    if not os.path.exists(events_path):
+        return totals
+    with open(events_path, "r", encoding="utf-8") as f:
+        for line in f:
+            event = json.loads(line)
+            if event["event"] == "file":
+                totals[event["outcome"]] = totals.get(event["outcome"], 0) + 1
+                if event["outcome"] != "failed":
+                    totals["audio_seconds"] += event.get("audio_seconds") or 0
+            elif event["event"] == "persist":
+                totals["persist_seconds"] += event["seconds"]
+                totals["checkpoints"] += 1
+    return totals
+
+def run_pipeline(corpus, run_dir, base_url, timeout=None):
+    """Run `transcribe_calls.py run` on corpus. Returns (exit code, wall seconds, peak RSS bytes)."""
+    env = dict(os.environ)
+    env.update({
+        "INPUT_FOLDER": corpus,
+        "OUTPUT_CSV": os.path.join(run_dir, "out.csv"),
+        "ELEVENLABS_API_KEY": env.get("ELEVENLABS_API_KEY", "fake-key"),
+        "ELEVENLABS_BASE_URL": base_url,
+        "EVENTS_FILE": os.path.join(run_dir, "events.jsonl"),
+    })
+    for name in ("ELEVENLABS_API_KEYS", "MANIFEST_PATH", "RESULT_STORE_PATH", "JOURNAL_PATH", "LEASE_DIR"):
+        env.pop(name, None)  # Everything the run writes stays in run_dir
+    
+    with open(os.path.join(run_dir, "run.log"), "w") as log:
+        started = time.perf_counter()
+        process = subprocess.Popen([sys.executable, SCRIPT, "run"], cwd=run_dir, env=env,
+                                   stdout=log, stderr=subprocess.STDOUT)
+        try:
+            if timeout:
+                # wait4 has no timeout, so poll until the run exits
+                deadline = time.monotonic() + timeout
+                while time.monotonic() < deadline:
+                    pid, status, rusage = os.wait4(process.pid, os.WNOHANG)
+                    if pid:
+                        break
+                    time.sleep(0.1)
+                else:
+                    process.kill()
+                    pid, status, rusage = os.wait4(process.pid, 0)
+            else:
+                _, status, rusage = os.wait4(process.pid, 0)
+        except BaseException:
+            process.kill()
+            raise
+        wall_seconds = time.perf_counter() - started
+    process.returncode = os.waitstatus_to_exitcode(status)
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS; it covers the run and its reaped decode workers
+    peak_rss = rusage.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+    return process.returncode, wall_seconds, peak_rss
+
+def benchmark(size, args, work_dir):
+    corpus = os.path.join(work_dir, f"corpus-{size}-{args.min_seconds:g}-{args.max_seconds:g}-{args.corpus_seed}")
+    print(f"Generating corpus of {size} calls in {corpus}...", file=sys.stderr)
+    corpus_seconds = generate_corpus(corpus, size, args.min_seconds, args.max_seconds, seed=args.corpus_seed)
+    
+    run_dir = tempfile.mkdtemp(prefix=f"run-{size}-", dir=work_dir)
+    server = FakeElevenLabsServer(fake_from_args(args))
+    base_url = server.start()
+    try:
+        print(f"Transcribing {size} calls ({corpus_seconds / 3600:.2f} audio hours) via {base_url}...", file=sys.stderr)
+        exit_code, wall_seconds, peak_rss = run_pipeline(corpus, run_dir, base_url, args.timeout)
+    finally:
+        server.stop()
+    
+    events = read_events(os.path.join(run_dir, "events.jsonl"))
+    finished = events["done"] + events["cached"]
+    result = {
+        "size": size,
+        "exit_code": exit_code,
+        "corpus_audio_seconds": round(corpus_seconds, 1),
+        "files_done": finished,
+        "files_failed": events["failed"],
+        "wall_seconds": round(wall_seconds, 2),
+        "files_per_second": round(finished / wall_seconds, 3),
+        "audio_seconds_per_second": round(events["audio_seconds"] / wall_seconds, 2),
+        "peak_rss_mb": round(peak_rss / 1024 / 1024, 1),
+        "checkpoints": events["checkpoints"],
+        "checkpoint_seconds": round(events["persist_seconds"], 3),
+        "checkpoint_overhead_pct": round(events["persist_seconds"] / wall_seconds * 100, 2),
+        "requests": server.fake.stats["requests"],
+        "responses_429": server.fake.stats["429"],
+        "responses_5xx": server.fake.stats["5xx"],
+        "run_dir": run_dir,
+    }
+    if not args.keep_runs:
+        shutil.rmtree(run_dir, ignore_errors=True)
+        del result["run_dir"]
+    return result
+
+COLUMNS = [
+    ("size", "files", "{}"),
+    ("files_done", "done", "{}"),
+    ("files_failed", "failed", "{}"),
+    ("wall_seconds", "wall s", "{:.1f}"),
+    ("files_per_second", "files/s", "{:.2f}"),
+    ("audio_seconds_per_second", "audio-s/s", "{:.1f}"),
+    ("peak_rss_mb", "peak RSS MB", "{:.0f}"),
+    ("checkpoints", "ckpts", "{}"),
+    ("checkpoint_overhead_pct", "ckpt %", "{:.2f}"),
+    ("requests", "requests", "{}"),
+    ("responses_429", "429s", "{}"),
+    ("responses_5xx", "5xx", "{}"),
+]
+
+def print_table(results):
+    rows = [[title for _, title, _ in COLUMNS]]
+    rows += [[fmt.format(result[key]) for key, _, fmt in COLUMNS] for result in results]
+    widths = [max(len(row[i]) for row in rows) for i in range(len(COLUMNS))]
+    for row in rows:
+        print("  ".join(cell.rjust(width) for cell, width in zip(row, widths)))
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark transcribe_calls.py end to end against a local fake API.")
+    parser.add_argument("--sizes", default="25,100", help="Comma-separated corpus sizes in files (default: 25,100)")
+    parser.add_argument("--min-seconds", type=float, default=20, help="Shortest synthetic call (default: 20)")
+    parser.add_argument("--max-seconds", type=float, default=180, help="Longest synthetic call (default: 180)")
+    parser.add_argument("--corpus-seed", type=int, default=0, help="Seed for the synthetic corpus")
+    parser.add_argument("--work-dir", default=os.path.join(tempfile.gettempdir(), "transcribe-benchmarks"),
+                        help="Where corpora are cached and runs are written")
+    parser.add_argument("--timeout", type=float, default=None, help="Kill a run after this many seconds")
+    parser.add_argument("--keep-runs", action="store_true", help="Keep each run's output folder for inspection")
+    parser.add_argument("--json", help="Append the results to this JSON Lines file")
+    add_fake_arguments(parser)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    os.makedirs(args.work_dir, exist_ok=True)
+    
+    results = []
+    for size in [int(size) for size in args.sizes.split(",") if size.strip()]:
+        results.append(benchmark(size, args, args.work_dir))
+        if results[-1]["exit_code"] != 0:
+            print(f"Run of {size} files exited with {results[-1]['exit_code']}", file=sys.stderr)
+    print_table(results)
+    
+    if args.json:
+        settings = {name: os.environ[name] for name in sorted(os.environ)
+                    if name in ("MAX_CONCURRENCY", "BATCH_SIZE", "PAYLOAD_STRATEGY", "RESULT_STORE", "DECODE_WORKERS",
+                                "PREPROCESS_AUDIO", "CHUNK_LONG_CALLS", "ADAPTIVE_CONCURRENCY")}
+        fake_settings = {name: getattr(args, name) for name in (
+            "latency_ms", "latency_distribution", "jitter", "ms_per_audio_second", "rate_429", "rate_5xx", "seed",
+        )}
+        with open(args.json, "a", encoding="utf-8") as f:
+            for result in results:
+                f.write(json.dumps({"ts": time.strftime("%Y-%m-%dT%H:%M:%S"), "settings": settings,
+                                    "fake": fake_settings, **result}) + "\n")
+    return 0 if all(result["exit_code"] == 0 for result in results) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,504 @@
+import csv
+import json
+import os
+import signal
+import struct
+import sys
+import time
+import wave
+from datetime import datetime, timedelta
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import transcribe_calls  # noqa: E402
+from transcribe_calls import FileManifest, LeaseDirectory, ResultJournal, SQLiteResultStore  # noqa: E402
+
+def make_audio_file(folder, name, content=b"audio"):
+    path = os.path.join(folder, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(content)
+    return path
+
+def lease_owner(lease_file):
+    with open(lease_file, "r") as f:
+        return json.load(f)["worker"]
+
+def expire(lease_file, ttl):
+    old = time.time() - ttl - 60
+    os.utime(lease_file, (old, old))
+
+def test_lease_claim_is_exclusive(tmp_path):
+    audio = make_audio_file(str(tmp_path / "in"), "call.wav")
+    worker_a = LeaseDirectory(str(tmp_path / "leases"), str(tmp_path / "in"), "a", ttl=30)
+    worker_b = LeaseDirectory(str(tmp_path / "leases"), str(tmp_path / "in"), "b", ttl=30)
+    
+    assert worker_a.claim(audio)
+    assert not worker_b.claim(audio)
+    assert lease_owner(worker_a.held[audio]) == "a"
+
+def test_finished_file_is_never_claimed_again(tmp_path):
+    audio = make_audio_file(str(tmp_path / "in"), "call.wav")
+    worker_a = LeaseDirectory(str(tmp_path / "leases"), str(tmp_path / "in"), "a", ttl=30)
+    worker_b = LeaseDirectory(str(tmp_path / "leases"), str(tmp_path / "in"), "b", ttl=30)
+    
+    assert worker_a.claim(audio)
+    worker_a.release([audio], finished=True)
+    assert not worker_b.claim(audio)
+    assert list(worker_b.unfinished([audio])) == []
+
+def test_expired_lease_is_reclaimed(tmp_path):
+    audio = make_audio_file(str(tmp_path / "in"), "call.wav")
+    worker_a = LeaseDirectory(str(tmp_path / "leases"), str(tmp_path / "in"), "a", ttl=30)
+    worker_b = LeaseDirectory(str(tmp_path / "leases"), str(tmp_path / "in"), "b", ttl=30)
+    
+    assert worker_a.claim(audio)
+    lease_file = worker_a.held[audio]
+    expire(lease_file, worker_a.ttl)
+    
+    assert worker_b.claim(audio)
+    assert lease_owner(lease_file) == "b"
+    # The crashed holder must not delete the lease it lost
+    worker_a.release([audio])
+    assert os.path.exists(lease_file)
+    assert [name for name in os.listdir(tmp_path / "leases") if ".stale." in name] == []
+
+def test_reclaim_does_not_steal_a_lease_renewed_during_the_race(tmp_path, monkeypatch):
+    audio = make_audio_file(str(tmp_path / "in"), "call.wav")
+    worker_a = LeaseDirectory(str(tmp_path / "leases"), str(tmp_path / "in"), "a", ttl=30)
+    worker_b = LeaseDirectory(str(tmp_path / "leases"), str(tmp_path / "in"), "b", ttl=30)
+    worker_c = LeaseDirectory(str(tmp_path / "leases"), str(tmp_path / "in"), "c", ttl=30)
+    
+    assert worker_a.claim(audio)
+    lease_file = worker_a.held[audio]
+    expire(lease_file, worker_a.ttl)
+    
+    # b reclaims the expired lease after c has seen it expire but before c renames it away
+    rename = os.rename
+    def rename_after_b_reclaims(src, dst):
+        monkeypatch.setattr(transcribe_calls.os, "rename", rename)
+        assert worker_b.claim(audio)
+        rename(src, dst)
+    monkeypatch.setattr(transcribe_calls.os, "rename", rename_after_b_reclaims)
+    
+    assert not worker_c.claim(audio)
+    assert lease_owner(lease_file) == "b"
+    assert audio not in worker_c.held
+    assert [name for name in os.listdir(tmp_path / "leases") if ".stale." in name] == []
+
+def test_leases_are_keyed_by_path_relative_to_the_input_folder(tmp_path):
+    make_audio_file(str(tmp_path / "mount_a"), "day1/call.wav")
+    make_audio_file(str(tmp_path / "mount_a"), "day2/call.wav")
+    worker_a = LeaseDirectory(str(tmp_path / "leases"), str(tmp_path / "mount_a"), "a", ttl=30)
+    worker_b = LeaseDirectory(str(tmp_path / "leases"), str(tmp_path / "mount_b"), "b", ttl=30)
+    
+    assert worker_a.claim(str(tmp_path / "mount_a" / "day1" / "call.wav"))
+    assert not worker_b.claim(str(tmp_path / "mount_b" / "day1" / "call.wav"))
+    assert worker_b.claim(str(tmp_path / "mount_b" / "day2" / "call.wav"))
+
+def journal_result(file_name, text="hello"):
+    return {"file_name": file_name, "file_date": "2026-10-17", "duration_seconds": 12.5,
+            "transcription": text, "speakers": 2, "content_hash": f"hash-{file_name}"}
+
+def test_journal_replay_recovers_entries_before_a_torn_last_line(tmp_path):
+    done_audio = make_audio_file(str(tmp_path / "in"), "done.wav")
+    failed_audio = make_audio_file(str(tmp_path / "in"), "failed.wav")
+    journal = ResultJournal(str(tmp_path / "out.journal.jsonl"), fsync_interval=0)
+    journal.append(done_audio, "done", content_hash="hash-done.wav", result=journal_result("done.wav"))
+    journal.append(failed_audio, "failed", "ValueError: bad audio")
+    journal.close()
+    # A crash in the middle of writing the next entry
+    with open(journal.path, "a", encoding="utf-8") as f:
+        f.write('{"path": "/in/torn.wav", "state": "do')
+    
+    store = SQLiteResultStore(str(tmp_path / "out.db"))
+    manifest = FileManifest(str(tmp_path / "manifest.db"))
+    journal = ResultJournal(journal.path, fsync_interval=0)
+    recovered = journal.replay(store, manifest)
+    
+    assert [row["file_name"] for row in recovered] == ["done.wav"]
+    assert store.file_names() == {"done.wav"}
+    assert manifest.counts() == {"done": 1, "failed": 1}
+    assert manifest.failures(("failed",))[0][:3] == (failed_audio, "failed", "ValueError: bad audio")
+    assert list(manifest.iter_pending([done_audio, failed_audio])) == []
+    assert manifest.hashes == {done_audio: "hash-done.wav"}
+    # Replayed entries are committed, so a second start has nothing to recover
+    assert os.path.getsize(journal.path) == 0
+    assert journal.replay(store, manifest) == []
+    journal.close()
+
+def test_journal_replay_keeps_the_latest_entry_per_file(tmp_path):
+    audio = make_audio_file(str(tmp_path / "in"), "call.wav")
+    journal = ResultJournal(str(tmp_path / "out.journal.jsonl"), fsync_interval=0)
+    journal.append(audio, "dead_letter", "RateLimitError: 429")
+    journal.append(audio, "done", result=journal_result("call.wav", "second try"))
+    
+    store = SQLiteResultStore(str(tmp_path / "out.db"))
+    manifest = FileManifest(str(tmp_path / "manifest.db"))
+    recovered = journal.replay(store, manifest)
+    journal.close()
+    
+    assert [row["transcription"] for row in recovered] == ["second try"]
+    assert manifest.counts() == {"done": 1}
+
+def test_manifest_resumes_by_path_size_and_mtime(tmp_path):
+    folder = str(tmp_path / "in")
+    done = make_audio_file(folder, "done.wav")
+    changed = make_audio_file(folder, "changed.wav")
+    failed = make_audio_file(folder, "failed.wav")
+    in_progress = make_audio_file(folder, "in_progress.wav")
+    manifest = FileManifest(str(tmp_path / "manifest.db"))
+    manifest.mark([done, changed], "done", hashes={done: "hash-done", changed: "hash-changed"})
+    manifest.mark([failed], "failed", {failed: "ValueError: bad audio"})
+    manifest.mark([in_progress], "in_progress")
+    manifest.close()
+    
+    # Re-recorded after it was transcribed
+    make_audio_file(folder, "changed.wav", b"a longer recording")
+    new = make_audio_file(folder, "new.wav")
+    
+    manifest = FileManifest(str(tmp_path / "manifest.db"))
+    assert manifest.pending([done, changed, failed, in_progress, new]) == [changed, in_progress, new]
+    assert manifest.hashes == {done: "hash-done"}
+    assert manifest.redrive(("failed",)) == 1
+    assert manifest.pending([failed]) == [failed]
+    manifest.close()
+
+def test_manifest_keys_entries_by_path_not_file_name(tmp_path):
+    folder = str(tmp_path / "in")
+    first = make_audio_file(folder, "2026-10-16/rec_001.wav")
+    second = make_audio_file(folder, "2026-10-17/rec_001.wav")
+    manifest = FileManifest(str(tmp_path / "manifest.db"))
+    manifest.seed([first, second], {"2026-10-16/rec_001.wav"}, folder)
+    
+    assert manifest.pending([first, second]) == [second]
+    manifest.close()
+
+def test_stored_file_names_reads_the_output_csv_without_creating_a_store(tmp_path, monkeypatch):
+    output_csv = str(tmp_path / "out.csv")
+    with open(output_csv, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["file_name", "transcription"])
+        writer.writerows([["a.wav", "hello"], ["b.wav", "ERROR: timeout"]])
+    monkeypatch.setenv("OUTPUT_CSV", output_csv)
+    monkeypatch.delenv("RESULT_STORE", raising=False)
+    monkeypatch.delenv("RESULT_STORE_PATH", raising=False)
+    monkeypatch.delenv("LEASE_DIR", raising=False)
+    
+    assert transcribe_calls.stored_file_names(transcribe_calls.storage_config()) == {"a.wav"}
+    assert sorted(os.listdir(tmp_path)) == ["out.csv"]
+
+def test_stored_file_names_reads_this_workers_store(tmp_path, monkeypatch):
+    output_csv = str(tmp_path / "out.csv")
+    store = SQLiteResultStore(str(tmp_path / "out.worker-w1.sqlite3"))
+    store.upsert([{"file_name": "a.wav", "transcription": "hello"}])
+    store.close()
+    monkeypatch.setenv("OUTPUT_CSV", output_csv)
+    monkeypatch.setenv("LEASE_DIR", str(tmp_path / "leases"))
+    monkeypatch.setenv("WORKER_ID", "w1")
+    monkeypatch.delenv("RESULT_STORE", raising=False)
+    monkeypatch.delenv("RESULT_STORE_PATH", raising=False)
+    
+    assert transcribe_calls.stored_file_names(transcribe_calls.storage_config()) == {"a.wav"}
+    monkeypatch.setenv("WORKER_ID", "w2")
+    assert transcribe_calls.stored_file_names(transcribe_calls.storage_config()) == set()
+
+class FakeSpeechToText:
+    def convert(self, file, **options):
+        return {"text": f"transcript of {file[0]}", "language_code": options["language_code"], "words": []}
+
+class FakeClient:
+    speech_to_text = FakeSpeechToText()
+
+def prepare_or_die(file_path, *args):
+    """prepare_audio stand-in whose worker is killed, as by the OOM killer, on files named kill*."""
+    name = os.path.basename(file_path)
+    if name.startswith("kill"):
+        os.kill(os.getpid(), signal.SIGKILL)
+    time.sleep(0.3)
+    return {"file_path": file_path, "file_name": name, "file_date": "2026-10-17", "duration_seconds": 1.0,
+            "payload_strategy": "wav", "payload": b"audio", "payload_size": 5, "payload_name": name}
+
+def test_pipeline_survives_a_decode_worker_dying(tmp_path, monkeypatch):
+    folder = str(tmp_path / "in")
+    paths = [make_audio_file(folder, name) for name in ("a.wav", "b.wav", "kill.wav", "c.wav", "d.wav")]
+    monkeypatch.setattr(transcribe_calls, "prepare_audio", prepare_or_die)
+    
+    outcomes = {
+        os.path.basename(path): (result, error)
+        for path, result, error in transcribe_calls.run_transcription_pipeline(
+            FakeClient(), paths, "hin", max_concurrency=2, decode_workers=2,
+        )
+    }
+    
+    assert sorted(outcomes) == ["a.wav", "b.wav", "c.wav", "d.wav", "kill.wav"]
+    for name in ("a.wav", "b.wav", "c.wav", "d.wav"):
+        result, error = outcomes[name]
+        assert error is None and result["transcription"] == f"transcript of {name}"
+    result, error = outcomes["kill.wav"]
+    assert result is None
+    # Left for a redrive rather than recorded as a permanent failure
+    assert transcribe_calls.classify_error(error)[0] == "retryable"
+
+def word(text, start, end, speaker, word_type="word"):
+    return {"text": text, "type": word_type, "start": start, "end": end, "speaker_id": speaker}
+
+def stitch_two_chunks(first_words, second_words):
+    """Stitch chunks cut at 10s, the second starting 4s before the cut (word times are local)."""
+    chunks = [
+        {"offset_seconds": 0.0, "start_seconds": 0.0, "end_seconds": 10.0},
+        {"offset_seconds": 6.0, "start_seconds": 10.0, "end_seconds": 20.0},
+    ]
+    responses = [{"language_code": "hin", "words": first_words}, {"language_code": "hin", "words": second_words}]
+    return transcribe_calls.stitch_chunk_responses(chunks, responses)
+
+def test_stitching_keeps_a_space_at_the_cut():
+    response = stitch_two_chunks(
+        [word("hi", 7.9, 8.4, "speaker_0"), word(" ", 8.4, 8.5, "speaker_0", "spacing"),
+         word("order", 8.5, 9.5, "speaker_0")],
+        # The spacing after "order" starts before the cut, so only the later chunk had it
+        [word("hi", 1.9, 2.4, "speaker_0"), word(" ", 2.4, 2.5, "speaker_0", "spacing"),
+         word("order", 2.5, 3.5, "speaker_0"), word(" ", 3.5, 4.5, "speaker_0", "spacing"),
+         word("aapka", 4.5, 5.0, "speaker_0")],
+    )
+    
+    segments = transcribe_calls.build_segments(response)
+    assert [segment["text"] for segment in segments] == ["hi order aapka"]
+    assert segments[0]["end"] == 11.0
+    assert [w["text"] for w in response["words"]] == ["hi", " ", "order", " ", "aapka"]
+
+def test_stitching_maps_speakers_across_the_cut():
+    response = stitch_two_chunks(
+        [word("hello", 7.0, 8.0, "speaker_0"), word("haan", 8.5, 9.5, "speaker_1")],
+        # The later chunk numbered the same two people the other way round
+        [word("hello", 1.0, 2.0, "speaker_1"), word("haan", 2.5, 3.5, "speaker_0"),
+         word("ji", 4.5, 5.0, "speaker_0"), word("theek", 6.0, 6.5, "speaker_1")],
+    )
+    
+    kept = [(w["text"], w["speaker_id"]) for w in response["words"] if w["type"] == "word"]
+    assert kept == [("hello", "speaker_0"), ("haan", "speaker_1"), ("ji", "speaker_1"), ("theek", "speaker_0")]
+    assert transcribe_calls.count_speakers(response) == 2
+
+def test_stitching_gives_new_speakers_ids_that_are_not_taken():
+    response = stitch_two_chunks(
+        [word("hello", 7.0, 8.0, "speaker_0"), word("haan", 8.5, 9.5, "speaker_1")],
+        # speaker_1 here is the earlier speaker_0; this chunk's speaker_0 is someone new
+        [word("hello", 1.0, 2.0, "speaker_1"), word("namaste", 4.5, 5.0, "speaker_0")],
+    )
+    
+    kept = [(w["text"], w["speaker_id"]) for w in response["words"] if w["type"] == "word"]
+    assert kept == [("hello", "speaker_0"), ("haan", "speaker_1"), ("namaste", "speaker_2")]
+    assert transcribe_calls.count_speakers(response) == 3
+
+def test_stitching_allows_words_without_an_end_time():
+    response = stitch_two_chunks(
+        [word("hello", 7.0, 8.0, "speaker_0"), word("(noise)", 8.5, None, "speaker_0", "audio_event")],
+        [word("hello", 1.0, 2.0, "speaker_0"), word("(noise)", 2.5, None, "speaker_0", "audio_event"),
+         word("ji", 4.5, None, "speaker_0")],
+    )
+    
+    assert [(w["text"], w["start"], w["end"]) for w in response["words"] if w["type"] != "spacing"] == [
+        ("hello", 7.0, 8.0), ("(noise)", 8.5, None), ("ji", 10.5, None),
+    ]
+
+def make_wav(folder, name, seconds, sample_rate=16000):
+    path = make_audio_file(folder, name, b"")
+    with wave.open(path, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(sample_rate)
+        w.writeframes(b"\0\0" * int(seconds * sample_rate))
+    return path
+
+def test_budget_does_not_admit_unprobeable_files_for_free(tmp_path):
+    folder = str(tmp_path / "in")
+    paths = [make_audio_file(folder, f"call_{index}.m4a", b"\xff" * 5_000_000) for index in range(3)]
+    scheduler = transcribe_calls.WorkScheduler(budget_seconds=60)
+    
+    assert list(scheduler.schedule(paths)) == []
+    assert scheduler.deferred == paths
+    assert scheduler.admitted_seconds == 0
+
+def test_budget_estimates_unprobeable_files_from_probed_ones(tmp_path):
+    folder = str(tmp_path / "in")
+    probed = make_wav(folder, "probed.wav", 10)
+    # Same bytes per second as the probed file, so about 10 seconds
+    unprobed = make_audio_file(folder, "unprobed.m4a", b"\xff" * os.path.getsize(probed))
+    too_much = make_audio_file(folder, "too_much.m4a", b"\xff" * os.path.getsize(probed))
+    scheduler = transcribe_calls.WorkScheduler(budget_seconds=25)
+    
+    assert list(scheduler.schedule([probed, unprobed, too_much])) == [probed, unprobed]
+    assert scheduler.deferred == [too_much]
+    assert round(scheduler.admitted_seconds, 3) == 20
+    assert "1 files that could not be probed" in scheduler.summary()[0]
+
+def test_idle_watch_stops_at_the_deadline(tmp_path):
+    folder = str(tmp_path / "in")
+    later = make_audio_file(folder, "later.wav")
+    scheduler = transcribe_calls.WorkScheduler(deadline=datetime.now() - timedelta(minutes=1))
+    
+    assert list(scheduler.schedule([transcribe_calls.NO_FILE_YET, later])) == []
+    assert scheduler.stop_reason.startswith("deadline")
+
+class FakeClock(datetime):
+    """datetime whose now() is set by the test, so backups get distinct timestamps."""
+    current = datetime(2026, 10, 17, 9, 0, 0)
+    
+    @classmethod
+    def now(cls, tz=None):
+        return cls.current
+
+def back_up(backups, store, clock, *rows):
+    clock.current += timedelta(minutes=1)
+    store.upsert(list(rows))
+    backups.record(list(rows), store)
+    return clock.current.strftime('%Y%m%dT%H%M%S')
+
+def backup_kinds(backups):
+    return [kind for _, _, kind, _ in backups.entries()]
+
+def test_backups_write_a_snapshot_every_snapshot_every_checkpoints(tmp_path, monkeypatch):
+    monkeypatch.setattr(transcribe_calls, "datetime", FakeClock)
+    store = SQLiteResultStore(str(tmp_path / "out.db"))
+    backups = transcribe_calls.BackupSet(str(tmp_path / "backups"), "out", snapshot_every=3, keep_snapshots=10)
+    for index in range(5):
+        back_up(backups, store, FakeClock, journal_result(f"call_{index}.wav"))
+    assert backup_kinds(backups) == ["snapshot", "delta", "delta", "snapshot", "delta"]
+    
+    # A new run carries on the cadence from the files already there
+    backups = transcribe_calls.BackupSet(str(tmp_path / "backups"), "out", snapshot_every=3, keep_snapshots=10)
+    for index in range(5, 7):
+        back_up(backups, store, FakeClock, journal_result(f"call_{index}.wav"))
+    assert backup_kinds(backups) == ["snapshot", "delta", "delta", "snapshot", "delta", "delta", "snapshot"]
+    assert [sequence for sequence, _, _, _ in backups.entries()] == list(range(1, 8))
+
+def test_backups_prune_to_keep_snapshots_and_their_deltas(tmp_path, monkeypatch):
+    monkeypatch.setattr(transcribe_calls, "datetime", FakeClock)
+    store = SQLiteResultStore(str(tmp_path / "out.db"))
+    backups = transcribe_calls.BackupSet(str(tmp_path / "backups"), "out", snapshot_every=2, keep_snapshots=2)
+    for index in range(6):
+        back_up(backups, store, FakeClock, journal_result(f"call_{index}.wav"))
+    assert [(sequence, kind) for sequence, _, kind, _ in backups.entries()] == [
+        (3, "snapshot"), (4, "delta"), (5, "snapshot"), (6, "delta"),
+    ]
+    
+    back_up(backups, store, FakeClock, journal_result("call_6.wav"))
+    assert [(sequence, kind) for sequence, _, kind, _ in backups.entries()] == [
+        (5, "snapshot"), (6, "delta"), (7, "snapshot"),
+    ]
+
+def test_restore_uses_the_newest_snapshot_before_until_and_later_rows_win(tmp_path, monkeypatch):
+    monkeypatch.setattr(transcribe_calls, "datetime", FakeClock)
+    store = SQLiteResultStore(str(tmp_path / "out.db"))
+    backups = transcribe_calls.BackupSet(str(tmp_path / "backups"), "out", snapshot_every=3, keep_snapshots=10)
+    before_first = FakeClock.current.strftime('%Y%m%dT%H%M%S')
+    first = back_up(backups, store, FakeClock, journal_result("a.wav", "a v1"))
+    back_up(backups, store, FakeClock, journal_result("a.wav", "a v2"), journal_result("b.wav", "b v1"))
+    third = back_up(backups, store, FakeClock, journal_result("b.wav", "b v2"))
+    back_up(backups, store, FakeClock, journal_result("a.wav", "a v3"))  # a new snapshot
+    back_up(backups, store, FakeClock, journal_result("c.wav", "c v1"))
+    
+    assert [row["transcription"] for row in backups.restore_rows(until=first)] == ["a v1"]
+    assert [row["transcription"] for row in backups.restore_rows(until=third)] == ["a v1", "a v2", "b v1", "b v2"]
+    latest = {}
+    for row in backups.restore_rows():
+        latest[row["file_name"]] = row["transcription"]
+    assert latest == {"a.wav": "a v3", "b.wav": "b v2", "c.wav": "c v1"}
+    with pytest.raises(FileNotFoundError):
+        list(backups.restore_rows(until=before_first))
+    
+    # run_restore applies the rows in order, so the later one for a file is the one exported
+    output_csv = str(tmp_path / "restored.csv")
+    assert transcribe_calls.run_restore(backups, output_csv, until=third) == 0
+    with open(output_csv, newline="", encoding="utf-8") as f:
+        restored = {row["file_name"]: row["transcription"] for row in csv.DictReader(f)}
+    assert restored == {"a.wav": "a v2", "b.wav": "b v2"}
+    # The scratch store is removed afterwards
+    assert [name for name in os.listdir(tmp_path) if ".restore." in name] == []
+
+def probe_bytes(tmp_path, name, data):
+    path = make_audio_file(str(tmp_path), name, data)
+    info = transcribe_calls.probe_audio(path)
+    assert info["source"] == "header"
+    return info
+
+def id3_tag(payload_size=100):
+    size = bytes((payload_size >> shift) & 0x7F for shift in (21, 14, 7, 0))
+    return b"ID3\x04\x00\x00" + size + b"\0" * payload_size
+
+def test_probe_wav_skips_padded_chunks_and_reads_streamed_sizes(tmp_path):
+    fmt = struct.pack("<HHIIHH", 1, 1, 8000, 16000, 2, 16)
+    audio = b"\0" * 16000 * 3
+    listing = b"LIST" + struct.pack("<I", 3) + b"abc\0"  # odd size, so padded
+    for data_size, name in ((len(audio), "sized.wav"), (0xFFFFFFFF, "streamed.wav")):
+        body = b"WAVE" + b"fmt " + struct.pack("<I", len(fmt)) + fmt + listing
+        body += b"data" + struct.pack("<I", data_size) + audio
+        info = probe_bytes(tmp_path, name, b"RIFF" + struct.pack("<I", len(body)) + body)
+        assert info["duration_seconds"] == 3.0
+        assert (info["sample_rate"], info["channels"]) == (8000, 1)
+
+def test_probe_mp3_cbr_estimates_from_the_bitrate(tmp_path):
+    # MPEG-1 layer III, 128 kbps, 44.1 kHz, stereo: 417-byte frames after an ID3 tag
+    frame = b"\xff\xfb\x90\x00" + b"\0" * 413
+    info = probe_bytes(tmp_path, "cbr.mp3", id3_tag() + frame * 383)
+    assert info["duration_seconds"] == 383 * 417 * 8 / 128000
+    assert (info["sample_rate"], info["channels"]) == (44100, 2)
+
+def test_probe_mp3_vbr_counts_frames_from_the_xing_header(tmp_path):
+    # MPEG-1 stereo: Xing after 32 bytes of side info, 1152 samples per frame
+    xing = b"Xing" + struct.pack(">II", 1, 1000)
+    first_frame = b"\xff\xfb\x90\x00" + b"\0" * 32 + xing
+    info = probe_bytes(tmp_path, "vbr.mp3", id3_tag() + first_frame + b"\0" * 4000)
+    assert info["duration_seconds"] == 1000 * 1152 / 44100
+    
+    # MPEG-2 mono at 22.05 kHz: Info after 9 bytes of side info, 576 samples per frame
+    info_header = b"Info" + struct.pack(">II", 1, 500)
+    first_frame = b"\xff\xf3\x80\xc0" + b"\0" * 9 + info_header
+    info = probe_bytes(tmp_path, "mpeg2.mp3", first_frame + b"\0" * 4000)
+    assert info["duration_seconds"] == 500 * 576 / 22050
+    assert (info["sample_rate"], info["channels"]) == (22050, 1)
+
+def adts_frame(frame_length, rate_index=4, channels=2, raw_blocks=1):
+    header = bytes([
+        0xFF, 0xF1,
+        (1 << 6) | (rate_index << 2) | (channels >> 2),
+        ((channels & 0x03) << 6) | (frame_length >> 11),
+        (frame_length >> 3) & 0xFF,
+        ((frame_length & 0x07) << 5) | 0x1F,
+        0xFC | (raw_blocks - 1),
+    ])
+    return header + b"\0" * (frame_length - 7)
+
+def test_probe_adts_counts_frames(tmp_path):
+    info = probe_bytes(tmp_path, "stereo.aac", adts_frame(300) * 431)
+    assert info["duration_seconds"] == 431 * 1024 / 44100
+    assert (info["sample_rate"], info["channels"]) == (44100, 2)
+    
+    # Frames of varying length, some with two raw data blocks, after an ID3 tag
+    frames = [adts_frame(120 + index % 7, rate_index=11, channels=1, raw_blocks=1 + index % 2) for index in range(100)]
+    info = probe_bytes(tmp_path, "mono.aac", id3_tag() + b"".join(frames))
+    assert info["duration_seconds"] == 150 * 1024 / 8000
+    assert (info["sample_rate"], info["channels"]) == (8000, 1)
+
+def mp4_atom(atom_type, payload):
+    return struct.pack(">I", 8 + len(payload)) + atom_type + payload
+
+def mp4_file(mvhd):
+    entry = b"\0" * 6 + struct.pack(">H", 1) + b"\0" * 8 + struct.pack(">HHHH", 1, 16, 0, 0) + struct.pack(">I", 16000 << 16)
+    stsd = mp4_atom(b"stsd", struct.pack(">II", 0, 1) + mp4_atom(b"mp4a", entry))
+    trak = mp4_atom(b"trak", mp4_atom(b"mdia", mp4_atom(b"minf", mp4_atom(b"stbl", stsd))))
+    moov = mp4_atom(b"moov", mp4_atom(b"mvhd", mvhd) + trak)
+    return mp4_atom(b"ftyp", b"M4A \0\0\0\0") + mp4_atom(b"free", b"\0" * 10) + moov + mp4_atom(b"mdat", b"\0" * 100)
+
+def test_probe_mp4_reads_mvhd_version_0_and_1(tmp_path):
+    mvhd_v0 = struct.pack(">B3xIIII", 0, 0, 0, 1000, 93500) + b"\0" * 80
+    info = probe_bytes(tmp_path, "v0.m4a", mp4_file(mvhd_v0))
+    assert info["duration_seconds"] == 93.5
+    assert (info["sample_rate"], info["channels"]) == (16000, 1)
+    
+    # 30 hours at 48 kHz needs the 64-bit duration of version 1
+    mvhd_v1 = struct.pack(">B3xQQIQ", 1, 0, 0, 48000, 48000 * 3600 * 30) + b"\0" * 80
+    info = probe_bytes(tmp_path, "v1.m4a", mp4_file(mvhd_v1))
+    assert info["duration_seconds"] == 3600 * 30
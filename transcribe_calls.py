@@ -1,235 +1,2678 @@
 import os
+import argparse
+import contextlib
 import csv
 import glob
-import pandas as pd
+import gzip
+import hashlib
+import io
+import itertools
+import heapq
+import json
+import random
 import signal
+import socket
+import sqlite3
+import struct
 import sys
 from dotenv import load_dotenv
-from elevenlabs.client import ElevenLabs
-from datetime import datetime, timedelta
-from pydub import AudioSegment
-from tqdm import tqdm
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
 import logging
 import threading
 import time
-
-# Configure logging with rotating file handler
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from concurrent.futures import BrokenExecutor
+from concurrent.futures.process import BrokenProcessPool
 import logging.handlers
 from pathlib import Path
 
-# Create logs directory if it doesn't exist
-logs_dir = Path("logs")
-logs_dir.mkdir(exist_ok=True)
-
-# Configure session-based logging
-log_filename = f"transcription_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log"
-log_path = logs_dir / log_filename
-
-# Set up rotating file handler to prevent log files from growing too large
-file_handler = logging.handlers.RotatingFileHandler(
-    log_path,
-    maxBytes=10_000_000,  # 10MB
-    backupCount=10
-)
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        file_handler,
-        logging.StreamHandler()
-    ]
-)
+# pandas, numpy, pydub, tqdm and elevenlabs are imported where they are used, so importing
+# this module (or starting a decode worker) stays fast; see transcribe_many for library use
+
 logger = logging.getLogger(__name__)
 
+class SessionLog:
+    """The human-readable session log, kept open for the whole run.
+    
+    Use as `with session_log as f: f.write(...)`; writers on other threads are
+    serialised and the file is only flushed at checkpoints and progress updates.
+    """
+    
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+        self.lock = threading.RLock()
+    
+    def __enter__(self):
+        self.lock.acquire()
+        if self.file is None:
+            self.file = open(self.path, "a", encoding="utf-8")
+        return self.file
+    
+    def __exit__(self, *exc_info):
+        self.lock.release()
+    
+    def flush(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.flush()
+    
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
 # Global variables for tracking progress
 session_id = datetime.now().strftime('%Y%m%d_%H%M%S')
 session_log_file = f"transcription_session_{session_id}.log"
+session_log = SessionLog(session_log_file)
+logs_dir = Path("logs")
 total_files = 0
-current_file_index = 0
 current_batch = 0
 total_batches = 0
 start_time = None
 is_exiting = False
 progress_thread = None
+progress_lock = threading.Lock()
+inflight_hashes = {}  # content hash -> threading.Event set when its request finishes
+inflight_lock = threading.Lock()
+metrics = None  # PipelineMetrics of the command-line run
+current_run = None  # PipelineRun of the command-line run, stopped by signal_handler
+
+PAYLOAD_STRATEGIES = ("wav", "passthrough", "compact")
+TRANSCRIPTION_OPTIONS = {"model_id": "scribe_v1", "tag_audio_events": True, "diarize": True}
+DEFAULT_INPUT_FOLDER = "/Users/namanagarwal/voice call/clips"
+DEFAULT_OUTPUT_CSV = "/Users/namanagarwal/voice call/call_transcriptions.csv"
+
+def setup_logging():
+    """Log to the console and to a rotating per-session file in logs/.
 
-def setup_environment():
-    """Set up environment variables and initialize the ElevenLabs client."""
+    Called by the command line only; library users configure logging themselves.
+    """
+    # Create logs directory if it doesn't exist
+    logs_dir.mkdir(exist_ok=True)
+    
+    # Set up rotating file handler to prevent log files from growing too large
+    file_handler = logging.handlers.RotatingFileHandler(
+        logs_dir / f"transcription_{session_id}.log",
+        maxBytes=10_000_000,  # 10MB
+        backupCount=10
+    )
+    
+    # Configure logging
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            file_handler,
+            logging.StreamHandler()
+        ]
+    )
+
+class NoUsableAPIKeys(Exception):
+    """Raised when every API key has been rejected or has used up its quota."""
+
+class TokenBucket:
+    """Allows rate requests per second on average, with bursts of up to burst requests."""
+    
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+    
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+    
+    def wait_time(self):
+        """Seconds until a token is available (0 if one is available now)."""
+        self._refill()
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+    
+    def take(self):
+        self._refill()
+        self.tokens -= 1
+
+class APIKeyState:
+    """One API key with its client, request budget and usage counters."""
+    
+    def __init__(self, api_key, client, requests_per_minute=0, quota_seconds=0):
+        self.label = f"...{api_key[-4:]}"
+        self.client = client
+        self.bucket = TokenBucket(requests_per_minute / 60, max(1.0, requests_per_minute / 6)) if requests_per_minute else None
+        self.quota_seconds = quota_seconds
+        self.used_seconds = 0.0
+        self.requests = 0
+        self.throttled = 0
+        self.in_flight = 0
+        self.cooldown_until = 0.0
+        self.disabled_reason = None
+
+class APIKeyPool:
+    """Spreads requests over several API keys.
+
+    Each key gets its own token bucket (requests_per_minute) and audio quota
+    (quota_seconds). A key that is rate limited cools down for its Retry-After, and a
+    key that is rejected or out of quota is taken out of rotation.
+    """
+    
+    def __init__(self, api_keys, client_factory, requests_per_minute=0, quota_seconds=0):
+        self.keys = [
+            APIKeyState(api_key, client_factory(api_key), requests_per_minute, quota_seconds)
+            for api_key in api_keys
+        ]
+        self.lock = threading.Lock()
+    
+    def acquire(self):
+        """Return the key to use for the next request, waiting for a token if needed."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                usable = [key for key in self.keys if key.disabled_reason is None]
+                if not usable:
+                    raise NoUsableAPIKeys("All API keys were rejected or have used up their quota")
+                
+                best, best_wait = None, None
+                for key in usable:
+                    key_wait = max(key.cooldown_until - now, key.bucket.wait_time() if key.bucket else 0.0)
+                    rank = (key_wait, key.in_flight, key.used_seconds)
+                    if best is None or rank < (best_wait, best.in_flight, best.used_seconds):
+                        best, best_wait = key, key_wait
+                
+                if best_wait <= 0:
+                    if best.bucket:
+                        best.bucket.take()
+                    best.in_flight += 1
+                    best.requests += 1
+                    return best
+            time.sleep(min(best_wait, 1.0))
+    
+    def release(self, key, audio_seconds=0, error=None):
+        """Record the outcome of a request made with key."""
+        with self.lock:
+            key.in_flight -= 1
+            if error is None:
+                key.used_seconds += audio_seconds
+                if key.quota_seconds and key.used_seconds >= key.quota_seconds:
+                    self._disable(key, f"quota of {key.quota_seconds / 3600:.1f} audio hours used")
+                return
+            
+            status_code = getattr(error, "status_code", None)
+            if status_code == 429:
+                key.throttled += 1
+                retry_after = _retry_after_seconds(getattr(error, "headers", None))
+                key.cooldown_until = time.monotonic() + (retry_after if retry_after is not None else 1.0)
+            elif status_code in (401, 402, 403):
+                detail = str(getattr(error, "body", "")).lower()
+                self._disable(key, "quota exceeded" if "quota" in detail else f"rejected (HTTP {status_code})")
+    
+    def _disable(self, key, reason):
+        if key.disabled_reason is None:
+            key.disabled_reason = reason
+            remaining = sum(1 for k in self.keys if k.disabled_reason is None)
+            logger.warning(f"API key {key.label} taken out of rotation: {reason} ({remaining} keys left)")
+    
+    def summary(self):
+        """Return one log line per key."""
+        return [
+            f"API key {key.label}: {key.requests} requests, {key.used_seconds / 3600:.2f} audio hours, "
+            f"{key.throttled} rate limited" + (f", disabled: {key.disabled_reason}" if key.disabled_reason else "")
+            for key in self.keys
+        ]
+
+class AdaptiveConcurrencyLimiter:
+    """AIMD limit on the number of API requests in flight.
+
+    The limit grows by about one for every limit successful requests, is halved on a
+    429, and shrinks by 10% when a request's latency per audio second climbs above
+    latency_tolerance times the best seen recently. Decreases are spaced out by
+    cooldown seconds so one burst of 429s only counts once.
+    """
+    
+    def __init__(self, initial, minimum=1, maximum=None, adaptive=True, latency_tolerance=2.0, cooldown=5.0):
+        self.maximum = maximum or initial
+        self.minimum = max(1, min(minimum, self.maximum))
+        self.limit = float(max(self.minimum, min(initial, self.maximum)))
+        self.adaptive = adaptive
+        self.latency_tolerance = latency_tolerance
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self.baseline = None  # best recent latency per audio second
+        self.last_decrease = 0.0
+        self.condition = threading.Condition()
+    
+    def acquire(self):
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+    
+    def release(self, latency=None, audio_seconds=0, throttled=False):
+        with self.condition:
+            self.in_flight -= 1
+            if self.adaptive:
+                self._adjust(latency, audio_seconds, throttled)
+            self.condition.notify_all()
+    
+    def _adjust(self, latency, audio_seconds, throttled):
+        now = time.monotonic()
+        if throttled:
+            self._decrease(now, 0.5)
+            return
+        if latency is None:
+            return
+        
+        normalized = latency / max(audio_seconds, 1.0)
+        # Let the baseline drift up slowly so it follows real changes in API speed
+        self.baseline = normalized if self.baseline is None else min(normalized, self.baseline * 1.01)
+        if normalized > self.baseline * self.latency_tolerance:
+            self._decrease(now, 0.9)
+        else:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+    
+    def _decrease(self, now, factor):
+        if now - self.last_decrease < self.cooldown:
+            return
+        self.last_decrease = now
+        self.limit = max(self.minimum, self.limit * factor)
+        logger.info(f"Concurrency limit lowered to {int(self.limit)}")
+
+class PipelineRun:
+    """State of one run_transcription_pipeline call.
+
+    Each run has its own concurrency limiter, stop flag and counters, so several runs in
+    one process (such as concurrent transcribe_many calls) don't share them. stop() asks
+    the run to finish what is in flight and take no new work; it can be called from any
+    thread or a signal handler. metrics, if given, is a PipelineMetrics to record into.
+    """
+    
+    def __init__(self, metrics=None):
+        self.metrics = metrics
+        self.limiter = None  # AdaptiveConcurrencyLimiter, set while the pipeline runs
+        self.stopping = False
+        self.files_finished = 0
+        self.upload_stats = {}  # payload strategy -> {"files": ..., "bytes": ...}
+        self.cache_hits = 0
+        self.lock = threading.Lock()
+    
+    def stop(self):
+        self.stopping = True
+    
+    def record_upload(self, prepared):
+        """Add a sent payload to the per-strategy upload totals."""
+        with self.lock:
+            stats = self.upload_stats.setdefault(prepared["payload_strategy"], {"files": 0, "bytes": 0})
+            stats["files"] += 1
+            stats["bytes"] += prepared["payload_size"]
+    
+    def record_cache_hit(self):
+        with self.lock:
+            self.cache_hits += 1
+    
+    def record_finished(self):
+        with self.lock:
+            self.files_finished += 1
+
+def setup_environment(load_env_file=True):
+    """Set up environment variables and initialize a pool of ElevenLabs clients.
+
+    With load_env_file, a .env file is loaded into os.environ first. ELEVENLABS_API_KEY and the comma-separated ELEVENLABS_API_KEYS are combined into
+    one pool. KEY_REQUESTS_PER_MINUTE and KEY_QUOTA_HOURS limit each key (0 = no limit).
+    ELEVENLABS_BASE_URL points the clients at another server, such as the local stand-in
+    in benchmarks/fake_elevenlabs.py.
+    """
     try:
         # Load environment variables
-        load_dotenv()
+        if load_env_file:
+            load_dotenv()
         
-        # Get API key
-        api_key = os.getenv("ELEVENLABS_API_KEY")
-        if not api_key:
+        # Get API keys
+        api_keys = [key.strip() for key in os.getenv("ELEVENLABS_API_KEYS", "").split(",") if key.strip()]
+        if os.getenv("ELEVENLABS_API_KEY") and os.getenv("ELEVENLABS_API_KEY") not in api_keys:
+            api_keys.insert(0, os.getenv("ELEVENLABS_API_KEY"))
+        if not api_keys:
             raise ValueError("ELEVENLABS_API_KEY environment variable not found")
         
-        # Initialize ElevenLabs client
-        client = ElevenLabs(api_key=api_key)
+        # Initialize one ElevenLabs client per key
+        from elevenlabs.client import ElevenLabs
+        base_url = os.getenv("ELEVENLABS_BASE_URL") or None
+        client = APIKeyPool(
+            api_keys,
+            lambda api_key: ElevenLabs(api_key=api_key, base_url=base_url),
+            requests_per_minute=float(os.getenv("KEY_REQUESTS_PER_MINUTE", "0")),
+            quota_seconds=float(os.getenv("KEY_QUOTA_HOURS", "0")) * 3600,
+        )
+        logger.info(f"Using {len(api_keys)} API key(s)" + (f" with {base_url}" if base_url else ""))
         return client
     except Exception as e:
         logger.error(f"Failed to set up environment: {str(e)}")
         return None
 
-def get_audio_files(folder_path, supported_extensions=None):
+SUPPORTED_EXTENSIONS = (".aac", ".mp3", ".wav", ".m4a")
+
+def iter_audio_files(folder_path, supported_extensions=None, recursive=True):
+    """Yield audio files under folder_path as they are found, matching extensions case-insensitively.
+    
+    Subfolders, such as the dated folders written by the telephony system, are walked
+    depth-first; symlinked folders are not followed.
+    """
+    extensions = tuple(ext.lower() for ext in (supported_extensions or SUPPORTED_EXTENSIONS))
+    folders = [folder_path]
+    while folders:
+        folder = folders.pop()
+        try:
+            with os.scandir(folder) as entries:
+                subfolders = []
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if recursive:
+                                subfolders.append(entry.path)
+                        elif entry.name.lower().endswith(extensions) and entry.is_file():
+                            yield entry.path
+                    except OSError:
+                        continue
+        except OSError as e:
+            logger.warning(f"Could not scan {folder}: {str(e)}")
+            continue
+        folders.extend(sorted(subfolders, reverse=True))
+
+def get_audio_files(folder_path, supported_extensions=None, recursive=True):
     """Get all audio files with supported extensions from the folder."""
-    if supported_extensions is None:
-        supported_extensions = [".aac", ".mp3", ".wav", ".m4a"]
+    try:
+        if not os.path.exists(folder_path):
+            raise FileNotFoundError(f"Folder {folder_path} not found")
+        
+        files = list(iter_audio_files(folder_path, supported_extensions, recursive))
+        
+        logger.info(f"Found {len(files)} audio files in {folder_path}")
+        return files
+    except Exception as e:
+        logger.error(f"Error finding audio files: {str(e)}")
+        return []
+
+# Yielded by a file source that has nothing to hand out yet but has not finished
+NO_FILE_YET = object()
+
+# inotify event bits (see inotify(7))
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+INOTIFY_EVENT = struct.Struct("iIII")
+
+class Inotify:
+    """Minimal recursive inotify watch through libc, for Linux without extra packages."""
+    
+    MASK = IN_CREATE | IN_CLOSE_WRITE | IN_MOVED_TO
+    
+    def __init__(self):
+        import ctypes
+        import ctypes.util
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.get_errno = ctypes.get_errno
+        self.folders = {}  # watch descriptor -> folder
+    
+    def add_tree(self, folder_path):
+        """Watch folder_path and every folder below it."""
+        for folder, subfolders, _ in os.walk(folder_path):
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(folder), self.MASK)
+            if wd < 0:
+                errno = self.get_errno()
+                raise OSError(errno, f"Cannot watch {folder}: {os.strerror(errno)}")
+            self.folders[wd] = folder
+    
+    def read(self):
+        """Return (path, mask) for the events queued since the last call, without blocking."""
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return events
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+                name = data[offset + INOTIFY_EVENT.size:offset + INOTIFY_EVENT.size + length].rstrip(b"\0")
+                offset += INOTIFY_EVENT.size + length
+                if mask & IN_IGNORED:
+                    self.folders.pop(wd, None)
+                    continue
+                folder = self.folders.get(wd)
+                if mask & IN_Q_OVERFLOW:
+                    events.append((None, mask))
+                elif folder is not None:
+                    events.append((os.path.join(folder, os.fsdecode(name)), mask))
+    
+    def close(self):
+        os.close(self.fd)
+
+class FolderWatcher:
+    """Hand out new recordings under a folder once they have stopped growing.
+    
+    New files are noticed through inotify or, where that is unavailable (other platforms,
+    network filesystems, too many folders), by rescanning every poll_seconds. A file is
+    handed out once its size and mtime have not changed for settle_seconds, so recordings
+    still being written are never sent half-finished.
+    """
+    
+    def __init__(self, folder_path, supported_extensions=None, settle_seconds=10, poll_seconds=30, backend="auto"):
+        self.folder_path = folder_path
+        self.extensions = tuple(ext.lower() for ext in (supported_extensions or SUPPORTED_EXTENSIONS))
+        self.settle_seconds = settle_seconds
+        self.poll_seconds = poll_seconds
+        self.known = set()  # paths already handed out by the initial scan or the watch
+        self.candidates = {}  # path -> (size, mtime, unchanged since)
+        self.inotify = None
+        self.last_poll = time.monotonic()
+        self.last_check = 0.0
+        self.caught_up = False  # True while there is nothing new to hand out
+        
+        if backend in ("auto", "inotify"):
+            try:
+                self.inotify = Inotify()
+                self.inotify.add_tree(folder_path)
+            except (OSError, AttributeError) as e:
+                if self.inotify is not None:
+                    self.inotify.close()
+                    self.inotify = None
+                if backend == "inotify":
+                    raise
+                logger.warning(f"inotify unavailable ({str(e)}); polling {folder_path} every {poll_seconds:.0f}s")
+        logger.info(f"Watching {folder_path} for new recordings ({'inotify' if self.inotify else 'polling'}, "
+                    f"settle {settle_seconds:.0f}s)")
+    
+    def initial_files(self):
+        """Yield the files already in the folder, remembering them so the watch skips them.
+        
+        Files modified within the last settle_seconds may still be recording, so they are
+        left to the watch instead.
+        """
+        for path in iter_audio_files(self.folder_path, self.extensions):
+            try:
+                if time.time() - os.path.getmtime(path) < self.settle_seconds:
+                    self._consider(path)
+                    continue
+            except OSError:
+                continue
+            self.known.add(path)
+            yield path
+    
+    def _consider(self, path):
+        if path not in self.known and path not in self.candidates and path.lower().endswith(self.extensions):
+            self.candidates[path] = (None, None, time.monotonic())
+    
+    def _rescan(self, folder_path=None):
+        for path in iter_audio_files(folder_path or self.folder_path, self.extensions):
+            self._consider(path)
+    
+    def _collect(self):
+        now = time.monotonic()
+        if self.inotify is not None:
+            for path, mask in self.inotify.read():
+                if path is None:
+                    logger.warning("inotify queue overflowed; rescanning the folder")
+                    self._rescan()
+                elif mask & IN_ISDIR:
+                    if mask & (IN_CREATE | IN_MOVED_TO):
+                        # Files can land before the new folder is watched, so scan it too
+                        try:
+                            self.inotify.add_tree(path)
+                        except OSError as e:
+                            logger.warning(f"{str(e)}; it will only be picked up by rescans")
+                        self._rescan(path)
+                else:
+                    self._consider(path)
+        elif now - self.last_poll >= self.poll_seconds:
+            self.last_poll = now
+            self._rescan()
+    
+    def new_files(self):
+        """Yield settled new files for as long as the run lasts, or NO_FILE_YET while there are none."""
+        while not is_exiting:
+            now = time.monotonic()
+            settled = []
+            if now - self.last_check >= 1:
+                self.last_check = now
+                self._collect()
+                for path, (size, mtime, since) in list(self.candidates.items()):
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        del self.candidates[path]
+                        continue
+                    if (stat.st_size, stat.st_mtime) != (size, mtime):
+                        self.candidates[path] = (stat.st_size, stat.st_mtime, now)
+                    elif stat.st_size > 0 and now - since >= self.settle_seconds:
+                        del self.candidates[path]
+                        self.known.add(path)
+                        settled.append(path)
+            self.caught_up = not settled
+            if settled:
+                yield from settled
+            else:
+                yield NO_FILE_YET
+    
+    def close(self):
+        if self.inotify is not None:
+            self.inotify.close()
+            self.inotify = None
+
+MP3_BITRATES = {
+    # (MPEG-1?, layer) -> kbps by bitrate index
+    (True, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (True, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (True, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (False, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (False, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (False, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+MP3_SAMPLE_RATES = {3: [44100, 48000, 32000], 2: [22050, 24000, 16000], 0: [11025, 12000, 8000]}
+ADTS_SAMPLE_RATES = [96000, 88200, 64000, 48000, 44100, 32000, 24000, 22050, 16000, 12000, 11025, 8000, 7350]
+
+def _skip_id3(f):
+    """Skip a leading ID3v2 tag and return the offset of the audio data."""
+    header = f.read(10)
+    if len(header) == 10 and header[:3] == b"ID3":
+        size = (header[6] << 21) | (header[7] << 14) | (header[8] << 7) | header[9]
+        offset = 10 + size + (10 if header[5] & 0x10 else 0)  # footer flag
+    else:
+        offset = 0
+    f.seek(offset)
+    return offset
+
+def _probe_wav(f, file_size):
+    """Read duration and format from the fmt and data chunks of a RIFF/WAVE file."""
+    header = f.read(12)
+    if len(header) < 12 or header[:4] != b"RIFF" or header[8:12] != b"WAVE":
+        return None
+    
+    channels = sample_rate = byte_rate = None
+    while True:
+        chunk = f.read(8)
+        if len(chunk) < 8:
+            return None
+        chunk_id, chunk_size = chunk[:4], int.from_bytes(chunk[4:], "little")
+        if chunk_id == b"fmt ":
+            fmt = f.read(chunk_size + (chunk_size & 1))
+            channels = int.from_bytes(fmt[2:4], "little")
+            sample_rate = int.from_bytes(fmt[4:8], "little")
+            byte_rate = int.from_bytes(fmt[8:12], "little")
+        elif chunk_id == b"data":
+            if not byte_rate:
+                return None
+            # Streamed WAVs leave the data size unset; the rest of the file is audio
+            if chunk_size in (0, 0xFFFFFFFF):
+                chunk_size = file_size - f.tell()
+            return {"duration_seconds": chunk_size / byte_rate, "sample_rate": sample_rate, "channels": channels}
+        else:
+            f.seek(chunk_size + (chunk_size & 1), os.SEEK_CUR)
+
+def _probe_mp3(f, file_size):
+    """Read duration from the Xing/Info or VBRI header, or estimate it from a CBR bitrate."""
+    audio_start = _skip_id3(f)
+    data = f.read(4096)
+    
+    # Find the first frame header
+    for i in range(len(data) - 4):
+        if data[i] != 0xFF or (data[i + 1] & 0xE0) != 0xE0:
+            continue
+        version_bits = (data[i + 1] >> 3) & 0x03
+        layer_bits = (data[i + 1] >> 1) & 0x03
+        bitrate_index = data[i + 2] >> 4
+        rate_index = (data[i + 2] >> 2) & 0x03
+        if version_bits == 1 or layer_bits == 0 or bitrate_index in (0, 15) or rate_index == 3:
+            continue
+        break
+    else:
+        return None
+    
+    mpeg1 = version_bits == 3
+    layer = 4 - layer_bits
+    sample_rate = MP3_SAMPLE_RATES[version_bits][rate_index]
+    channels = 1 if (data[i + 3] >> 6) == 3 else 2
+    bitrate = MP3_BITRATES[(mpeg1, layer)][bitrate_index] * 1000
+    if layer == 1:
+        samples_per_frame = 384
+    elif layer == 3 and not mpeg1:
+        samples_per_frame = 576
+    else:
+        samples_per_frame = 1152
+    
+    # VBR files carry a frame count in a Xing/Info or VBRI header inside the first frame
+    side_info = (32 if channels == 2 else 17) if mpeg1 else (17 if channels == 2 else 9)
+    frames = None
+    xing = i + 4 + side_info
+    if data[xing:xing + 4] in (b"Xing", b"Info") and int.from_bytes(data[xing + 4:xing + 8], "big") & 0x01:
+        frames = int.from_bytes(data[xing + 8:xing + 12], "big")
+    elif data[i + 36:i + 40] == b"VBRI":
+        frames = int.from_bytes(data[i + 50:i + 54], "big")
+    
+    if frames:
+        duration = frames * samples_per_frame / sample_rate
+    else:
+        duration = (file_size - audio_start - i) * 8 / bitrate
+    return {"duration_seconds": duration, "sample_rate": sample_rate, "channels": channels}
+
+def _probe_adts(f, file_size):
+    """Count ADTS frames by walking their headers; each frame holds 1024 samples."""
+    _skip_id3(f)
+    frames = 0
+    sample_rate = channels = None
+    while True:
+        header = f.read(7)
+        if len(header) < 7 or header[0] != 0xFF or (header[1] & 0xF6) != 0xF0:
+            break
+        rate_index = (header[2] >> 2) & 0x0F
+        if rate_index >= len(ADTS_SAMPLE_RATES):
+            return None
+        sample_rate = ADTS_SAMPLE_RATES[rate_index]
+        channels = ((header[2] & 0x01) << 2) | (header[3] >> 6)
+        frame_length = ((header[3] & 0x03) << 11) | (header[4] << 3) | (header[5] >> 5)
+        raw_blocks = (header[6] & 0x03) + 1
+        if frame_length < 7:
+            break
+        frames += raw_blocks
+        f.seek(frame_length - 7, os.SEEK_CUR)
+    
+    if not frames:
+        return None
+    return {"duration_seconds": frames * 1024 / sample_rate, "sample_rate": sample_rate, "channels": channels}
+
+def _iter_mp4_atoms(f, end):
+    """Yield (type, payload offset, payload size) for the atoms between the current position and end."""
+    while f.tell() + 8 <= end:
+        start = f.tell()
+        header = f.read(8)
+        size, atom_type = int.from_bytes(header[:4], "big"), header[4:8]
+        header_size = 8
+        if size == 1:
+            size = int.from_bytes(f.read(8), "big")
+            header_size = 16
+        elif size == 0:
+            size = end - start
+        if size < header_size:
+            return
+        yield atom_type, start + header_size, size - header_size
+        f.seek(start + size)
+
+def _probe_mp4(f, file_size):
+    """Read duration from the mvhd atom and format from the first audio sample entry."""
+    info = {}
+    
+    def walk(end):
+        for atom_type, offset, size in _iter_mp4_atoms(f, end):
+            if atom_type in (b"moov", b"trak", b"mdia", b"minf", b"stbl"):
+                walk(offset + size)
+            elif atom_type == b"mvhd":
+                body = f.read(min(size, 32))
+                if body[0] == 1:
+                    timescale = int.from_bytes(body[20:24], "big")
+                    duration = int.from_bytes(body[24:32], "big")
+                else:
+                    timescale = int.from_bytes(body[12:16], "big")
+                    duration = int.from_bytes(body[16:20], "big")
+                if timescale:
+                    info["duration_seconds"] = duration / timescale
+            elif atom_type == b"stsd" and "sample_rate" not in info:
+                body = f.read(min(size, 44))
+                # version/flags, entry count, then an AudioSampleEntry (mp4a, alac, ...)
+                if len(body) >= 44:
+                    info["channels"] = int.from_bytes(body[32:34], "big")
+                    info["sample_rate"] = int.from_bytes(body[40:42], "big")
+    
+    header = f.read(8)
+    if len(header) < 8 or header[4:8] != b"ftyp":
+        return None
+    f.seek(0)
+    walk(file_size)
+    if "duration_seconds" not in info:
+        return None
+    return info
+
+HEADER_PROBES = {
+    ".wav": _probe_wav,
+    ".mp3": _probe_mp3,
+    ".aac": _probe_adts,
+    ".m4a": _probe_mp4,
+}
+
+def probe_audio(file_path):
+    """Read duration, sample rate and channel count for an audio file.
+
+    Container headers are parsed for .aac/.mp3/.wav/.m4a files, which takes a few small
+    reads. Only when the header is missing or unusable is the file decoded with pydub.
+    """
+    file_size = os.path.getsize(file_path)
+    probe = HEADER_PROBES.get(os.path.splitext(file_path)[1].lower())
+    
+    if probe:
+        try:
+            with open(file_path, "rb") as f:
+                info = probe(f, file_size)
+            if info and info["duration_seconds"] > 0:
+                info["source"] = "header"
+                return info
+        except Exception as e:
+            logger.debug(f"Header probe failed for {file_path}: {str(e)}")
+    
+    # Fall back to a full decode
+    from pydub import AudioSegment
+    audio = AudioSegment.from_file(file_path)
+    return {
+        "duration_seconds": len(audio) / 1000,
+        "sample_rate": audio.frame_rate,
+        "channels": audio.channels,
+        "source": "decode",
+    }
+
+def hash_file(file_path, chunk_size=1024 * 1024):
+    """Return the SHA-256 hex digest of a file, read in chunks.
+
+    This is the same digest the web app stores as Recording.contentHash.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def response_cache_key(content_hash, language_code, preprocess=None):
+    """Key a transcription response by audio content and every option that changes it."""
+    key_fields = [
+        content_hash,
+        TRANSCRIPTION_OPTIONS["model_id"],
+        language_code,
+        TRANSCRIPTION_OPTIONS["diarize"],
+        TRANSCRIPTION_OPTIONS["tag_audio_events"],
+    ]
+    if preprocess:
+        key_fields.append(preprocess)
+    return hashlib.sha256(json.dumps(key_fields).encode("utf-8")).hexdigest()
+
+def _cached_response_path(cache_dir, cache_key):
+    return os.path.join(cache_dir, cache_key[:2], f"{cache_key}.json")
+
+def read_cached_response(cache_dir, cache_key):
+    """Return a cached transcription response, or None if there is none."""
+    try:
+        with open(_cached_response_path(cache_dir, cache_key), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable cached response {cache_key}: {str(e)}")
+        return None
+
+def write_cached_response(cache_dir, cache_key, response):
+    """Store a transcription response in the cache, atomically."""
+    path = _cached_response_path(cache_dir, cache_key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_file = f"{path}.{os.getpid()}.{threading.get_ident()}.temp"
+    with open(temp_file, 'w', encoding='utf-8') as f:
+        json.dump(response, f, ensure_ascii=False)
+    os.replace(temp_file, path)
+
+def transcription_to_dict(transcription):
+    """Convert an API response into plain data that can be cached as JSON."""
+    if isinstance(transcription, dict):
+        return transcription
+    if hasattr(transcription, "model_dump"):
+        return transcription.model_dump(mode="json")
+    if hasattr(transcription, "dict"):
+        return transcription.dict()
+    return {"text": transcription.text}
+
+def count_speakers(response):
+    """Count the distinct speakers in a diarized response."""
+    speakers = {word.get("speaker_id") for word in response.get("words") or [] if word.get("speaker_id")}
+    if not speakers:
+        speakers = {segment.get("speaker") for segment in response.get("segments") or [] if segment.get("speaker")}
+    return len(speakers) or 1
+
+def original_time(seconds, kept_ranges):
+    """Map a time in silence-trimmed audio back to the original recording."""
+    if seconds is None or not kept_ranges:
+        return seconds
+    elapsed = 0.0
+    for start, end in kept_ranges:
+        if seconds <= elapsed + (end - start):
+            return start + (seconds - elapsed)
+        elapsed += end - start
+    return kept_ranges[-1][1] + (seconds - elapsed)
+
+def build_segments(response, kept_ranges=None):
+    """Group a diarized response's words into speaker turns.
+    
+    Returns dicts with start, end, speaker, text and event_tags (the audio events,
+    such as "(laughter)", heard during the turn). Times are on the original
+    recording's timeline even when silence was trimmed before upload.
+    """
+    segments = []
+    for word in response.get("words") or []:
+        word_type = word.get("type", "word")
+        speaker = word.get("speaker_id")
+        current = segments[-1] if segments else None
+        
+        if word_type == "spacing":
+            if current is not None:
+                current["text"] += word.get("text") or ""
+            continue
+        # Audio events without a speaker, or by the current one, fold into the current turn
+        if current is None or (speaker is not None and speaker != current["speaker"]):
+            current = {"start": word.get("start"), "end": word.get("end"), "speaker": speaker, "text": "", "event_tags": []}
+            segments.append(current)
+        
+        if word_type == "audio_event":
+            current["event_tags"].append(word.get("text"))
+        else:
+            current["text"] += word.get("text") or ""
+        if word.get("end") is not None:
+            current["end"] = word["end"]
+        if current["start"] is None:
+            current["start"] = word.get("start")
+    
+    for segment in segments:
+        segment["text"] = segment["text"].strip()
+        segment["start"] = original_time(segment["start"], kept_ranges)
+        segment["end"] = original_time(segment["end"], kept_ranges)
+    return segments
+
+def result_file_name(file_path, input_folder=None):
+    """The name a file's results are stored under: its path relative to input_folder.
+    
+    Files directly in input_folder keep their bare name, as in the original flat layout,
+    while recordings with the same name in different subfolders get separate rows.
+    """
+    if not input_folder:
+        return os.path.basename(file_path)
+    return os.path.relpath(file_path, input_folder).replace(os.sep, "/")
+
+def prepare_audio(file_path, payload_strategy="wav", compact_format="flac",
+                  content_hash=None, cache_dir=None, language_code="hin",
+                  chunk_seconds=None, chunk_overlap_seconds=4, preprocess=None, input_folder=None):
+    """Decode an audio file and build the payload that will be uploaded for it.
+
+    payload_strategy selects what is sent to the API:
+      - "wav": the fully decoded audio as uncompressed WAV (the original behaviour)
+      - "passthrough": the original file, streamed from disk at upload time
+      - "compact": mono 16 kHz audio re-encoded as FLAC or Opus (compact_format)
+
+    The file is hashed first (unless content_hash is already known) and, with a
+    cache_dir, nothing is decoded when a response for the same audio is cached.
+    With chunk_seconds, longer calls are split into chunks of at most that length
+    (see find_chunk_ranges), each starting chunk_overlap_seconds before its cut.
+    With preprocess (see PREPROCESS_DEFAULTS), the decoded audio is downmixed, resampled
+    and trimmed of silence first, and its length is recorded as sent_seconds; passthrough
+    payloads are then re-encoded with the compact encoding. Results are named by
+    result_file_name relative to input_folder.
+
+    This is the CPU-bound half of a transcription, so it only uses its arguments and
+    returns plain data that can be sent back from a worker process. Passthrough
+    payloads only need the duration, which is read from the container header.
+    """
+    file_name = os.path.basename(file_path)
+    stem = os.path.splitext(file_name)[0]
+    
+    # Get file metadata
+    file_date = datetime.fromtimestamp(os.path.getmtime(file_path)).strftime('%Y-%m-%d')
+    
+    prepared = {
+        "file_path": file_path,
+        "file_name": result_file_name(file_path, input_folder),
+        "file_date": file_date,
+        "file_size": os.path.getsize(file_path),
+        "payload_strategy": payload_strategy,
+        "preprocess": preprocess,
+        "timings": {},  # stage -> seconds, see PipelineMetrics
+    }
+    timings = prepared["timings"]
+    
+    # Hash the audio so duplicate recordings can be served from the response cache
+    with timed(timings, "hash"):
+        prepared["content_hash"] = content_hash or hash_file(file_path)
+    if cache_dir:
+        prepared["cache_key"] = response_cache_key(prepared["content_hash"], language_code, preprocess)
+        cached_response = read_cached_response(cache_dir, prepared["cache_key"])
+        if cached_response is not None and preprocess:
+            # Segment times and the trimmed duration need what trimming kept; entries cached
+            # without it are decoded again (transcribe_prepared still serves their response)
+            trimmed = cached_response.pop("preprocessed", None)
+            if trimmed is None:
+                cached_response = None
+            else:
+                prepared["kept_ranges"] = trimmed["kept_ranges"]
+                prepared["sent_seconds"] = trimmed["sent_seconds"]
+        if cached_response is not None:
+            with timed(timings, "probe"):
+                prepared["duration_seconds"] = probe_audio(file_path)["duration_seconds"]
+            prepared["cached_response"] = cached_response
+            prepared["payload_size"] = 0
+            return prepared
+    
+    if payload_strategy == "passthrough" and not preprocess:
+        with timed(timings, "probe"):
+            prepared["duration_seconds"] = probe_audio(file_path)["duration_seconds"]
+        if not chunk_seconds or prepared["duration_seconds"] <= chunk_seconds:
+            # Nothing is decoded or held in memory; the file is streamed when it is uploaded
+            prepared["payload_name"] = file_name
+            prepared["payload_path"] = file_path
+            prepared["payload_size"] = prepared["file_size"]
+            return prepared
+    
+    # Load the audio file
+    from pydub import AudioSegment
+    with timed(timings, "decode"):
+        audio = AudioSegment.from_file(file_path)
+    prepared["duration_seconds"] = len(audio) / 1000  # Duration in seconds
+    
+    if preprocess:
+        with timed(timings, "preprocess"):
+            audio, prepared["kept_ranges"] = preprocess_audio(audio, preprocess)
+        prepared["sent_seconds"] = len(audio) / 1000
+        if payload_strategy == "passthrough":
+            payload_strategy = prepared["payload_strategy"] = "compact"
+    
+    # Long calls are sent as overlapping chunks cut at silences
+    if chunk_seconds and len(audio) / 1000 > chunk_seconds:
+        # Chunks can't be passed through, so passthrough chunks use the compact encoding
+        chunk_strategy = "compact" if payload_strategy == "passthrough" else payload_strategy
+        prepared["chunks"] = []
+        with timed(timings, "split"):
+            chunk_ranges = find_chunk_ranges(audio, int(chunk_seconds * 1000))
+        for index, (start_ms, end_ms) in enumerate(chunk_ranges):
+            chunk_start_ms = max(0, start_ms - int(chunk_overlap_seconds * 1000))
+            with timed(timings, "encode"):
+                payload, payload_name = encode_audio(
+                    audio[chunk_start_ms:end_ms], chunk_strategy, compact_format, f"{stem}_part{index:03d}"
+                )
+            prepared["chunks"].append({
+                "offset_seconds": chunk_start_ms / 1000,
+                "start_seconds": start_ms / 1000,
+                "end_seconds": end_ms / 1000,
+                "payload_name": payload_name,
+                "payload": payload,
+            })
+        prepared["payload_size"] = sum(len(chunk["payload"]) for chunk in prepared["chunks"])
+        return prepared
+    
+    with timed(timings, "encode"):
+        prepared["payload"], prepared["payload_name"] = encode_audio(audio, payload_strategy, compact_format, stem)
+    prepared["payload_size"] = len(prepared["payload"])
+    return prepared
+
+PREPROCESS_DEFAULTS = {
+    "sample_rate": 16000,  # Speech models don't need more
+    "trim_silence": True,
+    "silence_threshold_db": -45.0,  # Frames quieter than this (dBFS) count as silence
+    "min_silence_seconds": 2.0,  # Shorter pauses are left alone
+    "keep_silence_seconds": 0.5,  # Silence kept at each edge of a cut
+}
+
+def find_speech_ranges(audio, threshold_db=-45.0, min_silence_ms=2000, keep_silence_ms=500, frame_ms=20):
+    """Return the (start_ms, end_ms) ranges of audio to keep when trimming silence.
+    
+    The energy of every frame_ms frame is computed in one vectorised pass. Leading and
+    trailing silence is cut to keep_silence_ms, and pauses longer than min_silence_ms
+    are shortened to keep_silence_ms on each side. Silent recordings are kept whole.
+    """
+    import numpy as np
+    
+    total_ms = len(audio)
+    samples = np.asarray(audio.get_array_of_samples(), dtype=np.float32) / float(1 << (8 * audio.sample_width - 1))
+    if audio.channels > 1:
+        samples = samples.reshape(-1, audio.channels).mean(axis=1)
+    frame = max(1, audio.frame_rate * frame_ms // 1000)
+    count = len(samples) // frame
+    if count == 0:
+        return [(0, total_ms)]
+    
+    energy = np.square(samples[:count * frame].reshape(count, frame)).mean(axis=1)
+    loud = 10 * np.log10(energy + 1e-12) > threshold_db
+    if not loud.any():
+        return [(0, total_ms)]
+    
+    # Start and end frames of each run of loud frames
+    edges = np.diff(np.concatenate(([0], loud.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1) * frame_ms
+    ends = np.flatnonzero(edges == -1) * frame_ms
+    
+    ranges = []
+    for start, end in zip(starts.tolist(), ends.tolist()):
+        if ranges and start - ranges[-1][1] <= max(min_silence_ms, 2 * keep_silence_ms):
+            ranges[-1][1] = end
+        else:
+            ranges.append([start, end])
+    return [(max(0, start - keep_silence_ms), min(total_ms, end + keep_silence_ms)) for start, end in ranges]
+
+def preprocess_audio(audio, options):
+    """Downmix to mono, resample and trim silence before upload.
+    
+    Returns the processed audio and the (start, end) seconds of the original that it
+    keeps, or None if nothing was trimmed.
+    """
+    kept_ranges = None
+    audio = audio.set_channels(1).set_sample_width(2)
+    if options.get("sample_rate"):
+        audio = audio.set_frame_rate(int(options["sample_rate"]))
+    if options.get("trim_silence"):
+        ranges = find_speech_ranges(
+            audio,
+            threshold_db=options["silence_threshold_db"],
+            min_silence_ms=int(options["min_silence_seconds"] * 1000),
+            keep_silence_ms=int(options["keep_silence_seconds"] * 1000),
+        )
+        if ranges != [(0, len(audio))]:
+            audio = audio._spawn(b"".join(audio[start:end].raw_data for start, end in ranges))
+            kept_ranges = [(start / 1000, end / 1000) for start, end in ranges]
+    return audio, kept_ranges
+
+def encode_audio(audio, payload_strategy, compact_format, stem):
+    """Encode decoded audio for upload, returning (payload bytes, payload file name)."""
+    buffer = io.BytesIO()
+    if payload_strategy == "compact":
+        # Speech models don't need more than mono 16 kHz; lower rates are kept as they are
+        audio = audio.set_channels(1)
+        if audio.frame_rate > 16000:
+            audio = audio.set_frame_rate(16000)
+        if compact_format == "opus":
+            audio.export(buffer, format="ogg", codec="libopus", bitrate="24k")
+            return buffer.getvalue(), f"{stem}.ogg"
+        audio.export(buffer, format="flac")
+        return buffer.getvalue(), f"{stem}.flac"
+    
+    # Convert to WAV in memory
+    audio.export(buffer, format="wav")
+    return buffer.getvalue(), f"{stem}.wav"
+
+def find_chunk_ranges(audio, max_chunk_ms, search_ms=30000, min_silence_ms=400):
+    """Split audio into (start_ms, end_ms) ranges of at most max_chunk_ms.
+
+    Each cut is placed in the middle of the latest silence found in the search_ms before
+    the length limit, so words are not split across chunks. Without a silence the
+    chunk is cut at the limit.
+    """
+    from pydub.silence import detect_silence
+    
+    total_ms = len(audio)
+    silence_thresh = audio.dBFS - 16 if audio.dBFS != float('-inf') else -60
+    
+    ranges = []
+    start_ms = 0
+    while total_ms - start_ms > max_chunk_ms:
+        limit_ms = start_ms + max_chunk_ms
+        window_start_ms = max(start_ms + max_chunk_ms // 2, limit_ms - search_ms)
+        silences = detect_silence(
+            audio[window_start_ms:limit_ms],
+            min_silence_len=min_silence_ms,
+            silence_thresh=silence_thresh,
+            seek_step=10,
+        )
+        if silences:
+            silence_start, silence_end = silences[-1]
+            cut_ms = window_start_ms + (silence_start + silence_end) // 2
+        else:
+            cut_ms = limit_ms
+        ranges.append((start_ms, cut_ms))
+        start_ms = cut_ms
+    ranges.append((start_ms, total_ms))
+    return ranges
+
+def _map_chunk_speakers(previous_words, chunk_words, overlap_end):
+    """Map a chunk's local speaker ids onto the speaker ids used so far.
+
+    Words both chunks transcribed in their overlap vote, weighted by how long they
+    overlap in time, for which earlier speaker each local speaker is. Speakers without
+    a match get new ids.
+    """
+    votes = {}
+    for word in chunk_words:
+        if word.get("type") != "word" or word.get("start") is None or word.get("end") is None:
+            continue
+        if word["start"] >= overlap_end:
+            continue
+        for other in previous_words:
+            if other.get("type") != "word" or other.get("start") is None or other.get("end") is None:
+                continue
+            overlap = min(word["end"], other["end"]) - max(word["start"], other["start"])
+            if overlap > 0 and word.get("speaker_id") and other.get("speaker_id"):
+                key = (word["speaker_id"], other["speaker_id"])
+                votes[key] = votes.get(key, 0) + overlap
+    
+    mapping = {}
+    used = set()
+    for (local, known), _ in sorted(votes.items(), key=lambda item: item[1], reverse=True):
+        if local not in mapping and known not in used:
+            mapping[local] = known
+            used.add(known)
+    return mapping
+
+def stitch_chunk_responses(chunks, responses):
+    """Combine per-chunk responses into one response on the timeline of the whole call.
+
+    Word times are shifted by each chunk's offset. In the overlap before each cut the
+    earlier chunk's words are kept, and the later chunk's are only used to reconcile
+    speaker ids across the cut, so speaker counts stay meaningful. A space is kept
+    between the words either side of each cut.
+    """
+    words = []
+    texts = []
+    known_speakers = set()
+    for chunk, response in zip(chunks, responses):
+        offset = chunk["offset_seconds"]
+        chunk_words = []
+        for word in response.get("words") or []:
+            word = dict(word)
+            for field in ("start", "end"):
+                if word.get(field) is not None:
+                    word[field] += offset
+            chunk_words.append(word)
+        
+        if not chunk_words:
+            texts.append((response.get("text") or "").strip())
+            continue
+        
+        mapping = _map_chunk_speakers(words, chunk_words, chunk["start_seconds"]) if words else {}
+        for local in sorted({word["speaker_id"] for word in chunk_words if word.get("speaker_id")}):
+            if local not in mapping:
+                # A new speaker keeps its id unless an earlier speaker already has it
+                new_id, suffix = local, len(known_speakers)
+                while new_id in known_speakers:
+                    new_id, suffix = f"speaker_{suffix}", suffix + 1
+                mapping[local] = new_id
+            known_speakers.add(mapping[local])
+        
+        kept = [word for word in chunk_words if word.get("start") is None or word["start"] >= chunk["start_seconds"]]
+        for word in kept:
+            if word.get("speaker_id"):
+                word["speaker_id"] = mapping[word["speaker_id"]]
+        if words and kept and "spacing" not in (words[-1].get("type"), kept[0].get("type")):
+            # The spacing before the first kept word started before the cut and was dropped
+            words.append({
+                "text": " ", "type": "spacing", "start": words[-1].get("end"), "end": kept[0].get("start"),
+                "speaker_id": words[-1].get("speaker_id"),
+            })
+        words.extend(kept)
+        texts.append("".join(word.get("text") or "" for word in kept).strip())
+    
+    return {
+        "language_code": responses[0].get("language_code") if responses else None,
+        "text": " ".join(text for text in texts if text),
+        "words": words,
+        "chunks": len(chunks),
+    }
+
+def payload_memory(prepared):
+    """Number of bytes a prepared payload holds in memory."""
+    return len(prepared.get("payload") or b"") + sum(len(chunk["payload"]) for chunk in prepared.get("chunks", []))
+
+def format_bytes(num_bytes):
+    """Format a byte count for log output."""
+    for unit in ["B", "KB", "MB", "GB"]:
+        if abs(num_bytes) < 1024:
+            return f"{num_bytes:.1f} {unit}"
+        num_bytes /= 1024
+    return f"{num_bytes:.1f} TB"
+
+def call_convert(client, payload_name, payload_file, language_code, audio_seconds=0, run=None):
+    """Make one speech-to-text request within the concurrency limit of run (a PipelineRun).
+
+    client is an APIKeyPool or a plain ElevenLabs client. With a pool, a request
+    rejected because of its key is sent again with the next key.
+    """
+    rate_limiter = run.limiter if run else None
+    metrics = run.metrics if run else None
+    while True:
+        key = client.acquire() if isinstance(client, APIKeyPool) else None
+        api_client = key.client if key else client
+        if rate_limiter:
+            rate_limiter.acquire()
+        started = time.monotonic()
+        try:
+            payload_file.seek(0)
+            transcription = api_client.speech_to_text.convert(
+                file=(payload_name, payload_file),
+                language_code=language_code,
+                # Retries belong to the pipeline, so the limiter and key pool see every 429 and true latency
+                request_options={"max_retries": 0},
+                **TRANSCRIPTION_OPTIONS,
+            )
+        except Exception as e:
+            if rate_limiter:
+                rate_limiter.release(throttled=getattr(e, "status_code", None) == 429)
+            if metrics:
+                metrics.inc("api_requests_total", status=str(getattr(e, "status_code", None) or type(e).__name__))
+            if key:
+                client.release(key, error=e)
+                if key.disabled_reason is not None:
+                    continue
+            raise
+        
+        if rate_limiter:
+            rate_limiter.release(time.monotonic() - started, audio_seconds)
+        if metrics:
+            metrics.observe("request", time.monotonic() - started)
+            metrics.inc("api_requests_total", status="200")
+        if key:
+            client.release(key, audio_seconds)
+        return transcription_to_dict(transcription)
+
+def transcribe_chunks(client, prepared, language_code, cache_dir=None, run=None):
+    """Transcribe the chunks of a long call concurrently and stitch the responses together.
+
+    With a cache_dir each chunk's response is cached, so a retry after one chunk failed
+    only pays for the chunks that are missing.
+    """
+    def transcribe_chunk(chunk):
+        chunk_key = None
+        if cache_dir:
+            chunk_range = f"{chunk['offset_seconds']}-{chunk['end_seconds']}"
+            chunk_key = response_cache_key(
+                f"{prepared['content_hash']}:{chunk_range}", language_code, prepared.get("preprocess")
+            )
+            cached_response = read_cached_response(cache_dir, chunk_key)
+            if cached_response is not None:
+                return cached_response
+        response = call_convert(
+            client, chunk["payload_name"], io.BytesIO(chunk["payload"]), language_code,
+            chunk["end_seconds"] - chunk["offset_seconds"], run,
+        )
+        if chunk_key:
+            write_cached_response(cache_dir, chunk_key, response)
+        return response
+    
+    # API concurrency is bounded by the run's limiter, not by this pool
+    with ThreadPoolExecutor(max_workers=len(prepared["chunks"]), thread_name_prefix="chunk") as executor:
+        responses = list(executor.map(transcribe_chunk, prepared["chunks"]))
+    logger.info(f"Transcribed {prepared['file_name']} in {len(responses)} chunks")
+    return stitch_chunk_responses(prepared["chunks"], responses)
+
+def request_transcription(client, prepared, language_code, cache_dir=None, run=None):
+    """Get the API response for a prepared payload, as plain data."""
+    if "chunks" in prepared:
+        return transcribe_chunks(client, prepared, language_code, cache_dir, run)
+    
+    # Stream passthrough payloads straight from disk
+    if "payload_path" in prepared:
+        with open(prepared["payload_path"], "rb") as payload_file:
+            return call_convert(
+                client, prepared["payload_name"], payload_file, language_code, prepared["duration_seconds"], run,
+            )
+    return call_convert(
+        client, prepared["payload_name"], io.BytesIO(prepared["payload"]), language_code,
+        prepared.get("sent_seconds", prepared["duration_seconds"]), run,
+    )
+
+def transcribe_prepared(client, prepared, language_code="hin", cache_dir=None, run=None):
+    """Send a prepared payload to the ElevenLabs API and build the result row.
+
+    With a cache_dir, responses are served from and written to the on-disk cache, and
+    a file whose content is already being transcribed waits for that request instead
+    of paying for a second one. Requests and cache hits are counted on run, a
+    PipelineRun. API errors are raised for the caller to classify.
+    """
+    if run is None:
+        run = PipelineRun()
+    
+    file_name = prepared["file_name"]
+    content_hash = prepared.get("content_hash")
+    cache_key = prepared.get("cache_key")
+    owns_hash = False
+    
+    try:
+        response = prepared.get("cached_response")
+        
+        # Wait for any in-flight request for the same audio, then check the cache again
+        while response is None and cache_dir and content_hash and not owns_hash:
+            with inflight_lock:
+                event = inflight_hashes.get(content_hash)
+                if event is None:
+                    inflight_hashes[content_hash] = threading.Event()
+                    owns_hash = True
+            if not owns_hash:
+                event.wait()
+            response = read_cached_response(cache_dir, cache_key)
+            if response is not None:
+                response.pop("preprocessed", None)  # this copy was decoded and trimmed itself
+        
+        if response is not None:
+            run.record_cache_hit()
+            prepared["served_from_cache"] = True
+            logger.info(f"Using cached transcription for {file_name}")
+        else:
+            # Upload and API processing happen in one request, so they are timed together
+            with timed(prepared.setdefault("timings", {}), "upload"):
+                response = request_transcription(client, prepared, language_code, cache_dir, run)
+            run.record_upload(prepared)
+            if cache_dir and cache_key:
+                cached_response = response
+                if prepared.get("sent_seconds") is not None:
+                    # A later cache hit is not decoded, so keep what trimming did with the response
+                    cached_response = dict(response, preprocessed={
+                        "kept_ranges": prepared.get("kept_ranges"),
+                        "sent_seconds": prepared["sent_seconds"],
+                    })
+                write_cached_response(cache_dir, cache_key, cached_response)
+        
+        # Create a structured result
+        result = {
+            "file_name": file_name,
+            "file_date": prepared["file_date"],
+            "duration_seconds": prepared["duration_seconds"],
+            "transcription": response.get("text"),
+            "speakers": count_speakers(response),
+            "content_hash": content_hash,
+            "trimmed_duration_seconds": prepared.get("sent_seconds"),
+            "language_code": response.get("language_code"),
+            "segments": build_segments(response, prepared.get("kept_ranges")),
+        }
+        
+        logger.info(f"Successfully transcribed {file_name} ({prepared['duration_seconds']:.1f} sec)")
+        return result
+    
+    finally:
+        if owns_hash:
+            with inflight_lock:
+                inflight_hashes.pop(content_hash).set()
+
+def _init_decode_worker():
+    """Let the parent process own SIGINT/SIGTERM handling; workers just finish their job."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+RETRYABLE_STATUS_CODES = {408, 409, 425, 429, 500, 502, 503, 504}
+RETRYABLE_EXCEPTION_NAMES = {
+    # httpx transport errors, matched by name so httpx needn't be imported here
+    "TimeoutException", "ConnectTimeout", "ReadTimeout", "WriteTimeout", "PoolTimeout",
+    "NetworkError", "ConnectError", "ReadError", "WriteError", "RemoteProtocolError",
+}
+
+def _retry_after_seconds(headers):
+    """Parse a Retry-After header given as seconds or as an HTTP date."""
+    if not headers:
+        return None
+    value = next((v for k, v in headers.items() if k.lower() == "retry-after"), None)
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+def classify_error(error):
+    """Return ("retryable" or "permanent", Retry-After seconds or None) for a failure.
+
+    Rate limits, server errors, timeouts, dropped connections and decode workers that
+    died are retryable. Rejected requests (bad audio, unsupported format, auth) and anything unrecognised
+    are permanent, so they are not paid for again without being re-driven.
+    """
+    status_code = getattr(error, "status_code", None)
+    if isinstance(status_code, int):
+        if status_code in RETRYABLE_STATUS_CODES or status_code >= 500:
+            return "retryable", _retry_after_seconds(getattr(error, "headers", None))
+        return "permanent", None
+    
+    if isinstance(error, (ConnectionError, TimeoutError, BrokenExecutor)):
+        return "retryable", None
+    if any(cls.__name__ in RETRYABLE_EXCEPTION_NAMES for cls in type(error).__mro__):
+        return "retryable", None
+    return "permanent", None
+
+def compute_backoff(attempt, base_seconds=2.0, max_seconds=120.0, retry_after=None):
+    """Full-jitter exponential backoff for the given attempt, never shorter than Retry-After."""
+    delay = random.uniform(0, min(max_seconds, base_seconds * 2 ** attempt))
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+def run_transcription_pipeline(client, file_paths, language_code, max_concurrency,
+                               decode_workers=0, max_prepared=None, max_prepared_bytes=None,
+                               payload_strategy="wav", compact_format="flac", on_start=None,
+                               known_hashes=None, cache_dir=None, chunk_seconds=None, chunk_overlap_seconds=4,
+                               max_retries=5, retry_base_seconds=2.0, retry_max_seconds=120.0,
+                               adaptive_concurrency=True, initial_concurrency=None, min_concurrency=1,
+                               preprocess=None, input_folder=None, run=None):
+    """Decode audio and upload it to the API as two overlapping stages.
+
+    Decoding runs on a process pool of decode_workers processes (or on threads when it is
+    0) while up to max_concurrency uploads are in flight. Prepared payloads waiting for or
+    undergoing upload are capped at max_prepared items and max_prepared_bytes bytes of
+    in-memory payload (passthrough payloads stay on disk and don't count); new decodes
+    are only started while both caps have room, so the byte cap can be exceeded by at
+    most the payloads of the decodes already running.
+
+    known_hashes maps file paths to content hashes that don't need computing again, and
+    cache_dir enables the response cache (see prepare_audio and transcribe_prepared).
+    chunk_seconds enables splitting long calls; chunk requests share the same limit on
+    requests in flight. preprocess options are passed on to prepare_audio, so
+    downmixing, resampling and silence trimming run on the decode workers. With
+    input_folder, results are named by their path relative to it (see result_file_name).
+    
+    With adaptive_concurrency, that limit starts at initial_concurrency and moves
+    between min_concurrency and max_concurrency with the observed latency and 429s
+    (see AdaptiveConcurrencyLimiter); otherwise it is fixed at max_concurrency.
+    on_start, if given, is called with each file path as its decode is submitted.
+    file_paths may be a long-lived iterator that yields NO_FILE_YET while it has nothing
+    to hand out; the pipeline then keeps serving what is in flight and asks again.
+    
+    Uploads that fail with a retryable error (see classify_error) go to a retry queue
+    and are sent again, up to max_retries times, after a jittered exponential backoff
+    that honours Retry-After. The decoded payload is kept, so retries don't decode again.
+    If a decode worker process dies (e.g. killed for running out of memory), the pool
+    is restarted and the files it was decoding are decoded again one at a time; only a
+    file whose worker dies while it is decoded alone is given up on, with the
+    BrokenProcessPool as its (retryable) error.
+    
+    Yields (file_path, result, error) tuples in completion order, where error is the
+    exception of a file that failed for good. run is the PipelineRun holding this call's
+    limiter and counters (a new one by default). Once run.stop() has been called no new
+    files are decoded and decoded-but-unsent payloads and pending retries are dropped
+    (they are picked up again on the next run), but uploads already in flight are drained.
+    """
+    if run is None:
+        run = PipelineRun()
+    metrics = run.metrics
+    
+    max_concurrency = max(1, max_concurrency)
+    run.limiter = AdaptiveConcurrencyLimiter(
+        initial_concurrency or max_concurrency,
+        minimum=min_concurrency,
+        maximum=max_concurrency,
+        adaptive=adaptive_concurrency,
+    )
+    if metrics:
+        metrics.limiter = run.limiter
+    if max_prepared is None:
+        max_prepared = max_concurrency * 2
+    max_prepared = max(max_concurrency, max_prepared)
+    if max_prepared_bytes is None:
+        max_prepared_bytes = float('inf')
+    
+    def new_decode_executor():
+        if decode_workers > 0:
+            return ProcessPoolExecutor(max_workers=decode_workers, initializer=_init_decode_worker)
+        return ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="decode")
+    
+    def restart_decode_pool():
+        """Replace a broken process pool, queueing the decodes it lost as suspects."""
+        nonlocal decode_executor
+        if suspects or decoding:
+            logger.warning(
+                f"A decode worker died. Restarting the pool and decoding "
+                f"{len(suspects) + len(decoding)} files again one at a time."
+            )
+        suspects.extend(decoding.values())
+        decoding.clear()
+        decode_executor.shutdown(wait=False, cancel_futures=True)
+        decode_executor = new_decode_executor()
+    
+    decode_executor = new_decode_executor()
+    upload_executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="upload")
+    
+    file_iter = iter(file_paths)
+    files_exhausted = False
+    decoding = {}
+    suspects = deque()  # files that were decoding when a worker died
+    isolated = None  # the suspect being decoded on its own
+    uploading = {}
+    ready = deque()
+    retry_queue = []  # heap of (due time, sequence, prepared payload)
+    retry_sequence = 0
+    prepared_bytes = 0
+    
+    try:
+        while True:
+            # Start decodes while the in-memory payload caps have room
+            while (not run.stopping and (suspects or not files_exhausted)
+                   and len(decoding) + len(ready) + len(uploading) < max_prepared
+                   and prepared_bytes < max_prepared_bytes):
+                if suspects:
+                    # One at a time, so a file that kills its worker only takes itself down
+                    if decoding:
+                        break
+                    file_path = isolated = suspects.popleft()
+                else:
+                    file_path = next(file_iter, None)
+                    if file_path is None:
+                        files_exhausted = True
+                        break
+                    if file_path is NO_FILE_YET:
+                        break
+                    if on_start:
+                        on_start(file_path)
+                try:
+                    future = decode_executor.submit(
+                        prepare_audio, file_path, payload_strategy, compact_format,
+                        known_hashes.get(file_path) if known_hashes else None, cache_dir, language_code,
+                        chunk_seconds, chunk_overlap_seconds, preprocess, input_folder,
+                    )
+                except BrokenProcessPool:
+                    # A worker died since the last results were collected
+                    isolated = None
+                    suspects.appendleft(file_path)
+                    restart_decode_pool()
+                    break
+                decoding[future] = file_path
+            
+            # On exit, drop queued decodes and payloads that have not been sent yet
+            if run.stopping:
+                for future in [f for f in decoding if f.cancel()]:
+                    del decoding[future]
+                if ready or retry_queue:
+                    logger.info(f"Exit requested. Dropping {len(ready) + len(retry_queue)} decoded files that were not yet sent.")
+                    prepared_bytes -= sum(payload_memory(prepared) for prepared in ready)
+                    prepared_bytes -= sum(payload_memory(prepared) for _, _, prepared in retry_queue)
+                    ready.clear()
+                    retry_queue.clear()
+            
+            # Retries that are due go ahead of new files
+            while retry_queue and retry_queue[0][0] <= time.monotonic():
+                ready.appendleft(heapq.heappop(retry_queue)[2])
+            
+            # Hand prepared payloads to free upload slots
+            while ready and len(uploading) < max_concurrency:
+                prepared = ready.popleft()
+                if "ready_at" in prepared:
+                    # Time a decoded payload waited for an upload slot
+                    timings = prepared.setdefault("timings", {})
+                    timings["queued"] = timings.get("queued", 0.0) + time.monotonic() - prepared.pop("ready_at")
+                logger.info(f"Transcribing: {prepared['file_name']} ({run.files_finished} finished so far)")
+                uploading[upload_executor.submit(
+                    transcribe_prepared, client, prepared, language_code, cache_dir, run,
+                )] = prepared
+            
+            if not decoding and not uploading and not ready and not retry_queue and ((files_exhausted and not suspects) or run.stopping):
+                break
+            
+            # Wake up periodically so an exit request stops new work promptly
+            timeout = 1
+            if retry_queue:
+                timeout = min(timeout, max(0.0, retry_queue[0][0] - time.monotonic()))
+            if not decoding and not uploading:
+                time.sleep(timeout)
+                continue
+            done, _ = wait(list(decoding) + list(uploading), timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future in decoding:
+                    file_path = decoding.pop(future)
+                    was_isolated = file_path == isolated
+                    if was_isolated:
+                        isolated = None
+                    try:
+                        prepared = future.result()
+                    except BrokenProcessPool as e:
+                        if not was_isolated:
+                            suspects.appendleft(file_path)
+                            restart_decode_pool()
+                            continue
+                        # Its worker died while it was decoded alone, so this file is the cause
+                        logger.error(f"Decode worker died while preparing {file_path}: {str(e)}")
+                        restart_decode_pool()
+                        run.record_finished()
+                        if metrics:
+                            metrics.file_finished(file_path, error=e)
+                        yield file_path, None, e
+                        continue
+                    except Exception as e:
+                        logger.error(f"Error preparing {file_path}: {str(e)}")
+                        run.record_finished()
+                        if metrics:
+                            metrics.file_finished(file_path, error=e)
+                        yield file_path, None, e
+                        continue
+                    if run.stopping:
+                        continue
+                    prepared_bytes += payload_memory(prepared)
+                    prepared["ready_at"] = time.monotonic()
+                    ready.append(prepared)
+                elif future in uploading:  # not a decode of a pool that was restarted
+                    prepared = uploading.pop(future)
+                    try:
+                        result = future.result()
+                    except NoUsableAPIKeys as e:
+                        # Nothing more can be sent this run; stop and leave the file for the next one
+                        logger.critical(f"{str(e)}. Stopping the run.")
+                        run.stop()
+                        prepared_bytes -= payload_memory(prepared)
+                        continue
+                    except Exception as e:
+                        kind, retry_after = classify_error(e)
+                        attempt = prepared.get("attempts", 0) + 1
+                        prepared["attempts"] = attempt
+                        if kind == "retryable" and attempt <= max_retries and not run.stopping:
+                            delay = compute_backoff(attempt - 1, retry_base_seconds, retry_max_seconds, retry_after)
+                            logger.warning(
+                                f"Retryable error for {prepared['file_name']} ({str(e)}). "
+                                f"Retrying in {delay:.1f}s (attempt {attempt}/{max_retries})"
+                            )
+                            heapq.heappush(retry_queue, (time.monotonic() + delay, retry_sequence, prepared))
+                            retry_sequence += 1
+                            if metrics:
+                                metrics.inc("retries_total")
+                            continue
+                        logger.error(f"Error transcribing {prepared['file_path']} ({kind}): {str(e)}")
+                        result = None
+                        error = e
+                    else:
+                        error = None
+                    
+                    prepared_bytes -= payload_memory(prepared)
+                    run.record_finished()
+                    if metrics:
+                        metrics.file_finished(prepared["file_path"], prepared, error)
+                    yield prepared["file_path"], result, error
+    finally:
+        for future in decoding:
+            future.cancel()
+        upload_executor.shutdown(wait=True)
+        decode_executor.shutdown(wait=True)
+        if adaptive_concurrency:
+            logger.info(f"Final concurrency limit: {int(run.limiter.limit)} (max {max_concurrency})")
+        if metrics:
+            metrics.limiter = None
+
+def transcribe_many(paths, client=None, language_code="hin", max_concurrency=4, **options):
+    """Transcribe audio files and yield (file_path, result, error) as each one finishes.
+
+    The entry point for using this module as a library: nothing is configured or written
+    besides the optional response cache, and log records go to the caller's logging
+    setup. paths is any iterable of files, e.g. iter_audio_files(folder). client
+    defaults to the key pool built by setup_environment from ELEVENLABS_API_KEY(S).
+    Other options are passed to run_transcription_pipeline (payload_strategy,
+    decode_workers, cache_dir, preprocess, max_retries, run, ...); decoding runs on threads
+    unless decode_workers is given. Pass run=PipelineRun() to stop the call from another
+    thread or read its upload and cache counters. Results are the rows the CLI stores,
+    and error is the exception of a file that failed for good. Closing the generator
+    early waits for the requests already in flight.
+    """
+    if client is None:
+        # Only the process environment is read; a .env file is the application's business
+        client = setup_environment(load_env_file=False)
+        if client is None:
+            raise ValueError("No ElevenLabs client: set ELEVENLABS_API_KEY or pass client")
+    yield from run_transcription_pipeline(client, paths, language_code, max_concurrency, **options)
+
+def save_transcriptions(results, csv_path):
+    """Save transcription results to CSV file with version control and protection against data loss."""
+    import pandas as pd
+    
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    
+    try:
+        # Backups are taken per checkpoint by BackupSet, so only the merge happens here
+        if os.path.exists(csv_path):
+            # Load existing data
+            try:
+                existing_df = pd.read_csv(csv_path)
+                new_df = pd.DataFrame(results)
+                
+                # Check for duplicates before combining
+                duplicate_files = set(existing_df['file_name']).intersection(set(new_df['file_name']))
+                if duplicate_files:
+                    logger.warning(f"Found {len(duplicate_files)} duplicate files. Using new transcriptions for these files.")
+                    # Remove duplicates from existing data
+                    existing_df = existing_df[~existing_df['file_name'].isin(duplicate_files)]
+                
+                # Combine with existing data
+                combined_df = pd.concat([existing_df, new_df], ignore_index=True)
+            except Exception as e:
+                logger.error(f"Error processing existing data: {str(e)}")
+                return False
+        else:
+            combined_df = pd.DataFrame(results)
+        
+        # Write to a temporary file first to prevent corruption
+        temp_file = f"{csv_path}.temp"
+        combined_df.to_csv(temp_file, index=False)
+        
+        # If temporary write succeeds, rename to final file
+        if os.path.exists(temp_file):
+            if os.path.exists(csv_path):
+                os.replace(temp_file, csv_path)  # Atomic operation
+            else:
+                os.rename(temp_file, csv_path)
+            
+            logger.info(f"Successfully saved {len(results)} new transcriptions. Total records: {len(combined_df)}")
+            return True
+        else:
+            logger.error("Failed to write temporary file")
+            return False
+            
+    except Exception as e:
+        logger.error(f"Error saving transcriptions to CSV: {str(e)}")
+        
+        # Emergency backup - save new transcriptions to a separate file
+        try:
+            error_backup_path = f"new_transcriptions_{timestamp}.csv"
+            pd.DataFrame(results).to_csv(error_backup_path, index=False)
+            logger.info(f"Created emergency backup of new transcriptions at {error_backup_path}")
+        except Exception as backup_error:
+            logger.critical(f"Failed to create emergency backup: {str(backup_error)}")
+        
+        return False
+
+RESULT_COLUMNS = ["file_name", "file_date", "duration_seconds", "transcription", "speakers"]
+STORE_COLUMNS = RESULT_COLUMNS + ["content_hash", "trimmed_duration_seconds"]
+
+class SQLiteResultStore:
+    """Transcription results in a SQLite database in WAL mode, upserted by file name.
+
+    Each checkpoint only writes the rows of its batch. Rows keep the order in which
+    they were last written, so an export matches the layout of the old CSV output.
+    """
+    
+    kind = "sqlite"
+    
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS transcriptions (
+                file_name TEXT PRIMARY KEY,
+                file_date TEXT,
+                duration_seconds REAL,
+                transcription TEXT,
+                speakers INTEGER,
+                seq INTEGER NOT NULL,
+                updated_at TEXT,
+                content_hash TEXT,
+                trimmed_duration_seconds REAL
+            )"""
+        )
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(transcriptions)")}
+        if "content_hash" not in columns:
+            self.conn.execute("ALTER TABLE transcriptions ADD COLUMN content_hash TEXT")
+        if "trimmed_duration_seconds" not in columns:
+            self.conn.execute("ALTER TABLE transcriptions ADD COLUMN trimmed_duration_seconds REAL")
+        self.conn.commit()
+        self.next_seq = (self.conn.execute("SELECT MAX(seq) FROM transcriptions").fetchone()[0] or 0) + 1
+    
+    def upsert(self, results):
+        """Insert or replace the given rows, keyed by file name."""
+        now = datetime.now().isoformat(timespec='seconds')
+        rows = []
+        for result in results:
+            rows.append(tuple(result.get(column) for column in STORE_COLUMNS) + (self.next_seq, now))
+            self.next_seq += 1
+        with self.conn:
+            self.conn.executemany(
+                """INSERT INTO transcriptions
+                    (file_name, file_date, duration_seconds, transcription, speakers, content_hash,
+                     trimmed_duration_seconds, seq, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(file_name) DO UPDATE SET
+                    file_date = excluded.file_date,
+                    duration_seconds = excluded.duration_seconds,
+                    transcription = excluded.transcription,
+                    speakers = excluded.speakers,
+                    content_hash = excluded.content_hash,
+                    trimmed_duration_seconds = excluded.trimmed_duration_seconds,
+                    seq = excluded.seq,
+                    updated_at = excluded.updated_at""",
+                rows,
+            )
+    
+    def file_names(self):
+        """Return the set of file names that have a stored transcription (not an old error row)."""
+        return {
+            row[0] for row in self.conn.execute(
+                "SELECT file_name FROM transcriptions WHERE transcription IS NULL OR transcription NOT LIKE 'ERROR:%'"
+            )
+        }
+    
+    def count(self):
+        return self.conn.execute("SELECT COUNT(*) FROM transcriptions").fetchone()[0]
+    
+    def iter_rows(self):
+        """Yield stored rows as dicts, in the order they were last written."""
+        cursor = self.conn.execute(f"SELECT {', '.join(RESULT_COLUMNS)} FROM transcriptions ORDER BY seq")
+        for row in cursor:
+            yield dict(zip(RESULT_COLUMNS, row))
+    
+    def close(self):
+        self.conn.close()
+
+class JSONLResultStore:
+    """Append-only JSON Lines result store, upserted by file name.
+
+    Each checkpoint appends its rows; the last line for a file name wins. The file is
+    rewritten without superseded lines once they outnumber the live ones.
+    """
+    
+    kind = "jsonl"
+    
+    def __init__(self, path, min_compact_lines=1000):
+        self.path = path
+        self.min_compact_lines = min_compact_lines
+        self.line_count = 0
+        self.names = set()
+        self.error_names = set()  # names whose latest row is an old "ERROR: ..." row
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        self._track(json.loads(line))
+                        self.line_count += 1
+    
+    def _track(self, row):
+        self.names.add(row["file_name"])
+        if str(row.get("transcription") or "").startswith("ERROR:"):
+            self.error_names.add(row["file_name"])
+        else:
+            self.error_names.discard(row["file_name"])
+    
+    def upsert(self, results):
+        """Append the given rows; earlier rows for the same file names become stale."""
+        with open(self.path, 'a', encoding='utf-8') as f:
+            for result in results:
+                f.write(json.dumps({column: result.get(column) for column in STORE_COLUMNS}, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.line_count += len(results)
+        for result in results:
+            self._track(result)
+        
+        stale_lines = self.line_count - len(self.names)
+        if stale_lines >= self.min_compact_lines and stale_lines > len(self.names):
+            self.compact()
+    
+    def compact(self):
+        """Rewrite the file keeping only the latest row for each file name."""
+        rows = list(self.iter_rows())
+        temp_file = f"{self.path}.temp"
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            for row in rows:
+                f.write(json.dumps(row, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_file, self.path)
+        logger.info(f"Compacted {self.path}: {self.line_count} lines -> {len(rows)}")
+        self.line_count = len(rows)
+    
+    def file_names(self):
+        return self.names - self.error_names
+    
+    def count(self):
+        return len(self.names)
+    
+    def iter_rows(self):
+        """Yield the latest row for each file name, in the order they were last written."""
+        if not os.path.exists(self.path):
+            return
+        latest = {}
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    row = json.loads(line)
+                    latest.pop(row["file_name"], None)
+                    latest[row["file_name"]] = row
+        yield from latest.values()
+    
+    def close(self):
+        pass
+
+class CSVResultStore:
+    """The original output: the whole CSV is merged and rewritten on every checkpoint."""
+    
+    kind = "csv"
+    
+    def __init__(self, path):
+        self.path = path
+    
+    def upsert(self, results):
+        results = [{column: result.get(column) for column in RESULT_COLUMNS} for result in results]
+        if not save_transcriptions(results, self.path):
+            raise IOError(f"Failed to save transcriptions to {self.path}")
+    
+    def file_names(self):
+        if not os.path.exists(self.path):
+            return set()
+        import pandas as pd
+        df = pd.read_csv(self.path, usecols=["file_name", "transcription"])
+        return set(df.loc[~df["transcription"].astype(str).str.startswith("ERROR:"), "file_name"])
+    
+    def count(self):
+        return len(self.file_names())
+    
+    def iter_rows(self):
+        if os.path.exists(self.path):
+            import pandas as pd
+            yield from pd.read_csv(self.path).to_dict(orient="records")
+    
+    def close(self):
+        pass
+
+RESULT_STORES = {
+    "sqlite": (SQLiteResultStore, ".sqlite3"),
+    "jsonl": (JSONLResultStore, ".jsonl"),
+    "csv": (CSVResultStore, ".csv"),
+}
+
+def worker_name_suffix(worker_id):
+    """Name suffix for the files owned by one worker when several share the output folder."""
+    return f".worker-{worker_id}" if worker_id else ""
+
+def result_store_path(kind, output_csv, path=None, worker_id=None):
+    """Where a run keeps its result store: path if given, else next to output_csv."""
+    if kind not in RESULT_STORES:
+        raise ValueError(f"Unknown result store '{kind}'. Expected one of: {', '.join(RESULT_STORES)}")
+    _, suffix = RESULT_STORES[kind]
+    if path:
+        return path
+    if kind == "csv" and not worker_id:
+        return output_csv
+    return f"{os.path.splitext(output_csv)[0]}{worker_name_suffix(worker_id)}{suffix}"
+
+def open_result_store(kind, output_csv, path=None, worker_id=None):
+    """Open the result store for a run, importing an existing output CSV into a new store."""
+    path = result_store_path(kind, output_csv, path, worker_id)
+    store = RESULT_STORES[kind][0](path)
+    if kind == "csv":
+        return store
+    
+    if store.count() == 0 and os.path.exists(output_csv):
+        import pandas as pd
+        existing = pd.read_csv(output_csv).to_dict(orient="records")
+        store.upsert(existing)
+        logger.info(f"Imported {len(existing)} existing transcriptions from {output_csv} into {store.path}")
+    return store
+
+def worker_store_paths(kind, output_csv):
+    """Find the result stores written by every worker of a multi-host run."""
+    _, suffix = RESULT_STORES[kind]
+    pattern = f"{glob.escape(os.path.splitext(output_csv)[0])}{worker_name_suffix('*')}{suffix}"
+    return sorted(path for path in glob.glob(pattern) if not path.endswith(".manifest.sqlite3"))
+
+def export_csv(stores, csv_path):
+    """Write every stored result to csv_path in the layout of the original output CSV.
+    
+    Accepts one store or a list of them, e.g. one per worker; a file found in more
+    than one store is written once.
+    """
+    if not isinstance(stores, (list, tuple)):
+        stores = [stores]
+    temp_file = f"{csv_path}.temp"
+    count = 0
+    written = set()
+    with open(temp_file, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=RESULT_COLUMNS, extrasaction='ignore')
+        writer.writeheader()
+        for store in stores:
+            for row in store.iter_rows():
+                if len(stores) > 1:
+                    if row["file_name"] in written:
+                        continue
+                    written.add(row["file_name"])
+                writer.writerow(row)
+                count += 1
+    os.replace(temp_file, csv_path)
+    logger.info(f"Exported {count} transcriptions from {', '.join(store.path for store in stores)} to {csv_path}")
+    return count
+
+FINISHED_STATES = ("done", "failed", "dead_letter")
+
+def default_manifest_path(output_csv, worker_id=None):
+    return f"{os.path.splitext(output_csv)[0]}{worker_name_suffix(worker_id)}.manifest.sqlite3"
+
+def default_journal_path(output_csv, worker_id=None):
+    return f"{os.path.splitext(output_csv)[0]}{worker_name_suffix(worker_id)}.journal.jsonl"
+
+def storage_config():
+    """Where a run reads and writes: the input folder, result store, manifest and journal, from the environment."""
+    output_csv = os.getenv("OUTPUT_CSV", DEFAULT_OUTPUT_CSV)
+    result_store = os.getenv("RESULT_STORE", "sqlite")  # sqlite, jsonl or csv
+    result_store_path_override = os.getenv("RESULT_STORE_PATH")  # Defaults to OUTPUT_CSV with the store's extension
+    lease_dir = os.getenv("LEASE_DIR")  # Shared folder for claiming files across hosts (unset = single worker)
+    worker_id = os.getenv("WORKER_ID", socket.gethostname()) if lease_dir else None  # Must be unique per worker
+    return {
+        "input_folder": os.getenv("INPUT_FOLDER", DEFAULT_INPUT_FOLDER),
+        "output_csv": output_csv,
+        "result_store": result_store,
+        "result_store_path": result_store_path_override,
+        "store_path": result_store_path(result_store, output_csv, result_store_path_override, worker_id),
+        "lease_dir": lease_dir,
+        "worker_id": worker_id,
+        "manifest_path": os.getenv("MANIFEST_PATH", default_manifest_path(output_csv, worker_id)),
+        # Defaults to OUTPUT_CSV with a .journal.jsonl extension
+        "journal_path": os.getenv("JOURNAL_PATH") or default_journal_path(output_csv, worker_id),
+    }
+
+def stored_file_names(config):
+    """File names already in a run's result store (or its output CSV), read without creating or importing anything."""
+    if os.path.exists(config["store_path"]):
+        store = RESULT_STORES[config["result_store"]][0](config["store_path"])
+        try:
+            return store.file_names()
+        finally:
+            store.close()
+    if os.path.exists(config["output_csv"]):
+        return CSVResultStore(config["output_csv"]).file_names()
+    return set()
+
+class LeaseDirectory:
+    """Per-file leases in a directory shared by several workers, e.g. on NFS.
+
+    A lease is a file created with O_EXCL, so only one worker can hold it. Holders
+    touch their lease files every ttl/3 seconds; a lease not touched for ttl seconds
+    belongs to a crashed worker and is reclaimed by renaming it away, which only one
+    worker can do. The renamed file is checked again, so a fresh lease that another
+    worker took in the meantime is put back rather than stolen. Finished files get a
+    marker so no worker claims them again. Files are identified by their path relative
+    to the input folder, so hosts may mount the shared folder in different places.
+    """
+    
+    def __init__(self, lease_dir, input_folder, worker_id, ttl=300):
+        self.lease_dir = lease_dir
+        self.input_folder = input_folder
+        self.worker_id = worker_id
+        self.ttl = ttl
+        self.held = {}  # file path -> lease file
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.heartbeat_thread = None
+        os.makedirs(lease_dir, exist_ok=True)
+    
+    def _key(self, file_path):
+        relative = os.path.relpath(file_path, self.input_folder)
+        return hashlib.sha1(relative.encode("utf-8")).hexdigest()
+    
+    def finished_keys(self):
+        """Return the keys of files any worker has finished, from one directory listing."""
+        return {name[:-len(".done")] for name in os.listdir(self.lease_dir) if name.endswith(".done")}
+    
+    def unfinished(self, file_paths):
+        """Filter out files another worker had finished when this was called."""
+        finished = self.finished_keys()
+        return (path for path in file_paths if path is NO_FILE_YET or self._key(path) not in finished)
+    
+    def claim(self, file_path):
+        """Try to take the lease for a file. Returns True if this worker now holds it."""
+        key = self._key(file_path)
+        lease_file = os.path.join(self.lease_dir, f"{key}.lease")
+        if os.path.exists(os.path.join(self.lease_dir, f"{key}.done")):
+            return False
+        
+        for _ in range(2):
+            try:
+                fd = os.open(lease_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                # Reclaim the lease if its holder stopped renewing it
+                try:
+                    age = time.time() - os.path.getmtime(lease_file)
+                except FileNotFoundError:
+                    continue
+                if age <= self.ttl:
+                    return False
+                stale_file = f"{lease_file}.stale.{self.worker_id}.{os.getpid()}.{threading.get_ident()}"
+                try:
+                    os.rename(lease_file, stale_file)
+                except FileNotFoundError:
+                    return False  # another worker reclaimed it first
+                # Another worker may have reclaimed it and taken a fresh lease between our check and
+                # the rename, in which case we just moved its live lease: put it back and back off
+                if time.time() - os.path.getmtime(stale_file) <= self.ttl:
+                    try:
+                        os.link(stale_file, lease_file)  # unlike rename, never replaces a newer lease
+                    except FileExistsError:
+                        logger.warning(f"Lease on {file_path} was replaced while being reclaimed")
+                    os.remove(stale_file)
+                    return False
+                os.remove(stale_file)
+                logger.warning(f"Reclaimed expired lease on {file_path} ({age:.0f}s since last heartbeat)")
+                continue
+            
+            with os.fdopen(fd, "w") as f:
+                f.write(json.dumps({"worker": self.worker_id, "path": file_path, "claimed_at": time.time()}))
+            with self.lock:
+                self.held[file_path] = lease_file
+            return True
+        return False
+    
+    def _owns(self, lease_file):
+        try:
+            with open(lease_file, "r") as f:
+                return json.load(f).get("worker") == self.worker_id
+        except (OSError, ValueError):
+            return False
+    
+    def release(self, file_paths, finished=False):
+        """Give up the leases on the given files, marking them finished if requested."""
+        for file_path in file_paths:
+            with self.lock:
+                lease_file = self.held.pop(file_path, None)
+            if lease_file is None:
+                continue
+            if finished:
+                with open(os.path.join(self.lease_dir, f"{self._key(file_path)}.done"), "w") as f:
+                    f.write(json.dumps({"worker": self.worker_id, "path": file_path, "finished_at": time.time()}))
+            # Our lease may have expired and been taken over; never delete someone else's
+            if self._owns(lease_file):
+                try:
+                    os.remove(lease_file)
+                except FileNotFoundError:
+                    pass
+    
+    def release_all(self):
+        """Give up every lease still held, e.g. for files dropped on exit."""
+        with self.lock:
+            file_paths = list(self.held)
+        self.release(file_paths)
+    
+    def forget(self, file_paths):
+        """Remove the finished markers of files so they can be claimed again."""
+        for file_path in file_paths:
+            try:
+                os.remove(os.path.join(self.lease_dir, f"{self._key(file_path)}.done"))
+            except FileNotFoundError:
+                pass
+    
+    def _heartbeat(self):
+        while not self.stop_event.wait(self.ttl / 3):
+            with self.lock:
+                lease_files = list(self.held.values())
+            for lease_file in lease_files:
+                try:
+                    os.utime(lease_file)
+                except FileNotFoundError:
+                    logger.warning(f"Lease {lease_file} disappeared while held")
+    
+    def start_heartbeat(self):
+        self.heartbeat_thread = threading.Thread(target=self._heartbeat, daemon=True, name="lease-heartbeat")
+        self.heartbeat_thread.start()
+    
+    def stop(self):
+        self.stop_event.set()
+        if self.heartbeat_thread:
+            self.heartbeat_thread.join(timeout=2)
+        self.release_all()
+
+class FileManifest:
+    """Per-file processing state, keyed by path and validated against size and mtime.
+
+    States are "pending", "in_progress", "done", "failed" (a permanent error) and
+    "dead_letter" (still failing after all retries). Failed and dead-lettered files are
+    skipped until they are re-driven. Resuming only needs this table, so startup never
+    has to read the stored transcriptions.
+    """
+    
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                file_name TEXT NOT NULL,
+                size INTEGER,
+                mtime REAL,
+                state TEXT NOT NULL,
+                error TEXT,
+                updated_at TEXT,
+                content_hash TEXT
+            )"""
+        )
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(files)")}
+        if "content_hash" not in columns:
+            self.conn.execute("ALTER TABLE files ADD COLUMN content_hash TEXT")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS files_file_name ON files (file_name)")
+        self.conn.commit()
+        self.stats = {}  # path -> (size, mtime) seen by the last scan
+        self.hashes = {}  # path -> content hash still valid for that size and mtime
+    
+    def is_empty(self):
+        return self.conn.execute("SELECT 1 FROM files LIMIT 1").fetchone() is None
+    
+    def seed(self, audio_files, done_file_names, input_folder=None):
+        """Mark files that already have a stored result (see result_file_name) as done."""
+        entries = [path for path in audio_files if result_file_name(path, input_folder) in done_file_names]
+        self.mark(entries, "done")
+        self.commit()
+        logger.info(f"Seeded manifest {self.path} with {len(entries)} already transcribed files")
+    
+    def pending(self, audio_files):
+        """Return the files that still need transcribing, in the order given."""
+        return list(self.iter_pending(audio_files))
+    
+    def iter_pending(self, audio_files):
+        """Yield the files that still need transcribing as audio_files is consumed.
+
+        A file is skipped when its entry is done, failed or dead-lettered and its size
+        and mtime are unchanged; files without an entry are new. NO_FILE_YET is passed
+        through.
+        """
+        entries = {}
+        cached_hashes = {}
+        for path, size, mtime, state, content_hash in self.conn.execute(
+            "SELECT path, size, mtime, state, content_hash FROM files"
+        ):
+            entries[path] = (size, mtime, state)
+            if content_hash:
+                cached_hashes[path] = content_hash
+        
+        for path in audio_files:
+            if path is NO_FILE_YET:
+                yield path
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            self.stats[path] = (stat.st_size, stat.st_mtime)
+            
+            entry = entries.get(path)
+            if entry is not None and path in cached_hashes and (entry[0], entry[1]) == self.stats[path]:
+                self.hashes[path] = cached_hashes[path]
+            if entry is None or entry[2] not in FINISHED_STATES or (entry[0], entry[1]) != self.stats[path]:
+                yield path
+    
+    def mark(self, paths, state, errors=None, hashes=None):
+        """Record state (and optionally content hashes) for the given paths.
+
+        Changes are written at the next commit(). A previously recorded hash is kept
+        while the file's size and mtime are unchanged.
+        """
+        now = datetime.now().isoformat(timespec='seconds')
+        rows = []
+        for path in paths:
+            if path not in self.stats:
+                try:
+                    stat = os.stat(path)
+                    self.stats[path] = (stat.st_size, stat.st_mtime)
+                except OSError:
+                    self.stats[path] = (None, None)
+            size, mtime = self.stats[path]
+            error = errors.get(path) if errors else None
+            content_hash = hashes.get(path) if hashes else None
+            rows.append((path, os.path.basename(path), size, mtime, state, error, now, content_hash))
+        self.conn.executemany(
+            """INSERT INTO files (path, file_name, size, mtime, state, error, updated_at, content_hash)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(path) DO UPDATE SET
+                file_name = excluded.file_name,
+                content_hash = CASE
+                    WHEN excluded.content_hash IS NOT NULL THEN excluded.content_hash
+                    WHEN files.size IS excluded.size AND files.mtime IS excluded.mtime THEN files.content_hash
+                END,
+                size = excluded.size,
+                mtime = excluded.mtime,
+                state = excluded.state,
+                error = excluded.error,
+                updated_at = excluded.updated_at""",
+            rows,
+        )
+    
+    def failures(self, states=("dead_letter",)):
+        """Return (path, state, error, updated_at) for files in the given failure states."""
+        placeholders = ", ".join("?" for _ in states)
+        return self.conn.execute(
+            f"SELECT path, state, error, updated_at FROM files WHERE state IN ({placeholders}) ORDER BY updated_at",
+            tuple(states),
+        ).fetchall()
+    
+    def redrive(self, states=("dead_letter",)):
+        """Put files in the given failure states back in the work set. Returns how many."""
+        placeholders = ", ".join("?" for _ in states)
+        with self.conn:
+            cursor = self.conn.execute(
+                f"UPDATE files SET state = 'pending', updated_at = ? WHERE state IN ({placeholders})",
+                (datetime.now().isoformat(timespec='seconds'),) + tuple(states),
+            )
+        return cursor.rowcount
+    
+    def commit(self):
+        self.conn.commit()
+    
+    def counts(self):
+        """Return the number of files in each state."""
+        return dict(self.conn.execute("SELECT state, COUNT(*) FROM files GROUP BY state"))
+    
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+class ResultJournal:
+    """Append-only journal of finished files, written as each result arrives.
+    
+    Each line records a file's manifest state and, for transcribed files, its result
+    row. Writes are buffered and fsynced at most every fsync_interval seconds (0 syncs
+    every record), so a hard kill loses at most that much instead of a whole batch of
+    paid requests. The journal is truncated once a checkpoint has committed its entries
+    to the result store and manifest, and replayed into them on the next start.
+    """
+    
+    def __init__(self, path, fsync_interval=1.0):
+        self.path = path
+        self.fsync_interval = fsync_interval
+        self.lock = threading.Lock()
+        self.file = open(path, "a", encoding="utf-8")
+        self.last_sync = time.monotonic()
+        self.dirty = False
+        self.stop_event = threading.Event()
+        self.sync_thread = None
+        if fsync_interval > 0:
+            self.sync_thread = threading.Thread(target=self._sync_loop, daemon=True, name="journal-sync")
+            self.sync_thread.start()
+    
+    def append(self, file_path, state, error=None, content_hash=None, result=None):
+        line = json.dumps({
+            "path": file_path, "state": state, "error": error, "content_hash": content_hash, "result": result,
+        }, ensure_ascii=False)
+        with self.lock:
+            self.file.write(line + "\n")
+            self.dirty = True
+            if self.fsync_interval <= 0:
+                self._sync()
+    
+    def _sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.dirty = False
+        self.last_sync = time.monotonic()
     
-    try:
-        if not os.path.exists(folder_path):
-            raise FileNotFoundError(f"Folder {folder_path} not found")
-        
-        files = []
-        for ext in supported_extensions:
-            files.extend(glob.glob(os.path.join(folder_path, f"*{ext}")))
+    def _sync_loop(self):
+        while not self.stop_event.wait(self.fsync_interval):
+            with self.lock:
+                if self.dirty:
+                    try:
+                        self._sync()
+                    except OSError as e:
+                        logger.error(f"Could not sync journal {self.path}: {str(e)}")
+    
+    def truncate(self):
+        """Drop every entry; call once they are committed elsewhere."""
+        with self.lock:
+            self.file.flush()
+            self.file.truncate(0)
+            os.fsync(self.file.fileno())
+            self.dirty = False
+    
+    def replay(self, store, manifest):
+        """Commit entries left by a run that did not reach its checkpoint. Returns the recovered result rows."""
+        entries = []
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    # A torn last line from a crash mid-write
+                    logger.warning(f"Skipping unreadable journal line in {self.path}")
+        if not entries:
+            return []
         
-        logger.info(f"Found {len(files)} audio files in {folder_path}")
-        return files
-    except Exception as e:
-        logger.error(f"Error finding audio files: {str(e)}")
-        return []
+        # Later entries for a file win, as in the stores
+        latest = {entry["path"]: entry for entry in entries}
+        results = [entry["result"] for entry in latest.values() if entry["state"] == "done" and entry.get("result")]
+        if results:
+            store.upsert(results)
+        errors = {path: entry.get("error") for path, entry in latest.items()}
+        hashes = {path: entry["content_hash"] for path, entry in latest.items() if entry.get("content_hash")}
+        for state in FINISHED_STATES:
+            paths = [path for path, entry in latest.items() if entry["state"] == state]
+            manifest.mark(paths, state, errors, hashes)
+        manifest.commit()
+        self.truncate()
+        logger.info(f"Recovered {len(latest)} files ({len(results)} transcriptions) from journal {self.path}")
+        return results
+    
+    def close(self):
+        self.stop_event.set()
+        if self.sync_thread:
+            self.sync_thread.join(timeout=2)
+        with self.lock:
+            if self.dirty:
+                self._sync()
+            self.file.close()
 
-def get_already_transcribed_files(csv_path):
-    """Get a list of file names that have already been transcribed."""
+@contextlib.contextmanager
+def timed(timings, stage):
+    """Add the wall time spent in the block to timings[stage]."""
+    started = time.perf_counter()
     try:
-        if not os.path.exists(csv_path):
-            logger.info(f"No existing transcriptions file found at {csv_path}")
-            return []
-        
-        df = pd.read_csv(csv_path)
-        already_transcribed = df['file_name'].tolist()
-        logger.info(f"Found {len(already_transcribed)} already transcribed files")
-        return already_transcribed
-    except Exception as e:
-        logger.error(f"Error reading existing CSV: {str(e)}")
-        return []
+        yield
+    finally:
+        timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - started
 
-def transcribe_audio(client, file_path, language_code="hin"):
-    """Transcribe the audio file using ElevenLabs API."""
-    global current_file_index
+class PipelineMetrics:
+    """Per-stage timings and throughput counters for a run.
     
-    try:
-        file_name = os.path.basename(file_path)
-        logger.info(f"Transcribing: {file_name} ({current_file_index + 1}/{total_files})")
-        
-        # Get file metadata
-        file_date = datetime.fromtimestamp(os.path.getmtime(file_path)).strftime('%Y-%m-%d')
-        
-        # Load the audio file
-        audio = AudioSegment.from_file(file_path)
-        duration = len(audio) / 1000  # Duration in seconds
-        
-        # Convert to WAV in memory
-        audio_data = audio.export(format="wav")
-        
-        # Transcribe the audio
-        transcription = client.speech_to_text.convert(
-            file=audio_data,
-            model_id="scribe_v1",
-            tag_audio_events=True,
-            language_code=language_code,
-            diarize=True,
-        )
-        
-        # Create a structured result
-        result = {
-            "file_name": file_name,
-            "file_date": file_date,
-            "duration_seconds": duration,
-            "transcription": transcription.text,
-            "speakers": len(set(segment.speaker for segment in transcription.segments)) if hasattr(transcription, 'segments') else 1
-        }
-        
-        logger.info(f"Successfully transcribed {file_name} ({duration:.1f} sec)")
-        current_file_index += 1
-        return result
+    Every finished file and every checkpoint is written as one JSON event (when
+    events_path is set), and the totals can be rendered in the Prometheus text format
+    for a textfile collector or a scrape endpoint. Remaining time is estimated from
+    audio seconds per second, using the bytes-to-audio ratio of the files done so far
+    to size the work that is left.
+    """
     
-    except Exception as e:
-        logger.error(f"Error transcribing {file_path}: {str(e)}")
-        current_file_index += 1
-        return {
-            "file_name": os.path.basename(file_path),
-            "file_date": datetime.fromtimestamp(os.path.getmtime(file_path)).strftime('%Y-%m-%d'),
-            "duration_seconds": 0,
-            "transcription": f"ERROR: {str(e)}",
-            "speakers": 0
-        }
-
-def save_transcriptions(results, csv_path):
-    """Save transcription results to CSV file with version control and protection against data loss."""
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    STAGES = ("hash", "probe", "decode", "preprocess", "split", "encode", "queued", "upload", "request", "persist")
+    BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
     
-    try:
-        # Create backup of existing file before making any changes
-        if os.path.exists(csv_path):
-            backup_dir = os.path.join(os.path.dirname(csv_path), "backups")
-            os.makedirs(backup_dir, exist_ok=True)
-            
-            backup_file = os.path.join(
-                backup_dir, 
-                f"{os.path.basename(csv_path).split('.')[0]}_{timestamp}.csv"
-            )
-            
-            try:
-                # Create a backup copy of the original file
-                pd.read_csv(csv_path).to_csv(backup_file, index=False)
-                logger.info(f"Created backup of existing data at {backup_file}")
-            except Exception as backup_error:
-                logger.error(f"Failed to create backup of existing file: {str(backup_error)}")
-                # Don't proceed if we can't backup existing data
-                return False
-            
-            # Load existing data
+    def __init__(self, events_path=None):
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.histograms = {}  # stage -> [bucket counts, sum, count]
+        self.counters = {}  # (name, labels) -> value
+        self.discovered_files = 0
+        self.discovered_bytes = 0
+        self.finished_bytes = 0
+        self.done_bytes = 0
+        self.limiter = None  # the running pipeline's AdaptiveConcurrencyLimiter
+        self.done_audio_seconds = 0.0
+        self.events = None
+        if events_path:
+            os.makedirs(os.path.dirname(events_path) or ".", exist_ok=True)
+            self.events = open(events_path, "a", buffering=1, encoding="utf-8")
+        self.stop_event = threading.Event()
+        self.server = None
+    
+    def observe(self, stage, seconds):
+        with self.lock:
+            histogram = self.histograms.setdefault(stage, [[0] * len(self.BUCKETS), 0.0, 0])
+            for index, bound in enumerate(self.BUCKETS):
+                if seconds <= bound:
+                    histogram[0][index] += 1
+            histogram[1] += seconds
+            histogram[2] += 1
+    
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+    
+    def event(self, kind, **fields):
+        if self.events is None:
+            return
+        line = json.dumps({"event": kind, "ts": round(time.time(), 3), "session": session_id, **fields})
+        with self.lock:
+            self.events.write(line + "\n")
+    
+    def discovered(self, file_size):
+        with self.lock:
+            self.discovered_files += 1
+            self.discovered_bytes += file_size or 0
+    
+    def file_finished(self, file_path, prepared=None, error=None):
+        """Record the timings and sizes of a file that was transcribed or failed for good."""
+        prepared = prepared or {}
+        timings = prepared.get("timings", {})
+        file_size = prepared.get("file_size")
+        if file_size is None:
             try:
-                existing_df = pd.read_csv(csv_path)
-                new_df = pd.DataFrame(results)
-                
-                # Check for duplicates before combining
-                duplicate_files = set(existing_df['file_name']).intersection(set(new_df['file_name']))
-                if duplicate_files:
-                    logger.warning(f"Found {len(duplicate_files)} duplicate files. Using new transcriptions for these files.")
-                    # Remove duplicates from existing data
-                    existing_df = existing_df[~existing_df['file_name'].isin(duplicate_files)]
-                
-                # Combine with existing data
-                combined_df = pd.concat([existing_df, new_df], ignore_index=True)
-            except Exception as e:
-                logger.error(f"Error processing existing data: {str(e)}")
-                return False
+                file_size = os.path.getsize(file_path)
+            except OSError:
+                file_size = 0
+        audio_seconds = prepared.get("duration_seconds") or 0
+        if error is not None:
+            outcome = "failed"
+        elif prepared.get("served_from_cache"):
+            outcome = "cached"
         else:
-            combined_df = pd.DataFrame(results)
+            outcome = "done"
         
-        # Write to a temporary file first to prevent corruption
-        temp_file = f"{csv_path}.temp"
-        combined_df.to_csv(temp_file, index=False)
+        for stage, seconds in timings.items():
+            self.observe(stage, seconds)
+        self.inc("files_total", outcome=outcome)
+        with self.lock:
+            self.finished_bytes += file_size
+            if error is None:
+                self.done_bytes += file_size
+                self.done_audio_seconds += audio_seconds
+        if error is None:
+            self.inc("audio_seconds_total", audio_seconds)
+            if prepared.get("sent_seconds") is not None:
+                self.inc("audio_seconds_trimmed_total", audio_seconds - prepared["sent_seconds"])
+            if outcome == "done":
+                self.inc("payload_bytes_total", prepared.get("payload_size") or 0,
+                         strategy=prepared.get("payload_strategy", ""))
         
-        # If temporary write succeeds, rename to final file
-        if os.path.exists(temp_file):
-            if os.path.exists(csv_path):
-                os.replace(temp_file, csv_path)  # Atomic operation
-            else:
-                os.rename(temp_file, csv_path)
+        self.event(
+            "file",
+            file=os.path.basename(file_path),
+            outcome=outcome,
+            error=f"{type(error).__name__}: {str(error)}" if error is not None else None,
+            file_bytes=file_size,
+            payload_bytes=prepared.get("payload_size"),
+            audio_seconds=audio_seconds,
+            sent_audio_seconds=prepared.get("sent_seconds"),
+            attempts=prepared.get("attempts", 0) + 1,
+            stages={stage: round(seconds, 4) for stage, seconds in timings.items()},
+        )
+    
+    def summary(self):
+        """Return log lines with the mean time per file spent in each stage."""
+        with self.lock:
+            stages = [(stage, total / count) for stage, (_, total, count) in self.histograms.items() if count]
+        stages.sort(key=lambda item: self.STAGES.index(item[0]) if item[0] in self.STAGES else len(self.STAGES))
+        lines = []
+        if stages:
+            lines.append("Mean stage time: " + ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in stages))
+        lines.append(f"Audio throughput: {self.audio_rate():.2f} audio-sec/sec")
+        return lines
+    
+    def persisted(self, batch, rows, seconds):
+        self.observe("persist", seconds)
+        self.event("persist", batch=batch, rows=rows, seconds=round(seconds, 4))
+    
+    def audio_rate(self):
+        """Audio seconds transcribed per wall-clock second so far."""
+        elapsed = time.monotonic() - self.started
+        return self.done_audio_seconds / elapsed if elapsed > 0 else 0.0
+    
+    def estimate_remaining_seconds(self):
+        """Seconds left for the discovered work, or None before any audio is done."""
+        with self.lock:
+            if not self.done_bytes or not self.done_audio_seconds:
+                return None
+            remaining_audio = max(0, self.discovered_bytes - self.finished_bytes) * self.done_audio_seconds / self.done_bytes
+        rate = self.audio_rate()
+        return remaining_audio / rate if rate > 0 else None
+    
+    def render(self):
+        """Return the metrics in the Prometheus text exposition format."""
+        lines = [
+            "# HELP transcribe_stage_seconds Time spent in each pipeline stage, per file (per request for 'request').",
+            "# TYPE transcribe_stage_seconds histogram",
+        ]
+        with self.lock:
+            for stage in sorted(self.histograms, key=lambda s: self.STAGES.index(s) if s in self.STAGES else len(self.STAGES)):
+                buckets, total, count = self.histograms[stage]
+                for bound, bucket_count in zip(self.BUCKETS, buckets):
+                    lines.append(f'transcribe_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {bucket_count}')
+                lines.append(f'transcribe_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {count}')
+                lines.append(f'transcribe_stage_seconds_sum{{stage="{stage}"}} {total:.6f}')
+                lines.append(f'transcribe_stage_seconds_count{{stage="{stage}"}} {count}')
             
-            logger.info(f"Successfully saved {len(results)} new transcriptions. Total records: {len(combined_df)}")
-            return True
-        else:
-            logger.error("Failed to write temporary file")
-            return False
+            typed = set()
+            for (name, labels), value in sorted(self.counters.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE transcribe_{name} counter")
+                    typed.add(name)
+                label_text = ",".join(f'{key}="{value_}"' for key, value_ in labels)
+                lines.append(f"transcribe_{name}{{{label_text}}} {value}" if label_text else f"transcribe_{name} {value}")
             
-    except Exception as e:
-        logger.error(f"Error saving transcriptions to CSV: {str(e)}")
+            gauges = {
+                "files_discovered": self.discovered_files,
+                "bytes_discovered": self.discovered_bytes,
+                "bytes_finished": self.finished_bytes,
+            }
+        gauges["audio_seconds_per_second"] = round(self.audio_rate(), 4)
+        gauges["eta_seconds"] = self.estimate_remaining_seconds()
+        if self.limiter is not None:
+            gauges["concurrency_limit"] = int(self.limiter.limit)
+        for name, value in gauges.items():
+            if value is not None:
+                lines.append(f"# TYPE transcribe_{name} gauge")
+                lines.append(f"transcribe_{name} {value}")
+        return "\n".join(lines) + "\n"
+    
+    def write(self, path):
+        """Atomically replace path with the current metrics, e.g. for node_exporter's textfile collector."""
+        temp_file = f"{path}.temp"
+        with open(temp_file, "w", encoding="utf-8") as f:
+            f.write(self.render())
+        os.replace(temp_file, path)
+    
+    def start_writer(self, path, interval=15):
+        def write_loop():
+            while not self.stop_event.wait(interval):
+                try:
+                    self.write(path)
+                except OSError as e:
+                    logger.warning(f"Could not write metrics to {path}: {str(e)}")
+        threading.Thread(target=write_loop, daemon=True, name="metrics-writer").start()
+    
+    def serve(self, port, host="0.0.0.0"):
+        """Serve the metrics at http://host:port/metrics from a background thread."""
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        metrics = self
         
-        # Emergency backup - save new transcriptions to a separate file
-        try:
-            error_backup_path = f"new_transcriptions_{timestamp}.csv"
-            pd.DataFrame(results).to_csv(error_backup_path, index=False)
-            logger.info(f"Created emergency backup of new transcriptions at {error_backup_path}")
-        except Exception as backup_error:
-            logger.critical(f"Failed to create emergency backup: {str(backup_error)}")
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            
+            def log_message(self, *args):
+                pass
         
-        return False
+        self.server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True, name="metrics-server").start()
+        logger.info(f"Serving metrics at http://{host}:{self.server.server_address[1]}/metrics")
+    
+    def close(self, path=None):
+        self.stop_event.set()
+        if path:
+            try:
+                self.write(path)
+            except OSError as e:
+                logger.warning(f"Could not write metrics to {path}: {str(e)}")
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        if self.events is not None:
+            self.events.close()
+            self.events = None
 
 def estimate_completion_time(processed, total, elapsed_time):
     """Estimate the remaining time to complete all transcriptions."""
@@ -238,8 +2681,10 @@ def estimate_completion_time(processed, total, elapsed_time):
     
     rate = processed / elapsed_time
     remaining_files = total - processed
-    estimated_seconds = remaining_files / rate if rate > 0 else float('inf')
-    
+    return format_eta(remaining_files / rate if rate > 0 else float('inf'))
+
+def format_eta(estimated_seconds):
+    """Describe a remaining time in seconds, with the clock time it ends at."""
     if estimated_seconds == float('inf'):
         return "Unknown"
     
@@ -255,25 +2700,32 @@ def estimate_completion_time(processed, total, elapsed_time):
 
 def print_progress():
     """Function to periodically print progress information."""
-    global is_exiting, start_time, current_file_index, total_files, current_batch, total_batches
+    global is_exiting, start_time, total_files, current_batch, total_batches
     
     while not is_exiting:
-        if start_time is not None and current_file_index > 0:
+        files_finished = current_run.files_finished if current_run else 0
+        if start_time is not None and files_finished > 0:
             elapsed_time = (datetime.now() - start_time).total_seconds()
-            estimated_remaining = estimate_completion_time(current_file_index, total_files, elapsed_time)
+            # Weight the estimate by audio duration once some audio has been transcribed
+            remaining_seconds = metrics.estimate_remaining_seconds() if metrics else None
+            if remaining_seconds is not None:
+                estimated_remaining = f"{format_eta(remaining_seconds)} at {metrics.audio_rate():.1f} audio-sec/sec"
+            else:
+                estimated_remaining = estimate_completion_time(files_finished, total_files, elapsed_time)
             
             progress_msg = (
-                f"\nProgress update: {current_file_index}/{total_files} files processed "
-                f"({current_file_index/total_files*100:.1f}%)\n"
+                f"\nProgress update: {files_finished}/{total_files} files processed "
+                f"({files_finished/total_files*100:.1f}%)\n"
                 f"Batch: {current_batch}/{total_batches}\n"
                 f"Elapsed time: {timedelta(seconds=int(elapsed_time))}\n"
                 f"Estimated remaining: {estimated_remaining}\n"
             )
             
             print(progress_msg)
-            with open(session_log_file, 'a') as f:
+            with session_log as f:
                 f.write(f"\n--- PROGRESS UPDATE {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} ---\n")
                 f.write(progress_msg)
+            session_log.flush()
                 
         time.sleep(30)  # Update every 30 seconds
 
@@ -286,99 +2738,787 @@ def signal_handler(sig, frame):
         sys.exit(1)
     
     is_exiting = True
+    if current_run is not None:
+        current_run.stop()
     print("\n\nReceived termination signal. Finishing current transcription and saving progress...")
     print("Press Ctrl+C again to force exit (not recommended - data may be lost)")
     
-    # Continue execution - the main loop will check is_exiting and save progress
+    # Continue execution - the run stops taking new work and the main loop saves progress
+
+class BackupSet:
+    """Incremental backups of the result store: periodic snapshots plus per-checkpoint deltas.
+    
+    Each checkpoint writes only the rows it saved, as a gzipped JSON Lines delta. Every
+    snapshot_every checkpoints (and on the first one) the whole store is written as a
+    snapshot instead. Only the newest keep_snapshots snapshots, and the deltas that
+    follow them, are kept. Restoring loads a snapshot and applies the deltas after it
+    in order. File names are <base>.<sequence>.<timestamp>.<snapshot|delta>.jsonl.gz.
+    """
+    
+    def __init__(self, backup_dir, base_name, snapshot_every=100, keep_snapshots=3):
+        self.backup_dir = backup_dir
+        self.base_name = base_name
+        self.snapshot_every = max(1, snapshot_every)
+        self.keep_snapshots = max(1, keep_snapshots)
+        os.makedirs(backup_dir, exist_ok=True)
+        entries = self.entries()
+        self.sequence = entries[-1][0] if entries else 0
+        snapshots = [sequence for sequence, _, kind, _ in entries if kind == "snapshot"]
+        self.deltas_since_snapshot = (
+            sum(1 for sequence, _, kind, _ in entries if kind == "delta" and sequence > snapshots[-1])
+            if snapshots else None
+        )
+    
+    def entries(self):
+        """Return (sequence, timestamp, kind, path) for every backup file, oldest first."""
+        prefix = f"{self.base_name}."
+        entries = []
+        for name in os.listdir(self.backup_dir):
+            if not name.startswith(prefix) or not name.endswith(".jsonl.gz"):
+                continue
+            parts = name[len(prefix):-len(".jsonl.gz")].split(".")
+            if len(parts) != 3 or not parts[0].isdigit() or parts[2] not in ("snapshot", "delta"):
+                continue
+            entries.append((int(parts[0]), parts[1], parts[2], os.path.join(self.backup_dir, name)))
+        return sorted(entries)
+    
+    def _write(self, kind, rows):
+        self.sequence += 1
+        timestamp = datetime.now().strftime('%Y%m%dT%H%M%S')
+        path = os.path.join(self.backup_dir, f"{self.base_name}.{self.sequence:08d}.{timestamp}.{kind}.jsonl.gz")
+        temp_file = f"{path}.temp"
+        count = 0
+        with open(temp_file, "wb") as raw:
+            with gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=5) as f:
+                for row in rows:
+                    f.write((json.dumps(row, ensure_ascii=False, default=str) + "\n").encode("utf-8"))
+                    count += 1
+            raw.flush()
+            os.fsync(raw.fileno())
+        os.replace(temp_file, path)
+        return path, count
+    
+    def record(self, batch_results, store):
+        """Back up a checkpoint that has just been written to store."""
+        if self.deltas_since_snapshot is None or self.deltas_since_snapshot + 1 >= self.snapshot_every:
+            path, count = self._write("snapshot", store.iter_rows())
+            self.deltas_since_snapshot = 0
+            logger.info(f"Wrote backup snapshot of {count} transcriptions to {path}")
+            self.prune()
+        else:
+            path, count = self._write("delta", ({column: row.get(column) for column in STORE_COLUMNS} for row in batch_results))
+            self.deltas_since_snapshot += 1
+    
+    def prune(self):
+        """Delete snapshots beyond keep_snapshots and the deltas that only they needed."""
+        entries = self.entries()
+        snapshots = [sequence for sequence, _, kind, _ in entries if kind == "snapshot"]
+        if len(snapshots) <= self.keep_snapshots:
+            return
+        oldest_kept = snapshots[-self.keep_snapshots]
+        removed = 0
+        for sequence, _, _, path in entries:
+            if sequence < oldest_kept:
+                os.remove(path)
+                removed += 1
+        logger.info(f"Pruned {removed} old backup files from {self.backup_dir}")
+    
+    def restore_rows(self, until=None):
+        """Yield the rows as of the newest backup at or before until (a YYYYmmddTHHMMSS string).
+        
+        Rows for the same file appear in the order they were saved, so the last one wins.
+        """
+        entries = [entry for entry in self.entries() if until is None or entry[1] <= until]
+        snapshots = [index for index, entry in enumerate(entries) if entry[2] == "snapshot"]
+        if not snapshots:
+            raise FileNotFoundError(f"No backup snapshot in {self.backup_dir}" + (f" before {until}" if until else ""))
+        for _, _, _, path in entries[snapshots[-1]:]:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    yield json.loads(line)
+
+class ParquetOutput:
+    """Calls and diarized segments as Parquet datasets partitioned by file_date.
+    
+    Each checkpoint adds one file per date to <root>/calls/file_date=<date>/ and
+    <root>/segments/file_date=<date>/, so readers such as pyarrow.dataset, DuckDB or
+    pandas can prune both partitions and columns. A re-transcribed file appears again
+    in a later part; keep the row with the latest transcribed_at.
+    """
+    
+    def __init__(self, root, part_prefix=None):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise RuntimeError("RICH_OUTPUT_DIR needs pyarrow (pip install pyarrow)") from e
+        self.pa = pa
+        self.pq = pq
+        self.root = root
+        self.part_prefix = part_prefix or f"part-{session_id}"
+        self.calls_schema = pa.schema([
+            ("file_name", pa.string()),
+            ("duration_seconds", pa.float64()),
+            ("trimmed_duration_seconds", pa.float64()),
+            ("speakers", pa.int32()),
+            ("language_code", pa.string()),
+            ("content_hash", pa.string()),
+            ("transcription", pa.string()),
+            ("segment_count", pa.int32()),
+            ("transcribed_at", pa.timestamp("s")),
+        ])
+        self.segments_schema = pa.schema([
+            ("file_name", pa.string()),
+            ("segment_index", pa.int32()),
+            ("speaker", pa.string()),
+            ("start", pa.float64()),
+            ("end", pa.float64()),
+            ("text", pa.string()),
+            ("event_tags", pa.list_(pa.string())),
+            ("transcribed_at", pa.timestamp("s")),
+        ])
+    
+    def _write(self, table_name, file_date, batch_num, rows, schema):
+        folder = os.path.join(self.root, table_name, f"file_date={file_date}")
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, f"{self.part_prefix}-{batch_num:06d}.parquet")
+        # Readers skip files starting with "_", so a half-written part is never read
+        temp_file = os.path.join(folder, f"_{os.path.basename(path)}.temp")
+        table = self.pa.Table.from_pylist(rows, schema=schema)
+        self.pq.write_table(table, temp_file, compression="zstd")
+        os.replace(temp_file, path)
+    
+    def write_batch(self, results, batch_num):
+        """Write the calls and segments of one checkpoint's results."""
+        transcribed_at = datetime.now().replace(microsecond=0)
+        by_date = {}
+        for result in results:
+            by_date.setdefault(result.get("file_date") or "unknown", []).append(result)
+        
+        for file_date, date_results in by_date.items():
+            calls = []
+            segments = []
+            for result in date_results:
+                result_segments = result.get("segments") or []
+                calls.append({
+                    "file_name": result["file_name"],
+                    "duration_seconds": result.get("duration_seconds"),
+                    "trimmed_duration_seconds": result.get("trimmed_duration_seconds"),
+                    "speakers": result.get("speakers"),
+                    "language_code": result.get("language_code"),
+                    "content_hash": result.get("content_hash"),
+                    "transcription": result.get("transcription"),
+                    "segment_count": len(result_segments),
+                    "transcribed_at": transcribed_at,
+                })
+                for index, segment in enumerate(result_segments):
+                    segments.append({
+                        "file_name": result["file_name"],
+                        "segment_index": index,
+                        "transcribed_at": transcribed_at,
+                        **segment,
+                    })
+            self._write("calls", file_date, batch_num, calls, self.calls_schema)
+            if segments:
+                self._write("segments", file_date, batch_num, segments, self.segments_schema)
 
-def save_checkpoint(batch_results, output_csv, batch_num, force=False):
-    """Save the current progress as a checkpoint."""
+def save_checkpoint(batch_results, store, batch_num, force=False, backups=None, rich_output=None):
+    """Save the current progress as a checkpoint. Returns False if the store could not be written."""
     if not batch_results and not force:
-        return
+        return True
     
-    # Save to main output if possible
+    # Save to the result store if possible
+    success = True
     if batch_results:
-        success = save_transcriptions(batch_results, output_csv)
+        try:
+            store.upsert(batch_results)
+            logger.info(f"Saved {len(batch_results)} transcriptions to {store.path}")
+            success = True
+        except Exception as e:
+            logger.error(f"Error saving transcriptions to {store.path}: {str(e)}")
+            success = False
+        if success and backups is not None:
+            try:
+                backups.record(batch_results, store)
+            except Exception as e:
+                logger.error(f"Error backing up checkpoint {batch_num}: {str(e)}")
+        if success and rich_output is not None:
+            try:
+                rich_output.write_batch(batch_results, batch_num)
+            except Exception as e:
+                logger.error(f"Error writing checkpoint {batch_num} to {rich_output.root}: {str(e)}")
         if not success:
             # Save to checkpoint file if main save fails
             checkpoint_file = f"checkpoint_{session_id}_batch_{batch_num}.csv"
             try:
+                import pandas as pd
                 pd.DataFrame(batch_results).to_csv(checkpoint_file, index=False)
                 logger.info(f"Saved checkpoint to {checkpoint_file}")
             except Exception as e:
                 logger.critical(f"Failed to save checkpoint: {str(e)}")
     
     # Update session log with checkpoint information
-    with open(session_log_file, 'a') as f:
+    files_finished = current_run.files_finished if current_run else 0
+    with session_log as f:
         f.write(f"\n=== CHECKPOINT {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} ===\n")
-        f.write(f"Files processed: {current_file_index}/{total_files}\n")
+        f.write(f"Files processed: {files_finished}/{total_files}\n")
         f.write(f"Batch: {batch_num}/{total_batches}\n")
         if start_time:
             elapsed = (datetime.now() - start_time).total_seconds()
             f.write(f"Elapsed time: {timedelta(seconds=int(elapsed))}\n")
             
-            if current_file_index > 0:
-                est_remaining = estimate_completion_time(current_file_index, total_files, elapsed)
+            if files_finished > 0:
+                est_remaining = estimate_completion_time(files_finished, total_files, elapsed)
                 f.write(f"Estimated remaining: {est_remaining}\n")
         
-        if is_exiting:
+        if current_run is not None and current_run.stopping:
             f.write("PROCESS INTERRUPTED BY USER - PARTIAL COMPLETION\n")
+    session_log.flush()
+    
+    return success
+
+SCHEDULE_POLICIES = ("scan", "newest", "shortest", "largest")
+
+def parse_deadline(value):
+    """Parse a deadline given as an ISO date and time, or as HH:MM meaning its next occurrence."""
+    try:
+        clock = datetime.strptime(value, "%H:%M").time()
+    except ValueError:
+        return datetime.fromisoformat(value)
+    deadline = datetime.combine(datetime.now().date(), clock)
+    return deadline if deadline > datetime.now() else deadline + timedelta(days=1)
+
+class WorkScheduler:
+    """Orders the files of a run and admits them until a budget or deadline is reached.
+    
+    Policies:
+      - "scan": the order the folder scan finds files in; work starts immediately
+      - "newest": most recently modified first
+      - "shortest": shortest probed duration first, for the most finished calls per hour
+      - "largest": longest probed duration first, so the long calls don't straggle at the end
+    
+    Policies other than "scan" wait for the backlog to be scanned, probing durations
+    with probe_workers threads where needed; files arriving later (watch mode) follow in
+    arrival order. With budget_seconds, each file's probed duration is reserved when it
+    is admitted, and once a file no longer fits nothing more is admitted. Files that
+    can't be probed reserve an estimate from their size, at the bytes per second of the
+    files probed so far (UNPROBED_BYTES_PER_SECOND before any are). No new file is
+    admitted after the deadline, and an idle watch stops when it passes. Files not
+    admitted are left pending for the next run and reported by summary().
+    """
+    
+    UNPROBED_BYTES_PER_SECOND = 2000  # 16 kbps, below the call recordings' codecs, so estimates run long
+    
+    def __init__(self, policy="scan", budget_seconds=None, deadline=None, stats=None, probe_workers=8):
+        if policy not in SCHEDULE_POLICIES:
+            raise ValueError(f"Unknown schedule policy '{policy}'. Expected one of: {', '.join(SCHEDULE_POLICIES)}")
+        self.policy = policy
+        self.budget_seconds = budget_seconds
+        self.deadline = deadline
+        self.stats = stats if stats is not None else {}  # path -> (size, mtime)
+        self.probe_workers = probe_workers
+        self.durations = {}  # path -> probed duration in seconds, None if it could not be probed
+        self.reserved = {}  # path -> budget seconds reserved when it was admitted
+        self.probed_bytes = 0
+        self.probed_seconds = 0.0
+        self.admitted_seconds = 0.0
+        self.admitted_files = 0
+        self.estimated_files = 0
+        self.stop_reason = None
+        self.deferred = []
+    
+    def _probe(self, file_paths):
+        missing = [path for path in file_paths if path not in self.durations]
+        if not missing:
+            return
+        from tqdm import tqdm
+        with ThreadPoolExecutor(max_workers=max(1, self.probe_workers), thread_name_prefix="probe") as executor:
+            futures = {executor.submit(probe_audio, path): path for path in missing}
+            for future in tqdm(as_completed(futures), total=len(futures), desc="Probing", disable=len(futures) < 100):
+                try:
+                    duration = self.durations[futures[future]] = future.result()["duration_seconds"]
+                    if duration:
+                        self.probed_bytes += self._stat(futures[future])[0]
+                        self.probed_seconds += duration
+                except Exception as e:
+                    logger.warning(f"Could not probe {futures[future]}: {str(e)}")
+                    self.durations[futures[future]] = None
+    
+    def _stat(self, path):
+        if path not in self.stats:
+            try:
+                stat = os.stat(path)
+                self.stats[path] = (stat.st_size, stat.st_mtime)
+            except OSError:
+                self.stats[path] = (0, 0)
+        return self.stats[path]
+    
+    def _mtime(self, path):
+        return self._stat(path)[1] or 0
+    
+    def _estimate(self, path):
+        """Budget seconds for a file that could not be probed, from its size."""
+        bytes_per_second = self.UNPROBED_BYTES_PER_SECOND
+        if self.probed_seconds:
+            bytes_per_second = self.probed_bytes / self.probed_seconds
+        return (self._stat(path)[0] or 0) / bytes_per_second
+    
+    def _deadline_passed(self):
+        if self.deadline is not None and datetime.now() >= self.deadline:
+            self.stop_reason = f"deadline of {self.deadline.strftime('%Y-%m-%d %H:%M')} passed"
+            return True
+        return False
+    
+    def _ordered(self, file_paths):
+        file_iter = iter(file_paths)
+        if self.policy == "scan":
+            yield from file_iter
+            return
+        
+        backlog = []
+        for path in file_iter:
+            if path is NO_FILE_YET:
+                break
+            backlog.append(path)
+        else:
+            path = None
+        
+        if self.policy == "newest":
+            backlog.sort(key=self._mtime, reverse=True)
+        else:
+            self._probe(backlog)
+            known = [path for path in backlog if self.durations.get(path) is not None]
+            unknown = [path for path in backlog if self.durations.get(path) is None]
+            known.sort(key=self.durations.get, reverse=self.policy == "largest")
+            backlog = known + unknown
+        logger.info(f"Scheduled {len(backlog)} files {self.policy} first")
+        yield from backlog
+        
+        if path is NO_FILE_YET:
+            yield path
+            yield from file_iter
+    
+    def _admit(self, path):
+        if self._deadline_passed():
+            return False
+        if self.budget_seconds is not None:
+            if path not in self.durations:
+                self._probe([path])
+            duration = self.durations[path]
+            if duration is None:
+                duration = self._estimate(path)
+            if self.admitted_seconds + duration > self.budget_seconds:
+                self.stop_reason = f"budget of {self.budget_seconds / 60:.1f} audio minutes was used up"
+                return False
+            self.admitted_seconds += duration
+            self.reserved[path] = duration
+            if self.durations[path] is None:
+                self.estimated_files += 1
+        return True
+    
+    def schedule(self, file_paths, claim=None):
+        """Yield the files to transcribe, in policy order, while the budget and deadline allow.
+        
+        claim, if given, is asked for each file that fits (e.g. LeaseDirectory.claim);
+        files it refuses are skipped without using any budget.
+        """
+        for path in self._ordered(file_paths):
+            if path is NO_FILE_YET:
+                if self.stop_reason or self._deadline_passed():
+                    return  # Stop watching once nothing more can be admitted
+                yield path
+                continue
+            if self.stop_reason or not self._admit(path):
+                self.deferred.append(path)
+                continue
+            if claim is not None and not claim(path):
+                if self.budget_seconds is not None:
+                    self.admitted_seconds -= self.reserved.pop(path)
+                    if self.durations[path] is None:
+                        self.estimated_files -= 1
+                continue
+            self.admitted_files += 1
+            yield path
+    
+    def summary(self, cost_per_hour=0.40):
+        """Return log lines describing what was admitted and what was deferred."""
+        lines = []
+        if self.budget_seconds is not None:
+            lines.append(
+                f"Scheduled {self.admitted_seconds / 60:.1f} of a {self.budget_seconds / 60:.1f} audio minute budget "
+                f"(~{self.admitted_seconds / 3600 * cost_per_hour:.2f} at {cost_per_hour} per audio hour)"
+                + (f", {self.estimated_files} files that could not be probed estimated from their size"
+                   if self.estimated_files else "")
+            )
+        if self.deferred:
+            known = [self.durations[path] for path in self.deferred if self.durations.get(path) is not None]
+            lines.append(
+                f"Deferred {len(self.deferred)} files to the next run because the {self.stop_reason}"
+                + (f" ({sum(known) / 60:.1f} audio minutes across the {len(known)} probed)" if known else "")
+            )
+        return lines
+
+def default_work_scheduler(stats=None):
+    """Build the WorkScheduler configured by SCHEDULE_POLICY and the BUDGET_* and DEADLINE variables."""
+    cost_per_hour = float(os.getenv("COST_PER_AUDIO_HOUR", "0.40"))
+    budgets = []
+    if os.getenv("BUDGET_AUDIO_MINUTES"):  # Stop admitting files after this much audio
+        budgets.append(float(os.getenv("BUDGET_AUDIO_MINUTES")) * 60)
+    if os.getenv("BUDGET_COST"):  # Or after this estimated spend, at COST_PER_AUDIO_HOUR
+        budgets.append(float(os.getenv("BUDGET_COST")) / cost_per_hour * 3600)
+    deadline = os.getenv("DEADLINE")  # No new files after this time (HH:MM or ISO date and time)
+    return WorkScheduler(
+        os.getenv("SCHEDULE_POLICY", "scan"),  # scan, newest, shortest or largest
+        budget_seconds=min(budgets) if budgets else None,
+        deadline=parse_deadline(deadline) if deadline else None,
+        stats=stats,
+        probe_workers=int(os.getenv("PROBE_WORKERS", "8")),  # Files probed in parallel for scheduling
+    )
+
+def run_inventory(folder_path, already_transcribed, probe_workers=8, cost_per_hour=0.40):
+    """Probe every audio file in folder_path and report the audio hours and estimated cost of a run.
+    
+    already_transcribed is the set of file names with a stored result; they are left out of the remaining cost.
+    """
+    from tqdm import tqdm
+    
+    audio_files = get_audio_files(folder_path)
+    if not audio_files:
+        logger.warning(f"No audio files found in {folder_path}")
+        return 1
+    
+    started = time.monotonic()
+    
+    by_extension = {}
+    sources = {"header": 0, "decode": 0}
+    pending_seconds = 0.0
+    pending_files = 0
+    failed = []
+    
+    with ThreadPoolExecutor(max_workers=max(1, probe_workers), thread_name_prefix="probe") as executor:
+        futures = {executor.submit(probe_audio, file_path): file_path for file_path in audio_files}
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Probing"):
+            file_path = futures[future]
+            try:
+                info = future.result()
+            except Exception as e:
+                failed.append((file_path, str(e)))
+                continue
+            
+            ext = os.path.splitext(file_path)[1].lower()
+            totals = by_extension.setdefault(ext, {"files": 0, "seconds": 0.0, "bytes": 0})
+            totals["files"] += 1
+            totals["seconds"] += info["duration_seconds"]
+            totals["bytes"] += os.path.getsize(file_path)
+            sources[info["source"]] += 1
+            
+            if result_file_name(file_path, folder_path) not in already_transcribed:
+                pending_files += 1
+                pending_seconds += info["duration_seconds"]
+    
+    total_seconds = sum(totals["seconds"] for totals in by_extension.values())
+    logger.info(f"Inventory of {folder_path} ({len(audio_files)} files, probed in {time.monotonic() - started:.1f}s)")
+    for ext, totals in sorted(by_extension.items()):
+        logger.info(f"  {ext}: {totals['files']} files, {totals['seconds'] / 3600:.2f} hours, {format_bytes(totals['bytes'])}")
+    logger.info(f"Durations read from headers: {sources['header']}, by decoding: {sources['decode']}")
+    logger.info(f"Total audio: {total_seconds / 3600:.2f} hours")
+    logger.info(f"Not yet transcribed: {pending_files} files, {pending_seconds / 3600:.2f} hours")
+    logger.info(f"Estimated cost of remaining run: {pending_seconds / 3600 * cost_per_hour:.2f} (at {cost_per_hour} per audio hour)")
+    for file_path, error in failed:
+        logger.error(f"Could not probe {file_path}: {error}")
+    
+    return 0
+
+def run_redrive(manifest, include_permanent=False, list_only=False, leases=None):
+    """List or re-queue the files in the manifest's dead-letter list."""
+    states = ("dead_letter", "failed") if include_permanent else ("dead_letter",)
+    failures = manifest.failures(states)
+    for path, state, error, updated_at in failures:
+        logger.info(f"{state}: {path} ({updated_at}) - {error}")
+    
+    if list_only:
+        logger.info(f"{len(failures)} files in {', '.join(states)}")
+    else:
+        if leases is not None:
+            leases.forget([path for path, _, _, _ in failures])
+        count = manifest.redrive(states)
+        logger.info(f"Re-queued {count} files; they will be transcribed on the next run")
+    return 0
+
+def run_dry_run(folder_path, manifest, scheduler, recursive=True, cost_per_hour=0.40):
+    """List the files a run would transcribe, in order, without sending or recording anything."""
+    count = 0
+    for file_path in scheduler.schedule(manifest.iter_pending(iter_audio_files(folder_path, recursive=recursive))):
+        logger.info(f"Would transcribe: {file_path}")
+        count += 1
+    logger.info(f"{count} files would be transcribed from {folder_path}")
+    for line in scheduler.summary(cost_per_hour):
+        logger.info(line)
+    return 0
+
+def run_status(manifest_path, store=None, journal_path=None):
+    """Report the file states in the manifest, the stored transcriptions and any unsaved journal entries."""
+    if not os.path.exists(manifest_path):
+        logger.info(f"No manifest at {manifest_path} yet")
+    else:
+        manifest = FileManifest(manifest_path)
+        try:
+            counts = manifest.counts()
+        finally:
+            manifest.close()
+        logger.info(f"Manifest {manifest_path}: {sum(counts.values())} files")
+        for state in ("pending", "in_progress") + FINISHED_STATES:
+            if counts.get(state):
+                logger.info(f"  {state}: {counts[state]}")
+    if store is not None:
+        logger.info(f"Result store {store.path}: {store.count()} transcriptions")
+    if journal_path and os.path.exists(journal_path):
+        with open(journal_path, "r", encoding="utf-8") as f:
+            entries = sum(1 for _ in f)
+        if entries:
+            logger.info(f"Journal {journal_path}: {entries} results not yet checkpointed (recovered on the next run)")
+    return 0
+
+def default_backup_set(output_csv, worker_id=None):
+    """Open the backups of a run's result store, as configured by BACKUP_* variables. None if disabled."""
+    backup_dir = os.getenv("BACKUP_DIR", os.path.join(os.path.dirname(output_csv), "backups"))  # Empty to disable
+    if not backup_dir:
+        return None
+    return BackupSet(
+        backup_dir,
+        f"{os.path.splitext(os.path.basename(output_csv))[0]}{worker_name_suffix(worker_id)}",
+        snapshot_every=int(os.getenv("BACKUP_SNAPSHOT_EVERY", "100")),  # Checkpoints between full snapshots
+        keep_snapshots=int(os.getenv("BACKUP_KEEP_SNAPSHOTS", "3")),  # Snapshots (and their deltas) retained
+    )
 
-def main():
-    """Main function to transcribe audio files and save results to CSV."""
-    global start_time, total_files, current_file_index, current_batch, total_batches, progress_thread, is_exiting
+def run_restore(backups, output_csv, until=None, list_only=False):
+    """List the backups, or rebuild a results CSV from the newest snapshot and its deltas."""
+    if list_only:
+        for sequence, timestamp, kind, path in backups.entries():
+            logger.info(f"{sequence:8d}  {timestamp}  {kind:8s}  {format_bytes(os.path.getsize(path))}  {path}")
+        return 0
+    
+    # Upsert through a scratch SQLite store so later rows replace earlier ones without holding everything in memory
+    scratch_path = f"{output_csv}.restore.sqlite3"
+    scratch = SQLiteResultStore(scratch_path)
+    try:
+        rows = []
+        for row in backups.restore_rows(until):
+            rows.append(row)
+            if len(rows) >= 1000:
+                scratch.upsert(rows)
+                rows = []
+        scratch.upsert(rows)
+        export_csv(scratch, output_csv)
+    finally:
+        scratch.close()
+        for path in (scratch_path, f"{scratch_path}-wal", f"{scratch_path}-shm"):
+            if os.path.exists(path):
+                os.remove(path)
+    return 0
+
+def parse_args(argv=None):
+    """Parse the command line. Running without a command starts a transcription run."""
+    parser = argparse.ArgumentParser(description="Transcribe call recordings with the ElevenLabs API.")
+    subparsers = parser.add_subparsers(dest="command")
+    
+    run_parser = subparsers.add_parser("run", help="Transcribe new files in INPUT_FOLDER (default)")
+    run_parser.add_argument("--dry-run", action="store_true",
+                            help="Only list the files a run would transcribe, in order, within the budget")
+    subparsers.add_parser(
+        "watch", help="Transcribe new files in INPUT_FOLDER, then keep transcribing recordings as they arrive"
+    )
+    
+    subparsers.add_parser(
+        "status", help="Show how many files are done, failed or pending, and what is stored"
+    )
+    
+    inventory_parser = subparsers.add_parser(
+        "inventory", help="Estimate audio hours and cost of INPUT_FOLDER from file headers"
+    )
+    inventory_parser.add_argument("--workers", type=int, default=8, help="Files probed in parallel")
+    
+    export_parser = subparsers.add_parser(
+        "export-csv", help="Write all stored transcriptions to a CSV in the original output layout"
+    )
+    export_parser.add_argument("--output", help="CSV file to write (default: OUTPUT_CSV)")
+    export_parser.add_argument("--all-workers", action="store_true",
+                               help="Merge the result stores of every worker of a multi-host run")
+    
+    redrive_parser = subparsers.add_parser(
+        "redrive", help="Re-queue dead-lettered files so the next run transcribes them again"
+    )
+    redrive_parser.add_argument("--include-permanent", action="store_true",
+                                help="Also re-queue files that failed with permanent errors")
+    redrive_parser.add_argument("--list", action="store_true", help="Only list the files, don't re-queue them")
+    
+    restore_parser = subparsers.add_parser(
+        "restore", help="Rebuild a results CSV from the incremental backups in BACKUP_DIR"
+    )
+    restore_parser.add_argument("--output", help="CSV file to write (default: OUTPUT_CSV stem + _restored.csv)")
+    restore_parser.add_argument("--until", help="Restore the state as of this time (YYYY-mm-ddTHH:MM:SS)")
+    restore_parser.add_argument("--list", action="store_true", help="Only list the available backups")
+    
+    return parser.parse_args(argv)
+
+def main(watch=False):
+    """Main function to transcribe audio files and save results to CSV.
+    
+    With watch, keep running after the backlog and transcribe new recordings as they land.
+    """
+    global start_time, total_files, current_batch, total_batches, progress_thread, is_exiting, metrics, current_run
+    
+    # The run's limiter, stop flag and counters; the signal handlers stop it
+    run = current_run = PipelineRun()
     
     # Set up signal handlers for graceful exit
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
     
     # Configuration
-    INPUT_FOLDER = os.getenv("INPUT_FOLDER", "/Users/namanagarwal/voice call/clips")
-    OUTPUT_CSV = os.getenv("OUTPUT_CSV", "/Users/namanagarwal/voice call/call_transcriptions.csv")
+    config = storage_config()  # INPUT_FOLDER, OUTPUT_CSV, RESULT_STORE*, LEASE_DIR, WORKER_ID, MANIFEST_PATH, JOURNAL_PATH
+    INPUT_FOLDER = config["input_folder"]
+    OUTPUT_CSV = config["output_csv"]
+    LEASE_DIR = config["lease_dir"]
+    LEASE_TTL_SECONDS = float(os.getenv("LEASE_TTL_SECONDS", "300"))  # Leases not renewed this long are reclaimed
+    WORKER_ID = config["worker_id"]
+    MANIFEST_PATH = config["manifest_path"]
+    MAX_RETRIES = int(os.getenv("MAX_RETRIES", "5"))  # Retries for rate limits, timeouts and server errors
+    RETRY_BASE_SECONDS = float(os.getenv("RETRY_BASE_SECONDS", "2"))  # First backoff step, doubled per retry
+    RETRY_MAX_SECONDS = float(os.getenv("RETRY_MAX_SECONDS", "120"))  # Longest backoff between retries
+    CHUNK_LONG_CALLS = os.getenv("CHUNK_LONG_CALLS", "false").lower() in ("1", "true", "yes")  # Split long calls into chunks
+    CHUNK_MAX_SECONDS = float(os.getenv("CHUNK_MAX_SECONDS", "600"))  # Longest chunk sent in one request
+    CHUNK_OVERLAP_SECONDS = float(os.getenv("CHUNK_OVERLAP_SECONDS", "4"))  # Audio shared by neighbouring chunks
+    COST_PER_AUDIO_HOUR = float(os.getenv("COST_PER_AUDIO_HOUR", "0.40"))  # SCHEDULE_POLICY and budgets: see default_work_scheduler
+    RICH_OUTPUT_DIR = os.getenv("RICH_OUTPUT_DIR")  # Parquet calls and segments tables (needs pyarrow)
+    PREPROCESS_AUDIO = os.getenv("PREPROCESS_AUDIO", "false").lower() in ("1", "true", "yes")  # Downmix, resample and trim before upload
+    PREPROCESS = dict(
+        PREPROCESS_DEFAULTS,
+        sample_rate=int(os.getenv("PREPROCESS_SAMPLE_RATE", str(PREPROCESS_DEFAULTS["sample_rate"]))),  # 0 keeps the original rate
+        trim_silence=os.getenv("TRIM_SILENCE", "true").lower() in ("1", "true", "yes"),
+        silence_threshold_db=float(os.getenv("SILENCE_THRESHOLD_DB", str(PREPROCESS_DEFAULTS["silence_threshold_db"]))),
+        min_silence_seconds=float(os.getenv("MIN_SILENCE_SECONDS", str(PREPROCESS_DEFAULTS["min_silence_seconds"]))),
+        keep_silence_seconds=float(os.getenv("KEEP_SILENCE_SECONDS", str(PREPROCESS_DEFAULTS["keep_silence_seconds"]))),
+    ) if PREPROCESS_AUDIO else None
+    RESPONSE_CACHE_DIR = os.getenv("RESPONSE_CACHE_DIR", f"{os.path.splitext(OUTPUT_CSV)[0]}_response_cache")  # Empty to disable
     LANGUAGE_CODE = os.getenv("LANGUAGE_CODE", "hin")  # Default to Hindi
-    BATCH_SIZE = int(os.getenv("BATCH_SIZE", "10"))  # Process in batches to save progress frequently
+    BATCH_SIZE = int(os.getenv("BATCH_SIZE", "50"))  # Results per checkpoint; the journal covers the files in between
+    JOURNAL_FSYNC_SECONDS = float(os.getenv("JOURNAL_FSYNC_SECONDS", "1"))  # Most results a crash can lose (0 = fsync each)
+    MAX_CONCURRENCY = int(os.getenv("MAX_CONCURRENCY", "4"))  # Most transcription requests kept in flight
+    ADAPTIVE_CONCURRENCY = os.getenv("ADAPTIVE_CONCURRENCY", "true").lower() in ("1", "true", "yes")  # Tune the limit from 429s and latency
+    INITIAL_CONCURRENCY = int(os.getenv("INITIAL_CONCURRENCY", str(max(1, MAX_CONCURRENCY // 2))))  # Starting limit when adaptive
+    MIN_CONCURRENCY = int(os.getenv("MIN_CONCURRENCY", "1"))  # Lowest limit when adaptive
+    DECODE_WORKERS = int(os.getenv("DECODE_WORKERS", str(os.cpu_count() or 1)))  # Decode processes (0 = decode on upload threads)
+    MAX_PREPARED = int(os.getenv("MAX_PREPARED", str(MAX_CONCURRENCY * 2)))  # Decoded payloads held in memory
+    MAX_PREPARED_MB = float(os.getenv("MAX_PREPARED_MB", "512"))  # Memory cap for decoded payloads
+    PAYLOAD_STRATEGY = os.getenv("PAYLOAD_STRATEGY", "passthrough")  # wav, passthrough or compact
+    COMPACT_FORMAT = os.getenv("COMPACT_FORMAT", "flac")  # flac or opus, for the compact strategy
+    SCAN_RECURSIVE = os.getenv("SCAN_RECURSIVE", "true").lower() in ("1", "true", "yes")  # Include subfolders of INPUT_FOLDER
+    WATCH_BACKEND = os.getenv("WATCH_BACKEND", "auto")  # auto, inotify or poll
+    WATCH_SETTLE_SECONDS = float(os.getenv("WATCH_SETTLE_SECONDS", "10"))  # A new file must stop growing this long
+    WATCH_POLL_SECONDS = float(os.getenv("WATCH_POLL_SECONDS", "30"))  # Rescan interval without inotify
+    EVENTS_FILE = os.getenv("EVENTS_FILE", str(logs_dir / f"transcription_events_{session_id}.jsonl"))  # Per-file JSON timings, empty to disable
+    METRICS_FILE = os.getenv("METRICS_FILE")  # Prometheus text file, e.g. for node_exporter's textfile collector
+    METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))  # Serve /metrics on this port (0 = off)
+    METRICS_INTERVAL_SECONDS = float(os.getenv("METRICS_INTERVAL_SECONDS", "15"))  # How often METRICS_FILE is rewritten
     
     # Create a session identifier for this run
     logger.info(f"Starting transcription process - Session ID: {session_id}")
     
+    # Collect stage timings and throughput for the events file and metrics exports
+    metrics = run.metrics = PipelineMetrics(EVENTS_FILE or None)
+    if METRICS_FILE:
+        metrics.start_writer(METRICS_FILE, METRICS_INTERVAL_SECONDS)
+    if METRICS_PORT:
+        metrics.serve(METRICS_PORT)
+    
     # Start progress tracking thread
     progress_thread = threading.Thread(target=print_progress, daemon=True)
     progress_thread.start()
     
+    store = None
+    manifest = None
+    leases = None
+    watcher = None
+    journal = None
+    backups = None
+    rich_output = None
+    scheduler = None
     try:
+        if PAYLOAD_STRATEGY not in PAYLOAD_STRATEGIES:
+            logger.error(f"Unknown PAYLOAD_STRATEGY '{PAYLOAD_STRATEGY}'. Expected one of: {', '.join(PAYLOAD_STRATEGIES)}")
+            return
+        try:
+            scheduler = default_work_scheduler()
+        except ValueError as e:
+            logger.error(f"Invalid schedule settings: {str(e)}")
+            return
+        
         # Setup environment and client
         client = setup_environment()
         if not client:
             logger.error("Failed to initialize ElevenLabs client. Exiting.")
             return
         
-        # Get audio files
-        audio_files = get_audio_files(INPUT_FOLDER)
-        if not audio_files:
-            logger.warning(f"No audio files found in {INPUT_FOLDER}")
+        if not os.path.isdir(INPUT_FOLDER):
+            logger.error(f"Input folder {INPUT_FOLDER} not found")
             return
         
-        # Get already transcribed files
-        already_transcribed = get_already_transcribed_files(OUTPUT_CSV)
+        # Open the result store and the manifest of per-file state
+        store = open_result_store(config["result_store"], OUTPUT_CSV, config["result_store_path"], WORKER_ID)
+        manifest = FileManifest(MANIFEST_PATH)
+        
+        # Files are streamed from the scan into the pipeline, so work starts while the folder is still being walked
+        if watch:
+            watcher = FolderWatcher(INPUT_FOLDER, settle_seconds=WATCH_SETTLE_SECONDS,
+                                    poll_seconds=WATCH_POLL_SECONDS, backend=WATCH_BACKEND)
+            audio_files = itertools.chain(watcher.initial_files(), watcher.new_files())
+        else:
+            audio_files = iter_audio_files(INPUT_FOLDER, recursive=SCAN_RECURSIVE)
+        if manifest.is_empty():
+            # First run: the scan is needed twice, to seed the manifest and to find the work
+            audio_files = list(watcher.initial_files()) if watch else list(audio_files)
+            manifest.seed(audio_files, store.file_names(), INPUT_FOLDER)
+            if watch:
+                audio_files = itertools.chain(audio_files, watcher.new_files())
+        
+        # Commit results that a crashed or killed run journaled but never checkpointed
+        journal = ResultJournal(
+            config["journal_path"],
+            JOURNAL_FSYNC_SECONDS,
+        )
+        backups = default_backup_set(OUTPUT_CSV, WORKER_ID)
+        if RICH_OUTPUT_DIR:
+            rich_output = ParquetOutput(RICH_OUTPUT_DIR, f"part-{session_id}{worker_name_suffix(WORKER_ID)}")
+        recovered = journal.replay(store, manifest)
+        if recovered and backups is not None:
+            backups.record(recovered, store)
+        if recovered and rich_output is not None:
+            rich_output.write_batch(recovered, 0)
+        logger.info(f"Manifest {MANIFEST_PATH}: {manifest.counts()}")
         
         # Filter out files that have already been transcribed
-        files_to_transcribe = [f for f in audio_files if os.path.basename(f) not in already_transcribed]
-        logger.info(f"Found {len(files_to_transcribe)} new files to transcribe")
+        files_to_transcribe = manifest.iter_pending(audio_files)
+        if LEASE_DIR:
+            leases = LeaseDirectory(LEASE_DIR, INPUT_FOLDER, WORKER_ID, LEASE_TTL_SECONDS)
+            files_to_transcribe = leases.unfinished(files_to_transcribe)
+            leases.start_heartbeat()
+            logger.info(f"Worker {WORKER_ID} sharing work through {LEASE_DIR} (lease TTL {LEASE_TTL_SECONDS:.0f}s)")
         
-        if not files_to_transcribe:
-            logger.info("No new files to transcribe")
-            return
+        # The scheduler orders the work and holds it to the budget and deadline, reusing the scan's file stats
+        scheduler.stats = manifest.stats
         
-        # Set global counters for progress tracking
-        total_files = len(files_to_transcribe)
-        current_file_index = 0
-        total_batches = (total_files - 1) // BATCH_SIZE + 1
+        # Progress counters grow as the scan finds work
+        total_files = 0
+        total_batches = 0
         
         # Create session log file to track progress
-        with open(session_log_file, 'w') as f:
+        with session_log as f:
             f.write(f"Session started at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-            f.write(f"Files to transcribe: {len(files_to_transcribe)}\n")
-            f.write(f"Total batches: {total_batches} (batch size: {BATCH_SIZE})\n\n")
+            f.write(f"Input folder: {INPUT_FOLDER}{' (watching for new files)' if watch else ''}\n")
+            f.write(f"Batch size: {BATCH_SIZE}\n")
+            f.write(f"Max concurrency: {MAX_CONCURRENCY} (decode workers: {DECODE_WORKERS})\n")
+            f.write(f"Payload strategy: {PAYLOAD_STRATEGY}\n\n")
         
         # Start timing
         start_time = datetime.now()
@@ -387,71 +3527,147 @@ def main():
         total_processed = 0
         total_successful = 0
         total_failed = 0
+        preprocessed_seconds = 0.0  # original audio of files sent preprocessed
+        sent_seconds = 0.0  # and the part of it that was uploaded
         
-        for i in range(0, len(files_to_transcribe), BATCH_SIZE):
-            # Check if exit was requested
-            if is_exiting:
-                logger.info("Exit requested. Stopping after current batch.")
-                break
-                
-            batch_files = files_to_transcribe[i:i+BATCH_SIZE]
-            current_batch = i//BATCH_SIZE + 1
-            logger.info(f"Processing batch {current_batch}/{total_batches} ({len(batch_files)} files)")
-            
-            # Process batch
-            batch_results = []
-            batch_successful = 0
-            batch_failed = 0
-            
-            for file_path in tqdm(batch_files, desc=f"Batch {current_batch}/{total_batches}"):
-                # Check if exit was requested during processing
-                if is_exiting:
-                    logger.info("Exit requested. Finishing current file and saving progress.")
-                    # Continue with current file to complete it, then break the loop
-                
-                try:
-                    result = transcribe_audio(client, file_path, LANGUAGE_CODE)
-                    if result:
-                        batch_results.append(result)
-                        if "ERROR:" not in result["transcription"]:
-                            batch_successful += 1
-                            # Log success
-                            with open(session_log_file, 'a') as f:
-                                f.write(f"SUCCESS: {os.path.basename(file_path)}\n")
-                        else:
-                            batch_failed += 1
-                            # Log failure
-                            with open(session_log_file, 'a') as f:
-                                f.write(f"FAILED: {os.path.basename(file_path)} - {result['transcription']}\n")
-                except Exception as e:
-                    logger.error(f"Unhandled exception processing {file_path}: {str(e)}")
-                    batch_failed += 1
-                    # Log exception
-                    with open(session_log_file, 'a') as f:
-                        f.write(f"EXCEPTION: {os.path.basename(file_path)} - {str(e)}\n")
-                
-                # If exit requested after processing current file, break
-                if is_exiting and total_processed < total_files - 1:
-                    break
+        # Results are checkpointed every BATCH_SIZE completions, in completion order
+        batch_results = []
+        batch_outcomes = {}  # file path -> (manifest state, error)
+        batch_hashes = {}  # file path -> content hash
+        batch_successful = 0
+        batch_failed = 0
+        unsaved_batches = False  # a checkpoint failed, so the journal must be kept for the next start
+        current_batch = 1
+        logger.info(f"Transcribing new files in {INPUT_FOLDER} with up to {MAX_CONCURRENCY} concurrent requests")
+        
+        def finish_batch():
+            nonlocal batch_results, batch_outcomes, batch_hashes, batch_successful, batch_failed, total_successful, total_failed
+            nonlocal unsaved_batches
+            global current_batch
             
-            # Update totals
-            total_processed += len(batch_files)
             total_successful += batch_successful
             total_failed += batch_failed
             
-            # Save batch results
-            if batch_results or is_exiting:
+            # Save batch results, then record the files as finished once they are stored
+            saved = True
+            persist_started = time.perf_counter()
+            if batch_results or run.stopping:
                 logger.info(f"Saving batch results: {len(batch_results)} transcriptions")
-                save_checkpoint(batch_results, OUTPUT_CSV, current_batch, force=is_exiting)
+                saved = save_checkpoint(
+                    batch_results, store, current_batch, force=run.stopping, backups=backups, rich_output=rich_output,
+                )
+            if saved:
+                errors = {path: error for path, (_, error) in batch_outcomes.items()}
+                for state in ("done", "failed", "dead_letter"):
+                    paths = [path for path, (outcome, _) in batch_outcomes.items() if outcome == state]
+                    manifest.mark(paths, state, errors, batch_hashes)
+            manifest.commit()
+            unsaved_batches = unsaved_batches or not saved
+            if not unsaved_batches:
+                journal.truncate()
+            metrics.persisted(current_batch, len(batch_results), time.perf_counter() - persist_started)
+            if saved and leases is not None:
+                # Only now is it safe for other workers to skip these files
+                leases.release(list(batch_outcomes), finished=True)
             
             # Log batch summary
             logger.info(f"Batch {current_batch} complete: {batch_successful} successful, {batch_failed} failed")
-            with open(session_log_file, 'a') as f:
+            with session_log as f:
                 f.write(f"\nBatch {current_batch} summary: {batch_successful} successful, {batch_failed} failed\n\n")
+            session_log.flush()
             
-            # If exiting, don't continue to next batch
-            if is_exiting:
-                break
+            batch_results = []
+            batch_outcomes = {}
+            batch_hashes = {}
+            batch_successful = 0
+            batch_failed = 0
+            current_batch += 1
+        
+        from tqdm import tqdm
+        with tqdm(total=0, desc="Transcribing") as progress_bar:
+            def discovered(paths):
+                global total_files, total_batches
+                for path in paths:
+                    if path is not NO_FILE_YET:
+                        total_files += 1
+                        total_batches = (total_files - 1) // BATCH_SIZE + 1
+                        metrics.discovered(manifest.stats.get(path, (0, None))[0])
+                        progress_bar.total = total_files
+                        progress_bar.refresh()
+                    yield path
+            
+            # With leases, each file is claimed just before it is started, so workers split the folder between them
+            work = scheduler.schedule(files_to_transcribe, claim=leases.claim if leases is not None else None)
+            for file_path, result, error in run_transcription_pipeline(
+                client, discovered(work), LANGUAGE_CODE, MAX_CONCURRENCY,
+                decode_workers=DECODE_WORKERS,
+                max_prepared=MAX_PREPARED,
+                max_prepared_bytes=int(MAX_PREPARED_MB * 1024 * 1024),
+                payload_strategy=PAYLOAD_STRATEGY,
+                compact_format=COMPACT_FORMAT,
+                on_start=lambda path: manifest.mark([path], "in_progress"),
+                known_hashes=manifest.hashes,
+                cache_dir=RESPONSE_CACHE_DIR or None,
+                chunk_seconds=CHUNK_MAX_SECONDS if CHUNK_LONG_CALLS else None,
+                chunk_overlap_seconds=CHUNK_OVERLAP_SECONDS,
+                max_retries=MAX_RETRIES,
+                retry_base_seconds=RETRY_BASE_SECONDS,
+                retry_max_seconds=RETRY_MAX_SECONDS,
+                adaptive_concurrency=ADAPTIVE_CONCURRENCY,
+                initial_concurrency=INITIAL_CONCURRENCY,
+                min_concurrency=MIN_CONCURRENCY,
+                preprocess=PREPROCESS,
+                input_folder=INPUT_FOLDER,
+                run=run,
+            ):
+                total_processed += 1
+                progress_bar.update(1)
+                
+                if error is not None:
+                    # Failures only go to the manifest, so they are never mistaken for transcripts
+                    kind, _ = classify_error(error)
+                    state = "dead_letter" if kind == "retryable" else "failed"
+                    batch_failed += 1
+                    batch_outcomes[file_path] = (state, f"{type(error).__name__}: {str(error)}")
+                    journal.append(file_path, state, batch_outcomes[file_path][1])
+                    # Log failure
+                    with session_log as f:
+                        f.write(f"FAILED ({kind}): {os.path.basename(file_path)} - {str(error)}\n")
+                elif result:
+                    batch_results.append(result)
+                    if result.get("trimmed_duration_seconds") is not None:
+                        preprocessed_seconds += result["duration_seconds"]
+                        sent_seconds += result["trimmed_duration_seconds"]
+                    if result.get("content_hash"):
+                        batch_hashes[file_path] = result["content_hash"]
+                    batch_successful += 1
+                    batch_outcomes[file_path] = ("done", None)
+                    journal.append(file_path, "done", content_hash=result.get("content_hash"), result=result)
+                    # Log success
+                    with session_log as f:
+                        f.write(f"SUCCESS: {os.path.basename(file_path)}\n")
+                
+                # Once a watch has caught up with the backlog, new files are saved as soon as they are done
+                if batch_successful + batch_failed >= BATCH_SIZE or (watcher is not None and watcher.caught_up):
+                    finish_batch()
+        
+        # Save the final partial batch (always checkpoint on interrupt)
+        if batch_successful + batch_failed > 0 or run.stopping:
+            if run.stopping:
+                logger.info("Exit requested. In-flight transcriptions drained; saving progress.")
+            finish_batch()
+        
+        for line in scheduler.summary(COST_PER_AUDIO_HOUR):
+            logger.info(line)
+        if scheduler.deferred:
+            with session_log as f:
+                f.write(f"\nDeferred to the next run ({scheduler.stop_reason}):\n")
+                for path in scheduler.deferred:
+                    f.write(f"DEFERRED: {path}\n")
+        
+        if total_files == 0:
+            logger.info("No new files to transcribe")
+            return
         
         # Calculate elapsed time
         elapsed = datetime.now() - start_time
@@ -463,20 +3679,42 @@ def main():
         logger.info(f"Successfully transcribed: {total_successful}")
         logger.info(f"Failed transcriptions: {total_failed}")
         logger.info(f"Total time: {elapsed_str}")
+        for strategy, stats in run.upload_stats.items():
+            logger.info(f"Uploaded ({strategy}): {format_bytes(stats['bytes'])} across {stats['files']} files")
+        logger.info(f"Served from response cache: {run.cache_hits}")
+        if preprocessed_seconds:
+            saved_summary = (
+                f"Preprocessing trimmed {(preprocessed_seconds - sent_seconds) / 60:.1f} of "
+                f"{preprocessed_seconds / 60:.1f} audio minutes "
+                f"({(preprocessed_seconds - sent_seconds) / preprocessed_seconds * 100:.1f}% saved)"
+            )
+            logger.info(saved_summary)
+        for line in client.summary() + metrics.summary():
+            logger.info(line)
         
-        with open(session_log_file, 'a') as f:
+        with session_log as f:
             f.write(f"\n=== FINAL SUMMARY ===\n")
             f.write(f"Session completed at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
             f.write(f"Total files processed: {total_processed}/{total_files}")
-            if is_exiting:
+            if run.stopping:
                 f.write(" (PARTIAL - Process was interrupted)")
             f.write("\n")
             f.write(f"Successfully transcribed: {total_successful}\n")
             f.write(f"Failed transcriptions: {total_failed}\n")
             f.write(f"Total time: {elapsed_str}\n")
+            for strategy, stats in run.upload_stats.items():
+                f.write(f"Uploaded ({strategy}): {format_bytes(stats['bytes'])} across {stats['files']} files\n")
+            f.write(f"Served from response cache: {run.cache_hits}\n")
+            if preprocessed_seconds:
+                f.write(f"{saved_summary}\n")
+            for line in client.summary() + metrics.summary():
+                f.write(f"{line}\n")
         
         if total_failed > 0:
             logger.warning(f"Some transcriptions failed. See {session_log_file} for details.")
+            logger.warning("Files that kept failing with retryable errors can be re-queued with the 'redrive' command.")
+        elif scheduler.deferred:
+            logger.info("Run stopped at its budget or deadline; deferred files are left for the next run.")
         elif total_processed == total_files:
             logger.info("All transcriptions completed successfully.")
         else:
@@ -489,7 +3727,7 @@ def main():
         with open(f"emergency_log_{session_id}.txt", 'w') as f:
             f.write(f"EMERGENCY LOG - CRITICAL ERROR at {datetime.now()}\n")
             f.write(f"Error: {str(e)}\n")
-            f.write(f"Files processed: {current_file_index}/{total_files}\n")
+            f.write(f"Files processed: {run.files_finished}/{total_files}\n")
             f.write(f"Current batch: {current_batch}/{total_batches}\n")
         
         return 1
@@ -498,14 +3736,103 @@ def main():
         is_exiting = True
         if progress_thread and progress_thread.is_alive():
             progress_thread.join(timeout=2)
+        
+        if watcher is not None:
+            watcher.close()
+        if metrics is not None:
+            metrics.close(METRICS_FILE)
+        if journal is not None:
+            journal.close()
+        session_log.close()
+        # Hand back leases on files this worker claimed but did not finish
+        if leases is not None:
+            leases.stop()
+        if store is not None:
+            store.close()
+        if manifest is not None:
+            manifest.close()
             
         logger.info("Transcription process completed. Exit successful.")
         return 0
 
 if __name__ == "__main__":
     exit_code = 1
+    setup_logging()
     try:
-        exit_code = main()
+        args = parse_args()
+        config = storage_config()
+        if args.command == "run" and args.dry_run:
+            input_folder = config["input_folder"]
+            manifest_path = config["manifest_path"]
+            recursive = os.getenv("SCAN_RECURSIVE", "true").lower() in ("1", "true", "yes")
+            # Nothing is written: before the first run the manifest is built in memory from the stored results
+            manifest = FileManifest(manifest_path if os.path.exists(manifest_path) else ":memory:")
+            try:
+                if manifest.is_empty():
+                    manifest.seed(iter_audio_files(input_folder, recursive=recursive), stored_file_names(config), input_folder)
+                exit_code = run_dry_run(
+                    input_folder, manifest, default_work_scheduler(manifest.stats), recursive,
+                    cost_per_hour=float(os.getenv("COST_PER_AUDIO_HOUR", "0.40")),
+                )
+            finally:
+                manifest.close()
+        elif args.command == "status":
+            store_path = config["store_path"]
+            store = RESULT_STORES[config["result_store"]][0](store_path) if os.path.exists(store_path) else None
+            try:
+                exit_code = run_status(config["manifest_path"], store, config["journal_path"])
+            finally:
+                if store is not None:
+                    store.close()
+        elif args.command == "export-csv" and args.all_workers:
+            output_csv = config["output_csv"]
+            result_store = config["result_store"]
+            stores = [open_result_store(result_store, output_csv, path)
+                      for path in worker_store_paths(result_store, output_csv)]
+            try:
+                if not stores:
+                    logger.error(f"No worker result stores found next to {output_csv}")
+                else:
+                    export_csv(stores, args.output or output_csv)
+                    exit_code = 0
+            finally:
+                for store in stores:
+                    store.close()
+        elif args.command == "inventory":
+            exit_code = run_inventory(
+                config["input_folder"],
+                stored_file_names(config),
+                probe_workers=args.workers,
+                cost_per_hour=float(os.getenv("COST_PER_AUDIO_HOUR", "0.40")),
+            )
+        elif args.command == "export-csv":
+            output_csv = config["output_csv"]
+            store = open_result_store(config["result_store"], output_csv, config["result_store_path"], config["worker_id"])
+            try:
+                export_csv(store, args.output or output_csv)
+                exit_code = 0
+            finally:
+                store.close()
+        elif args.command == "restore":
+            output_csv = config["output_csv"]
+            backups = default_backup_set(output_csv, config["worker_id"])
+            if backups is None:
+                logger.error("Backups are disabled (BACKUP_DIR is empty)")
+            else:
+                until = datetime.fromisoformat(args.until).strftime('%Y%m%dT%H%M%S') if args.until else None
+                exit_code = run_restore(
+                    backups, args.output or f"{os.path.splitext(output_csv)[0]}_restored.csv", until, args.list,
+                )
+        elif args.command == "redrive":
+            manifest = FileManifest(config["manifest_path"])
+            leases = (LeaseDirectory(config["lease_dir"], config["input_folder"], config["worker_id"])
+                      if config["lease_dir"] else None)
+            try:
+                exit_code = run_redrive(manifest, args.include_permanent, args.list, leases)
+            finally:
+                manifest.close()
+        else:
+            exit_code = main(watch=args.command == "watch")
     except Exception as e:
         logger.critical(f"Unhandled exception in script: {str(e)}", exc_info=True)
     finally: